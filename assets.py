@@ -0,0 +1,409 @@
+"""Build static asset bundles for production.
+
+Stylesheets and scripts of base.html are joined into one bundle each. CSS
+rules of Bootstrap and Font Awesome whose classes don't appear in templates
+or scripts are left out, CSS and JS are minified, and bundles and the fonts
+they use are written to static/build/ with a hash of their content in the
+file name. app.yaml serves static/build/ with year long expiration, since a
+changed file gets a new name.
+
+Bundles are built by running this module before deploying.
+
+    $ python assets.py
+
+The manifest of built file names is written to assets.json, which render.py
+reads to give templates the URLs of bundles. Without it, templates link the
+source files one by one, using the minified copies which Bootstrap and Font
+Awesome ship except on the development server.
+"""
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(BASE_DIR, 'static')
+BUILD_DIR = os.path.join(STATIC_DIR, 'build')
+TEMPLATE_DIR = os.path.join(BASE_DIR, 'templates')
+MANIFEST_PATH = os.path.join(BASE_DIR, 'assets.json')
+STATIC_URL = '/static/'
+HASH_LENGTH = 10
+
+# Source files of each bundle, relative to static/, in order.
+BUNDLES = {
+    'site.css': ['css/bootstrap.css',
+                 'font-awesome/css/font-awesome.css',
+                 'css/simple-blog-template.css',
+                 'css/style.css'],
+    'site.js': ['js/jquery.js',
+                'js/bootstrap.js',
+                'js/main.js'],
+}
+# Stylesheets whose rules are dropped unless their classes are used.
+SUBSET_SOURCES = frozenset(['css/bootstrap.css',
+                            'font-awesome/css/font-awesome.css'])
+# At-rules which hold rules, rather than declarations.
+NESTED_AT_RULES = ('@media', '@supports', '@document')
+
+WORD_RE = re.compile(r'[\w-]+')
+CLASS_RE = re.compile(r'\.(-?[_a-zA-Z][\w-]*)')
+ATTRIBUTE_RE = re.compile(r'\[[^\]]*\]')
+URL_RE = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+STRING_RE = re.compile(r'''("(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')''')
+SPACE_RE = re.compile(r'\s+')
+PUNCTUATION_SPACE_RE = re.compile(r'\s*([{};,>])\s*')
+COLON_SPACE_RE = re.compile(r'\s*:\s*')
+
+_manifest = None
+_minified_urls = {}
+
+def read(path):
+    """Return text of the file.
+    """
+    with io.open(path, encoding='utf-8') as source:
+        return source.read()
+
+def used_words():
+    """Return words of templates and scripts, which class names are among.
+
+    Scripts are included since they add classes like 'in' and 'open'.
+
+    Returns:
+        set: Words.
+    """
+    texts = [read(os.path.join(TEMPLATE_DIR, name))
+             for name in os.listdir(TEMPLATE_DIR)]
+    texts.extend(read(os.path.join(STATIC_DIR, path))
+                 for path in BUNDLES['site.js'])
+    return set(word for text in texts for word in WORD_RE.findall(text))
+
+def _skip_string(text, pos):
+    """Return position after the quoted string which starts at pos.
+    """
+    quote = text[pos]
+    pos += 1
+    while pos < len(text) and text[pos] != quote:
+        pos += 2 if text[pos] == '\\' else 1
+    return pos + 1
+
+def strip_comments(text):
+    """Remove comments from CSS, keeping /*! license comments.
+
+    Returns:
+        tuple: (CSS without comments, list of license comments).
+    """
+    pieces = []
+    licenses = []
+    pos = start = 0
+    while pos < len(text):
+        if text[pos] in '"\'':
+            pos = _skip_string(text, pos)
+        elif text.startswith('/*', pos):
+            end = text.find('*/', pos + 2)
+            end = len(text) if end < 0 else end + 2
+            if text.startswith('/*!', pos):
+                licenses.append(text[pos:end])
+            pieces.append(text[start:pos])
+            pos = start = end
+        else:
+            pos += 1
+    pieces.append(text[start:])
+    return ''.join(pieces), licenses
+
+def _block_end(text, pos):
+    """Return position of the brace which closes the block opened at pos.
+    """
+    depth = 0
+    while pos < len(text):
+        if text[pos] in '"\'':
+            pos = _skip_string(text, pos)
+            continue
+        if text[pos] == '{':
+            depth += 1
+        elif text[pos] == '}':
+            depth -= 1
+            if depth == 0:
+                return pos
+        pos += 1
+    return pos
+
+def parse_rules(text, pos=0):
+    """Parse CSS without comments into rules.
+
+    Each rule is a pair of its prelude and body. Body is a list of rules
+    for nested at-rules like @media, a string for other blocks, and None
+    for statements like @charset.
+
+    Returns:
+        tuple: (list of rules, position after them).
+    """
+    rules = []
+    start = pos
+    while pos < len(text):
+        char = text[pos]
+        if char in '"\'':
+            pos = _skip_string(text, pos)
+            continue
+
+        if char == '{':
+            prelude = text[start:pos].strip()
+            if prelude.startswith(NESTED_AT_RULES):
+                body, pos = parse_rules(text, pos + 1)
+            else:
+                end = _block_end(text, pos)
+                body = text[pos + 1:end]
+                pos = end + 1
+            rules.append((prelude, body))
+            start = pos
+            continue
+
+        if char == '}':
+            return rules, pos + 1
+        if char == ';' and text[start:pos].strip().startswith('@'):
+            rules.append((text[start:pos].strip(), None))
+            start = pos + 1
+        pos += 1
+    return rules, pos
+
+def _selector_used(selector, words):
+    """Check if every class of the selector is used.
+    """
+    selector = ATTRIBUTE_RE.sub('', selector)
+    return all(name in words for name in CLASS_RE.findall(selector))
+
+def subset_rules(rules, words):
+    """Drop selectors whose classes are not used, and rules left empty.
+
+    Args:
+        rules (list): Rules made by parse_rules.
+        words (set): Words which are used, see used_words().
+
+    Returns:
+        list: Rules which are used.
+    """
+    used = []
+    for prelude, body in rules:
+        if isinstance(body, list):
+            body = subset_rules(body, words)
+            if body:
+                used.append((prelude, body))
+        elif prelude.startswith('@'):
+            used.append((prelude, body))
+        else:
+            selectors = [selector for selector in prelude.split(',')
+                         if _selector_used(selector, words)]
+            if selectors:
+                used.append((','.join(selectors), body))
+    return used
+
+def _squeeze(text, colons=False):
+    """Remove whitespace which doesn't matter, leaving strings alone.
+
+    Args:
+        text (str): CSS to minify.
+        colons (bool): Remove whitespace around colons too, which is safe
+            for declarations but not for selectors.
+    """
+    pieces = STRING_RE.split(text)
+    for i in xrange(0, len(pieces), 2):
+        piece = PUNCTUATION_SPACE_RE.sub(r'\1', SPACE_RE.sub(' ', pieces[i]))
+        pieces[i] = COLON_SPACE_RE.sub(':', piece) if colons else piece
+    return ''.join(pieces).strip()
+
+def _squeeze_declarations(body):
+    """Minify declarations, or a block of rules like @keyframes has.
+    """
+    body = _squeeze(body, colons=True)
+    return body.replace(';}', '}').rstrip(';')
+
+def emit_rules(rules):
+    """Return minified CSS of the rules.
+    """
+    pieces = []
+    for prelude, body in rules:
+        if body is None:
+            pieces.append('%s;' % _squeeze(prelude))
+        elif isinstance(body, list):
+            pieces.append('%s{%s}' % (_squeeze(prelude), emit_rules(body)))
+        else:
+            pieces.append('%s{%s}' % (_squeeze(prelude),
+                                      _squeeze_declarations(body)))
+    return ''.join(pieces)
+
+def minify_js(text):
+    """Remove comment lines, indentation and blank lines of a script.
+
+    Only comments which start a line are removed, so it's safe for strings
+    and regular expressions which contain comment markers. Line breaks are
+    kept since statements may rely on them.
+    """
+    lines = []
+    in_comment = False
+    for line in text.splitlines():
+        line = line.strip()
+        if in_comment:
+            in_comment = '*/' not in line
+            if not in_comment and not line.endswith('*/'):
+                lines.append(line[line.index('*/') + 2:].strip())
+        elif line.startswith('//'):
+            continue
+        elif line.startswith('/*') and not line.startswith('/*!'):
+            in_comment = '*/' not in line[2:]
+            if not in_comment and not line.endswith('*/'):
+                lines.append(line[line.index('*/', 2) + 2:].strip())
+        elif line:
+            lines.append(line)
+    return '\n'.join(line for line in lines if line)
+
+def write_hashed(name, content):
+    """Write content to BUILD_DIR with a hash of it in the file name.
+
+    Args:
+        name (str): File name, e.g. site.css.
+        content (bytes): File content.
+
+    Returns:
+        str: URL of the written file.
+    """
+    digest = hashlib.md5(content).hexdigest()[:HASH_LENGTH]
+    root, ext = os.path.splitext(name)
+    hashed_name = '%s.%s%s' % (root, digest, ext)
+    with open(os.path.join(BUILD_DIR, hashed_name), 'wb') as output:
+        output.write(content)
+    return STATIC_URL + 'build/' + hashed_name
+
+def rewrite_urls(css, source, copied):
+    """Copy files which CSS refers to into BUILD_DIR and point CSS to them.
+
+    Args:
+        css (str): CSS of the source file.
+        source (str): Path of the source file relative to static/.
+        copied (dict): URL of copied file by its path, updated.
+
+    Returns:
+        str: CSS with rewritten URLs.
+    """
+    def replace(match):
+        """Return url() of the hashed copy of the file."""
+        url = match.group(2)
+        if url.startswith(('data:', '/', 'http:', 'https:')):
+            return match.group(0)
+
+        path = re.split(r'[?#]', url, 1)[0]
+        suffix = url[len(path):]
+        path = os.path.normpath(
+            os.path.join(STATIC_DIR, os.path.dirname(source), path))
+        if path not in copied:
+            with open(path, 'rb') as referred:
+                copied[path] = write_hashed(os.path.basename(path),
+                                            referred.read())
+        return "url('%s%s')" % (copied[path], suffix)
+
+    return URL_RE.sub(replace, css)
+
+def build_css(sources, words, copied):
+    """Return minified CSS of the sources.
+    """
+    pieces = []
+    for source in sources:
+        css, licenses = strip_comments(read(os.path.join(STATIC_DIR,
+                                                         source)))
+        rules = parse_rules(css)[0]
+        if source in SUBSET_SOURCES:
+            rules = subset_rules(rules, words)
+        pieces.extend(licenses)
+        pieces.append(rewrite_urls(emit_rules(rules), source, copied))
+    return '\n'.join(pieces)
+
+def minified_source(source):
+    """Return the minified copy the source is shipped with, if any.
+
+    Args:
+        source (str): Path relative to static/, e.g. js/bootstrap.js.
+
+    Returns:
+        str: Path of the .min file next to it, or source if there is none.
+    """
+    root, ext = os.path.splitext(source)
+    minified = '%s.min%s' % (root, ext)
+    if os.path.exists(os.path.join(STATIC_DIR, minified)):
+        return minified
+    return source
+
+def build_js(sources):
+    """Return minified JS of the sources.
+
+    Sources shipped with a .min.js file, like Bootstrap, use it as it is.
+    """
+    scripts = []
+    for source in sources:
+        minified = minified_source(source)
+        if minified != source:
+            scripts.append(read(os.path.join(STATIC_DIR, minified)))
+        else:
+            scripts.append(minify_js(read(os.path.join(STATIC_DIR,
+                                                       source))))
+    return '\n;'.join(scripts)
+
+def build():
+    """Build every bundle into BUILD_DIR and write the manifest.
+
+    Returns:
+        dict: URL of each built bundle by bundle name.
+    """
+    if os.path.isdir(BUILD_DIR):
+        shutil.rmtree(BUILD_DIR)
+    os.makedirs(BUILD_DIR)
+
+    words = used_words()
+    copied = {}
+    manifest = {}
+    for name, sources in sorted(BUNDLES.items()):
+        if name.endswith('.css'):
+            content = build_css(sources, words, copied)
+        else:
+            content = build_js(sources)
+        manifest[name] = write_hashed(name, content.encode('utf-8'))
+
+    with open(MANIFEST_PATH, 'w') as output:
+        json.dump(manifest, output, indent=2, sort_keys=True)
+    return manifest
+
+def load_manifest():
+    """Return URLs of built bundles, None if they are not built.
+    """
+    global _manifest # pylint: disable=global-statement
+    if _manifest is None and os.path.exists(MANIFEST_PATH):
+        with open(MANIFEST_PATH) as manifest_file:
+            _manifest = json.load(manifest_file)
+    return _manifest
+
+def asset_urls(name, built=True):
+    """Return URLs to link for the bundle.
+
+    Args:
+        name (str): Bundle name, e.g. site.css.
+        built (bool): Use the built bundle if it exists, or else minified
+            copies of source files. If False, link the source files as
+            they are, for the development server.
+
+    Returns:
+        list: URL of the built bundle, or URLs of its source files.
+    """
+    if not built:
+        return [STATIC_URL + source for source in BUNDLES[name]]
+
+    manifest = load_manifest()
+    if manifest and name in manifest:
+        return [manifest[name]]
+
+    if name not in _minified_urls:
+        _minified_urls[name] = [STATIC_URL + minified_source(source)
+                                for source in BUNDLES[name]]
+    return _minified_urls[name]
+
+if __name__ == '__main__':
+    for bundle, url in sorted(build().items()):
+        print('%s -> %s' % (bundle, url))
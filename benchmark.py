@@ -0,0 +1,539 @@
+"""Benchmark handlers in process against local datastore and memcache stubs.
+
+This module boots main.app on the App Engine testbed, seeds users, posts,
+comments and likes, and requests every route a number of times. For each
+route it reports latency percentiles, datastore and memcache RPCs and
+bytes rendered, and stores the results under benchmark_results/ named by
+git commit, so they can be compared between commits.
+
+    $ python benchmark.py --sdk ~/google_appengine
+    $ python benchmark.py --compare benchmark_results/a.json \\
+          benchmark_results/b.json
+
+Deferred tasks queued by a request run after it's measured. Admin job
+pages are requested with GET only, since their tasks go over every entity.
+"""
+import argparse
+import collections
+import datetime
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(BASE_DIR, 'benchmark_results')
+PASSWORD = 'benchmark'
+WORDS = ('datastore memcache template render cursor query index counter '
+         'shard cache request handler latency python jinja feed search '
+         'comment like post user blog page stream batch task').split()
+
+def setup_sdk(sdk_path):
+    """Put App Engine SDK and its bundled libraries on sys.path.
+
+    Args:
+        sdk_path (str): Directory of the SDK, which has dev_appserver.py.
+    """
+    sys.path.insert(0, sdk_path)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+
+
+class RpcCounter(object):
+    """Counter of API calls by service.
+
+    Attributes:
+        calls (Counter): The number of calls of each service.
+    """
+    def __init__(self):
+        self.calls = collections.Counter()
+
+    def reset(self):
+        """Forget calls counted so far.
+        """
+        self.calls.clear()
+
+    def hook(self, service, call, request, response):
+        """Count the call. It's installed as an API proxy post call hook.
+        """
+        self.calls[service] += 1
+
+
+def activate_testbed():
+    """Activate testbed with stubs the app uses.
+
+    The datastore stub applies writes immediately, like the production
+    datastore does for almost every query.
+
+    Returns:
+        testbed.Testbed instance.
+    """
+    from google.appengine.datastore import datastore_stub_util
+    from google.appengine.ext import testbed
+
+    bed = testbed.Testbed()
+    bed.activate()
+    policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+        probability=1)
+    bed.init_datastore_v3_stub(consistency_policy=policy)
+    bed.init_memcache_stub()
+    bed.init_taskqueue_stub()
+    return bed
+
+def make_text(rand, words):
+    """Return random text of the number of words.
+    """
+    return ' '.join(rand.choice(WORDS) for _ in xrange(words))
+
+def seed(rand, runner, users, posts, comments, likes):
+    """Store users, posts, comments and likes, and index posts.
+
+    Args:
+        rand (Random): Random number generator.
+        runner (LocalRunner): Runner of deferred tasks.
+        users (int): The number of users.
+        posts (int): The number of posts.
+        comments (int): The number of comments of each post.
+        likes (int): The number of likes of each post.
+
+    Returns:
+        dict: Stored users, posts, comments and profile.
+    """
+    import tasks
+    from models import counter
+    from models import search
+    from models.comment import Comment
+    from models.like import Like
+    from models.post import Post
+    from models.user import User
+
+    user_list = [User.register('user%d' % i, PASSWORD,
+                               'user%d@example.com' % i)
+                 for i in xrange(users)]
+
+    post_list = []
+    for _ in xrange(posts):
+        author = rand.choice(user_list)
+        post = Post(user=author.key, subject=make_text(rand, 4),
+                    content=make_text(rand, 80))
+        counter.run_with_counters(post.put, {
+            counter.POSTS: 1,
+            counter.user_posts(author.key): 1,
+        })
+        post_list.append(post)
+
+    comment_list = []
+    for post in post_list:
+        for _ in xrange(comments):
+            comment = Comment(user=rand.choice(user_list).key, post=post.key,
+                              content=make_text(rand, 20))
+            counter.run_with_counters(comment.put, {
+                counter.post_comments(post.key): 1,
+            })
+            comment_list.append(comment)
+
+        others = [user for user in user_list if user.key != post.user]
+        for user in rand.sample(others, min(likes, len(others))):
+            Like.add(user.key, post.key)
+
+    tasks.defer(search.reindex_posts)
+    runner.run_all()
+
+    return dict(users=user_list, posts=post_list, comments=comment_list,
+                profile=seed_profile())
+
+def seed_profile():
+    """Store a profile by requesting the signup form with X-Profile header.
+
+    The form is chosen since it caches nothing measured routes would hit.
+
+    Returns:
+        ProfileRecord: Stored profile.
+    """
+    import webob
+    import main
+    import profiling
+    from handlers.blog import make_secure_val
+    from models.profile import ProfileRecord
+
+    request = webob.Request.blank('/blog/signup')
+    request.headers[profiling.PROFILE_HEADER] = make_secure_val(
+        profiling.new_token_value())
+    request.get_response(main.app)
+    return ProfileRecord.recent(limit=1)[0]
+
+def make_routes(data, rand):
+    """Make requests of every route.
+
+    Each route is a pair of name and a function which does what the request
+    needs beforehand and returns its method, path, form and user.
+
+    Args:
+        data (dict): Seeded users, posts, comments and profile.
+        rand (Random): Random number generator.
+
+    Returns:
+        list: Routes.
+    """
+    from models import counter
+    from models.comment import Comment
+    from models.like import Like
+    from models.post import Post
+
+    users = data['users']
+    posts = list(data['posts'])
+    owner = users[0]
+    own_posts = [post for post in posts
+                 if post.user == owner.key]
+    other_posts = [post for post in posts
+                   if post.user != owner.key]
+    names = ('newuser%d' % i for i in itertools.count())
+    profile_id = data['profile'].key.id()
+
+    def post_id():
+        """Return id of a random post."""
+        return rand.choice(posts).key.id()
+
+    def get(path, user=None):
+        """Return function which makes GET request of the path."""
+        return lambda: ('GET', path() if callable(path) else path, None, user)
+
+    def own_post():
+        """Return a post of the owner, storing one if there isn't."""
+        if not own_posts:
+            post = Post(user=owner.key, subject=make_text(rand, 4),
+                        content=make_text(rand, 80))
+            counter.run_with_counters(post.put, {
+                counter.POSTS: 1,
+                counter.user_posts(owner.key): 1,
+            })
+            own_posts.append(post)
+        return rand.choice(own_posts)
+
+    def own_comment():
+        """Store and return a comment of the owner."""
+        post = rand.choice(posts)
+        comment = Comment(user=owner.key, post=post.key,
+                          content=make_text(rand, 20))
+        counter.run_with_counters(comment.put, {
+            counter.post_comments(post.key): 1,
+        })
+        return comment
+
+    def signup():
+        """Return request registering a new user."""
+        name = next(names)
+        return ('POST', '/blog/signup',
+                dict(username=name, password=PASSWORD,
+                     confirmation=PASSWORD,
+                     email='%s@example.com' % name), None)
+
+    def new_post():
+        """Return request writing a post."""
+        return ('POST', '/blog/new_post',
+                dict(subject=make_text(rand, 4),
+                     content=make_text(rand, 80)), owner)
+
+    def edit_post():
+        """Return request editing a post of the owner."""
+        return ('POST', '/blog/edit_post/%d' % own_post().key.id(),
+                dict(subject=make_text(rand, 4),
+                     content=make_text(rand, 80)), owner)
+
+    def delete_post():
+        """Return request deleting a post of the owner."""
+        post = own_post()
+        own_posts.remove(post)
+        if post in posts:
+            posts.remove(post)
+        return ('POST', '/blog/delete_post/%d' % post.key.id(), {}, owner)
+
+    def new_comment():
+        """Return request writing a comment."""
+        return ('POST', '/blog/new_comment',
+                dict(post_id=str(post_id()),
+                     content=make_text(rand, 20)), owner)
+
+    def edit_comment():
+        """Return request editing a comment of the owner."""
+        comment_id = own_comment().key.id()
+        return ('POST', '/blog/edit_comment/%d' % comment_id,
+                {'content-%d' % comment_id: make_text(rand, 20)}, owner)
+
+    def delete_comment():
+        """Return request deleting a comment of the owner."""
+        return ('POST', '/blog/delete_comment/%d' % own_comment().key.id(),
+                {}, owner)
+
+    def like():
+        """Return request liking a post the owner doesn't like yet."""
+        post = rand.choice(other_posts)
+        Like.remove(owner.key, post.key)
+        return ('POST', '/blog/like/%d' % post.key.id(), {}, owner)
+
+    def unlike():
+        """Return request unliking a post the owner likes."""
+        post = rand.choice(other_posts)
+        Like.add(owner.key, post.key)
+        return ('POST', '/blog/unlike/%d' % post.key.id(), {}, owner)
+
+    def login():
+        """Return request logging in."""
+        return ('POST', '/blog/login',
+                dict(username=owner.username, password=PASSWORD), None)
+
+    routes = [
+        ('main (anonymous)', get('/blog')),
+        ('main', get('/blog', owner)),
+        ('permalink (anonymous)', get(lambda: '/blog/%d' % post_id())),
+        ('permalink', get(lambda: '/blog/%d' % post_id(), owner)),
+        ('comment list', get(lambda: '/blog/%d/comments' % post_id())),
+        ('my posts', get('/blog/my_post', owner)),
+        ('liked posts', get('/blog/like_post', owner)),
+        ('search', get(lambda: '/blog/search?q=%s+%s' % (
+            rand.choice(WORDS), rand.choice(WORDS)))),
+        ('feed atom', get('/blog/feed.atom')),
+        ('feed rss', get('/blog/feed.rss')),
+        ('user feed', get('/blog/users/%s/feed.atom' % owner.username)),
+        ('api posts', get('/api/posts')),
+        ('api posts by ids', get(lambda: '/api/posts?ids=%s' % ','.join(
+            str(post.key.id()) for post in rand.sample(
+                posts, min(10, len(posts)))))),
+        ('api comments', get(lambda: '/api/posts/%d/comments' % post_id())),
+        ('api user posts', get('/api/users/%s/posts' % owner.username)),
+        ('signup form', get('/blog/signup')),
+        ('signup', signup),
+        ('login form', get('/blog/login')),
+        ('login', login),
+        ('logout', get('/blog/logout', owner)),
+        ('new post form', get('/blog/new_post', owner)),
+        ('new post', new_post),
+        ('edit post form', get(lambda: '/blog/edit_post/%d' %
+                               own_post().key.id(), owner)),
+        ('edit post', edit_post),
+        ('delete post', delete_post),
+        ('new comment', new_comment),
+        ('edit comment', edit_comment),
+        ('delete comment', delete_comment),
+        ('like', like),
+        ('unlike', unlike),
+        ('warmup', get('/_ah/warmup')),
+        ('admin repair counters form', get('/admin/repair_counters')),
+        ('admin migrate likes form', get('/admin/migrate_likes')),
+        ('admin backfill usernames form', get('/admin/backfill_usernames')),
+        ('admin backfill content html form',
+         get('/admin/backfill_content_html')),
+        ('admin reindex search form', get('/admin/reindex_search')),
+        ('admin cache stats', get('/admin/cache_stats')),
+        ('admin profiles', get('/admin/profiles')),
+        ('admin profile', get('/admin/profiles/%d' % profile_id)),
+        ('admin profile collapsed', get(
+            '/admin/profiles/%d?format=collapsed' % profile_id)),
+        ('not found', get('/nowhere')),
+    ]
+    if not other_posts:
+        routes = [route for route in routes
+                  if route[0] not in ('like', 'unlike')]
+    return routes
+
+def percentile(values, percent):
+    """Return the nearest rank percentile of sorted values.
+    """
+    index = int(round(percent / 100.0 * (len(values) - 1)))
+    return values[index]
+
+def measure(routes, iterations, runner, rpc_counter):
+    """Request every route and measure it.
+
+    Args:
+        routes (list): Routes made by make_routes.
+        iterations (int): The number of requests of each route.
+        runner (LocalRunner): Runner of deferred tasks.
+        rpc_counter (RpcCounter): Counter installed as API proxy hook.
+
+    Returns:
+        dict: Results by route name.
+    """
+    import webob
+    import main
+    from handlers.blog import make_secure_val
+
+    results = collections.OrderedDict()
+    for name, make_request in routes:
+        latencies = []
+        datastore_rpcs = []
+        memcache_rpcs = []
+        sizes = []
+        statuses = collections.Counter()
+
+        for _ in xrange(iterations):
+            method, path, form, user = make_request()
+            runner.run_all()
+
+            request = webob.Request.blank(path, POST=form)
+            request.method = method
+            if user:
+                request.headers['Cookie'] = 'user_id=%s' % make_secure_val(
+                    str(user.key.id()))
+
+            rpc_counter.reset()
+            start = time.time()
+            response = request.get_response(main.app)
+            body = response.body
+            latencies.append((time.time() - start) * 1000)
+
+            datastore_rpcs.append(rpc_counter.calls['datastore_v3'])
+            memcache_rpcs.append(rpc_counter.calls['memcache'])
+            sizes.append(len(body))
+            statuses[response.status_int] += 1
+            runner.run_all()
+
+        latencies.sort()
+        results[name] = dict(
+            requests=iterations,
+            statuses=dict((str(status), count)
+                          for status, count in statuses.iteritems()),
+            p50_ms=percentile(latencies, 50),
+            p90_ms=percentile(latencies, 90),
+            p99_ms=percentile(latencies, 99),
+            mean_ms=sum(latencies) / iterations,
+            datastore_rpcs=float(sum(datastore_rpcs)) / iterations,
+            memcache_rpcs=float(sum(memcache_rpcs)) / iterations,
+            bytes=float(sum(sizes)) / iterations,
+        )
+    return results
+
+def git_commit():
+    """Return short hash of HEAD, suffixed with -dirty if tree is changed.
+    """
+    def git(*args):
+        """Run git command and return its output."""
+        return subprocess.check_output(('git',) + args, cwd=BASE_DIR).strip()
+
+    try:
+        commit = git('rev-parse', '--short', 'HEAD')
+        if git('status', '--porcelain', '--untracked-files=no'):
+            commit += '-dirty'
+        return commit
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def run(args):
+    """Seed data, measure every route and store the results.
+
+    Returns:
+        str: Path of the results file.
+    """
+    setup_sdk(args.sdk)
+    bed = activate_testbed()
+    try:
+        from google.appengine.api import apiproxy_stub_map
+        import tasks
+
+        runner = tasks.LocalRunner()
+        tasks.set_runner(runner)
+        rand = random.Random(args.seed)
+
+        data = seed(rand, runner, args.users, args.posts, args.comments,
+                    args.likes)
+
+        rpc_counter = RpcCounter()
+        apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+            'benchmark', rpc_counter.hook)
+
+        routes = make_routes(data, rand)
+        if args.route:
+            routes = [route for route in routes if args.route in route[0]]
+        results = measure(routes, args.iterations, runner, rpc_counter)
+    finally:
+        bed.deactivate()
+
+    commit = git_commit()
+    output = dict(commit=commit,
+                  time=datetime.datetime.utcnow().isoformat(),
+                  users=args.users, posts=args.posts,
+                  comments=args.comments, likes=args.likes,
+                  iterations=args.iterations, seed=args.seed,
+                  routes=results)
+
+    if not os.path.isdir(RESULTS_DIR):
+        os.makedirs(RESULTS_DIR)
+    path = args.output or os.path.join(RESULTS_DIR, '%s.json' % commit)
+    with open(path, 'w') as results_file:
+        json.dump(output, results_file, indent=2)
+
+    print_results(results)
+    print '\nResults are stored in %s' % path
+    return path
+
+def print_results(results):
+    """Print table of results.
+    """
+    print '%-34s %8s %8s %8s %6s %6s %8s' % (
+        'route', 'p50 ms', 'p90 ms', 'p99 ms', 'db', 'mc', 'bytes')
+    for name, result in results.iteritems():
+        print '%-34s %8.1f %8.1f %8.1f %6.1f %6.1f %8d' % (
+            name, result['p50_ms'], result['p90_ms'], result['p99_ms'],
+            result['datastore_rpcs'], result['memcache_rpcs'],
+            result['bytes'])
+
+def compare(base_path, new_path):
+    """Print changes of p50 latency and RPCs from base results to new ones.
+
+    Args:
+        base_path (str): Results file to compare with.
+        new_path (str): Results file to compare.
+    """
+    with open(base_path) as base_file:
+        base = json.load(base_file)
+    with open(new_path) as new_file:
+        new = json.load(new_file)
+
+    print '%s -> %s' % (base['commit'], new['commit'])
+    print '%-34s %17s %7s %13s %13s' % (
+        'route', 'p50 ms', 'change', 'db', 'mc')
+    for name, result in new['routes'].iteritems():
+        old = base['routes'].get(name)
+        if old is None:
+            print '%-34s %8s %8.1f' % (name, '-', result['p50_ms'])
+            continue
+
+        change = ((result['p50_ms'] - old['p50_ms']) / old['p50_ms'] * 100
+                  if old['p50_ms'] else 0)
+        print '%-34s %8.1f %8.1f %+6.0f%% %6.1f %6.1f %6.1f %6.1f' % (
+            name, old['p50_ms'], result['p50_ms'], change,
+            old['datastore_rpcs'], result['datastore_rpcs'],
+            old['memcache_rpcs'], result['memcache_rpcs'])
+
+def main():
+    """Parse arguments and run benchmark or comparison.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sdk', default=os.environ.get('APPENGINE_SDK', ''),
+                        help='App Engine SDK directory, '
+                             'defaults to $APPENGINE_SDK')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--posts', type=int, default=100)
+    parser.add_argument('--comments', type=int, default=5,
+                        help='comments of each post')
+    parser.add_argument('--likes', type=int, default=3,
+                        help='likes of each post')
+    parser.add_argument('--iterations', type=int, default=20,
+                        help='requests of each route')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--route', help='measure routes containing it only')
+    parser.add_argument('--output', help='results file path')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'),
+                        help='compare two results files')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+    else:
+        run(args)
+
+if __name__ == '__main__':
+    main()
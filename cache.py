@@ -0,0 +1,288 @@
+"""Caches for rendered html.
+
+This module provides a bounded in-process LRU cache, a fragment cache
+which keeps rendered html in the LRU cache backed by memcache, and the
+content generation number which versions cached pages.
+"""
+import collections
+import os
+import threading
+import time
+
+from google.appengine.api import memcache
+
+# Deployed version of the app. Fragments are versioned by it too, so ones
+# rendered by templates of another deploy are not served.
+APP_VERSION = os.environ.get('CURRENT_VERSION_ID', '')
+
+class LRUCache(object):
+    """Thread safe least recently used cache with bounded size.
+
+    Attributes:
+        max_size (int): The maximum number of entries.
+    """
+    def __init__(self, max_size=1000):
+        self.max_size = max_size
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Get value of the key and mark it as recently used.
+
+        Args:
+            key (str): Key to find.
+            default: Value to return if key doesn't exist.
+
+        Returns:
+            Value of the key if it exists, default otherwise.
+        """
+        with self._lock:
+            try:
+                value = self._entries.pop(key)
+            except KeyError:
+                return default
+            self._entries[key] = value
+            return value
+
+    def set(self, key, value):
+        """Set value of the key, evicting least recently used one if full.
+
+        Args:
+            key (str): Key to set.
+            value: Value to set.
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        """Delete the key if it exists.
+
+        Args:
+            key (str): Key to delete.
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Delete every entry.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_fragment_caches = []
+
+class FragmentCache(object):
+    """Two level cache of rendered html fragments.
+
+    Entries are kept in an in-process LRU cache and in memcache. Each entry
+    holds the version of the source it was rendered from and APP_VERSION,
+    and it is a miss if they don't match, so stale entries in other
+    instances are never served. The version must include everything the
+    template reads other than the viewer class in the key.
+
+    Attributes:
+        namespace (str): Memcache namespace of the cache.
+        local (LRUCache): In-process cache.
+        stats (dict): The number of local hits, memcache hits and misses.
+    """
+    def __init__(self, namespace, max_size=1000):
+        self.namespace = namespace
+        self.local = LRUCache(max_size)
+        self.stats = dict(local_hits=0, memcache_hits=0, misses=0)
+        _fragment_caches.append(self)
+
+    def get(self, key, version):
+        """Get html of the key rendered from the version.
+
+        Args:
+            key (str): Fragment key.
+            version: Version of the source.
+
+        Returns:
+            str: Cached html if it exists, None otherwise.
+        """
+        version = (APP_VERSION, version)
+        entry = self.local.get(key)
+        if entry and entry[0] == version:
+            self.stats['local_hits'] += 1
+            return entry[1]
+
+        entry = memcache.get(key, namespace=self.namespace)
+        if entry and entry[0] == version:
+            self.stats['memcache_hits'] += 1
+            self.local.set(key, entry)
+            return entry[1]
+
+        self.stats['misses'] += 1
+        return None
+
+    def set(self, key, version, html):
+        """Store html of the key rendered from the version.
+
+        Args:
+            key (str): Fragment key.
+            version: Version of the source.
+            html (str): Rendered html.
+        """
+        entry = ((APP_VERSION, version), html)
+        self.local.set(key, entry)
+        memcache.set(key, entry, namespace=self.namespace)
+
+    def invalidate(self, keys):
+        """Delete fragments of the keys.
+
+        Args:
+            keys (list): Fragment keys to delete.
+        """
+        for key in keys:
+            self.local.delete(key)
+        memcache.delete_multi(keys, namespace=self.namespace)
+
+    def hit_rate(self):
+        """Return ratio of hits to lookups, None if nothing was looked up.
+        """
+        hits = self.stats['local_hits'] + self.stats['memcache_hits']
+        lookups = hits + self.stats['misses']
+        if lookups:
+            return float(hits) / lookups
+
+
+def fragment_cache_stats():
+    """Return statistics of every fragment cache in this instance.
+
+    Returns:
+        list: Dict of namespace, size, hit_rate and counts for each cache.
+    """
+    results = []
+    for fragment_cache in _fragment_caches:
+        stats = dict(fragment_cache.stats)
+        stats.update(namespace=fragment_cache.namespace,
+                     size=len(fragment_cache.local),
+                     hit_rate=fragment_cache.hit_rate())
+        results.append(stats)
+    return results
+
+
+GENERATION_KEY = 'page-generation'
+PAGE_NAMESPACE = 'page'
+
+def _initial_generation():
+    """Return initial generation number which is larger than evicted ones.
+    """
+    return int(time.time() * 1000)
+
+def page_generation():
+    """Return current content generation number.
+
+    Returns:
+        int: Generation number, None if memcache is unavailable.
+    """
+    generation = memcache.get(GENERATION_KEY)
+    if generation is None:
+        memcache.add(GENERATION_KEY, _initial_generation())
+        generation = memcache.get(GENERATION_KEY)
+    return generation
+
+def bump_generation():
+    """Increase content generation number so every cached page expires.
+
+    Write handlers, and background tasks when they finish, must call it
+    after changing anything shown in pages.
+    """
+    memcache.incr(GENERATION_KEY, initial_value=_initial_generation())
+
+def get_page(etag):
+    """Get cached page body of the etag.
+
+    Args:
+        etag (str): ETag of the page.
+
+    Returns:
+        str: Cached page body if it exists, None otherwise.
+    """
+    return memcache.get(etag, namespace=PAGE_NAMESPACE)
+
+def set_page(etag, body):
+    """Store page body of the etag.
+
+    Args:
+        etag (str): ETag of the page.
+        body (str): Page body.
+    """
+    memcache.set(etag, body, namespace=PAGE_NAMESPACE)
+
+
+FEED_NAMESPACE = 'feed'
+# Seconds a cached feed is kept, since ones of old generations are never
+# read again.
+FEED_TIME = 3600
+
+def _feed_generation_key(name):
+    """Return memcache key of the generation number of the feed.
+    """
+    return 'generation:%s' % name
+
+def feed_generation(name):
+    """Return current generation number of the feed.
+
+    Read it before building the feed, so a feed built while a post in it
+    is written is stored under the generation that the write expires.
+
+    Args:
+        name (str): Feed name.
+
+    Returns:
+        int: Generation number, None if memcache is unavailable.
+    """
+    key = _feed_generation_key(name)
+    generation = memcache.get(key, namespace=FEED_NAMESPACE)
+    if generation is None:
+        memcache.add(key, _initial_generation(), namespace=FEED_NAMESPACE)
+        generation = memcache.get(key, namespace=FEED_NAMESPACE)
+    return generation
+
+def bump_feed_generations(names):
+    """Increase generation numbers of the feeds so cached ones expire.
+
+    Post write handlers must call it with names of feeds the post belongs.
+
+    Args:
+        names (list): Feed names.
+    """
+    memcache.offset_multi(
+        dict((_feed_generation_key(name), 1) for name in names),
+        namespace=FEED_NAMESPACE, initial_value=_initial_generation())
+
+def get_feed(name, feed_format, generation):
+    """Get cached feed of the generation.
+
+    Args:
+        name (str): Feed name.
+        feed_format (str): 'atom' or 'rss'.
+        generation (int): Generation number read by feed_generation().
+
+    Returns:
+        dict: etag, last_modified and body of the feed if it exists, None
+            otherwise.
+    """
+    return memcache.get('%s:%s:%d' % (name, feed_format, generation),
+                        namespace=FEED_NAMESPACE)
+
+def set_feed(name, feed_format, generation, feed):
+    """Store feed of the generation for FEED_TIME seconds.
+
+    Args:
+        name (str): Feed name.
+        feed_format (str): 'atom' or 'rss'.
+        generation (int): Generation number read before building the feed.
+        feed (dict): etag, last_modified and body of the feed.
+    """
+    memcache.set('%s:%s:%d' % (name, feed_format, generation), feed,
+                 time=FEED_TIME, namespace=FEED_NAMESPACE)
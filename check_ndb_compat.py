@@ -0,0 +1,185 @@
+"""Check that entities stored by the old db models load with the ndb models.
+
+This module stores users, a post, a comment and likes with db models of
+the schema the app used before ndb, on the App Engine testbed, then loads
+them through the ndb models and the code paths handlers use. It exits with
+status 1 if any check fails. tests/test_ndb_compat.py runs the same checks
+with the other tests when APPENGINE_SDK is set.
+
+    $ python check_ndb_compat.py --sdk ~/google_appengine
+"""
+import argparse
+import sys
+
+from benchmark import setup_sdk, activate_testbed
+
+def legacy_models():
+    """Define db models with kinds and properties of the old schema.
+
+    Returns:
+        dict: Model classes by kind.
+    """
+    from google.appengine.ext import db
+
+    def kind_of(name):
+        """Return kind() class method which returns the name."""
+        return classmethod(lambda cls: name)
+
+    class LegacyUser(db.Model):
+        """User as it was stored by db."""
+        kind = kind_of('User')
+        username = db.StringProperty(required=True)
+        password = db.StringProperty(required=True)
+        email = db.StringProperty()
+
+    class LegacyUsername(db.Model):
+        """Username index as it was stored by db."""
+        kind = kind_of('Username')
+        user = db.ReferenceProperty(LegacyUser, required=True)
+
+    class LegacyPost(db.Model):
+        """Post as it was stored by db."""
+        kind = kind_of('Post')
+        user = db.ReferenceProperty(LegacyUser, collection_name='posts',
+                                    required=True)
+        subject = db.StringProperty(required=True)
+        content = db.TextProperty(required=True)
+        content_html = db.TextProperty()
+        use_markdown = db.BooleanProperty(default=False)
+        created = db.DateTimeProperty(auto_now_add=True)
+        updated = db.DateTimeProperty(auto_now=True)
+
+    class LegacyComment(db.Model):
+        """Comment as it was stored by db."""
+        kind = kind_of('Comment')
+        user = db.ReferenceProperty(LegacyUser, collection_name='comments',
+                                    required=True)
+        post = db.ReferenceProperty(LegacyPost, collection_name='comments',
+                                    required=True)
+        content = db.TextProperty(required=True)
+        content_html = db.TextProperty()
+        created = db.DateTimeProperty(auto_now_add=True)
+        updated = db.DateTimeProperty(auto_now=True)
+
+    class LegacyLike(db.Model):
+        """Like as it was stored by db."""
+        kind = kind_of('Like')
+        user = db.ReferenceProperty(LegacyUser, collection_name='likes',
+                                    required=True)
+        post = db.ReferenceProperty(LegacyPost, collection_name='liked_by',
+                                    required=True)
+
+    return dict(User=LegacyUser, Username=LegacyUsername, Post=LegacyPost,
+                Comment=LegacyComment, Like=LegacyLike)
+
+def store_legacy(models):
+    """Store entities with the db models.
+
+    Returns:
+        dict: Stored entities.
+    """
+    from models.user import make_password_hash
+
+    author = models['User'](username='Alice', email='alice@example.com',
+                            password=make_password_hash('Alice', 'secret'))
+    author.put()
+    reader = models['User'](username='bob',
+                            password=make_password_hash('bob', 'secret'))
+    reader.put()
+    for user in (author, reader):
+        models['Username'](key_name=user.username.lower(), user=user).put()
+
+    post = models['Post'](user=author, subject=u'Subject \xe9',
+                          content=u'First line\nsecond line',
+                          content_html=u'First line<br>second line')
+    post.put()
+    old_post = models['Post'](user=author, subject='Old',
+                              content='Stored before content_html')
+    old_post.put()
+    comment = models['Comment'](user=reader, post=post, content='Nice')
+    comment.put()
+
+    like = models['Like'](key_name='u%d-p%d' % (reader.key().id(),
+                                                post.key().id()),
+                          user=reader, post=post)
+    like.put()
+    legacy_like = models['Like'](user=author, post=old_post)
+    legacy_like.put()
+
+    return dict(author=author, reader=reader, post=post, old_post=old_post,
+                comment=comment, like=like, legacy_like=legacy_like)
+
+def check(stored):
+    """Load stored entities with the ndb models and compare them.
+
+    Returns:
+        list: Pairs of check name and whether it passed.
+    """
+    from google.appengine.ext import ndb
+
+    from models import counter
+    from models.comment import Comment
+    from models.like import Like
+    from models.post import Post
+    from models.user import User
+
+    ndb.get_context().clear_cache()
+    old = stored['post']
+    post = Post.get_by_id(old.key().id())
+    user = User.login('alice', 'secret')
+    comments = Comment.page_by_post(post).items
+    reader_key = ndb.Key(User, stored['reader'].key().id())
+
+    # Cursors and recent writes lists hold keys as strings, so they stay
+    # valid as long as both APIs make the same string of a key.
+    return [
+        ('db and ndb keys are the same',
+         ndb.Key(urlsafe=str(old.key())) == post.key and
+         str(old.key()) == post.key.urlsafe()),
+        ('user logs in by name', user is not None and
+         user.key.id() == stored['author'].key().id()),
+        ('post fields', (post.subject, post.content, post.content_html,
+                         post.use_markdown, post.created) ==
+         (old.subject, old.content, old.content_html, old.use_markdown,
+          old.created)),
+        ('post author', post.author.username == 'Alice' and
+         post.is_owner(user)),
+        ('old post is converted on read',
+         Post.get_by_id(stored['old_post'].key().id()).html() ==
+         'Stored before content_html'),
+        ('comment of post', [comment.key.id() for comment in comments] ==
+         [stored['comment'].key().id()] and
+         comments[0].author.username == 'bob'),
+        ('like of post', Like.liked_post_keys(
+            User.get_by_id(reader_key.id()), [post]) == set([post.key])),
+        ('like is found by key',
+         Like.make_key(reader_key, post.key).get() is not None),
+        ('legacy like is queried by user',
+         Like.query(Like.user == user.key).count() == 1),
+        ('counter names', counter.post_likes(post.key) ==
+         'post-likes:%d' % old.key().id()),
+    ]
+
+def main():
+    """Run the checks and print their results.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sdk', required=True,
+                        help='Directory of the App Engine SDK.')
+    args = parser.parse_args()
+
+    setup_sdk(args.sdk)
+    bed = activate_testbed()
+    try:
+        results = check(store_legacy(legacy_models()))
+    finally:
+        bed.deactivate()
+
+    for name, passed in results:
+        print '%-34s %s' % (name, 'ok' if passed else 'FAILED')
+    if not all(passed for _, passed in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
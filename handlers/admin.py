@@ -0,0 +1,187 @@
+"""Handlers for administrative jobs.
+
+These pages are restricted to application admins by app.yaml.
+"""
+import cgi
+import json
+
+import webapp2
+
+from google.appengine.api import memcache
+
+import cache
+import profiling
+import tasks
+from models import counter
+from models import like
+from models import post
+from models import search
+from models import user
+from models.comment import Comment
+from models.profile import ProfileRecord
+from handlers.blog import make_secure_val
+
+JOB_FORM = """<form method="post">
+  <p>%s</p>
+  <button type="submit">Start</button>
+</form>
+"""
+
+class JobPage(webapp2.RequestHandler):
+    """Base handler for admin jobs.
+
+    Subclasses set description and implement start().
+    """
+    description = ''
+
+    def get(self):
+        """Render form to start the job.
+        """
+        self.response.write(JOB_FORM % self.description)
+
+    def post(self):
+        """Start the job.
+        """
+        self.start()
+        self.response.write('Started: %s' % self.description)
+
+    def start(self):
+        """Start the job. Subclasses must override it.
+        """
+        raise NotImplementedError
+
+
+class RepairCountersPage(JobPage):
+    """Counter repair job handler.
+    """
+    description = 'Recompute every counter from scratch.'
+
+    def start(self):
+        """Defer counter repair task.
+        """
+        tasks.defer(counter.repair_counters)
+
+
+class MigrateLikesPage(JobPage):
+    """Like migration job handler.
+    """
+    description = 'Re-key likes by user and post, removing duplicates.'
+
+    def start(self):
+        """Defer like migration task.
+        """
+        tasks.defer(like.migrate_likes)
+
+
+class BackfillUsernamesPage(JobPage):
+    """Username index backfill job handler.
+    """
+    description = 'Build username index for existing users.'
+
+    def start(self):
+        """Defer username index backfill task.
+        """
+        tasks.defer(user.backfill_usernames)
+
+
+class BackfillContentHtmlPage(JobPage):
+    """Content html backfill job handler.
+    """
+    description = 'Convert content of old posts and comments to html.'
+
+    def start(self):
+        """Defer content html backfill tasks for posts and comments.
+        """
+        tasks.defer(post.backfill_content_html, post.Post)
+        tasks.defer(post.backfill_content_html, Comment)
+
+
+class ReindexSearchPage(JobPage):
+    """Search index rebuild job handler.
+    """
+    description = 'Index every post for search.'
+
+    def start(self):
+        """Defer search reindex task.
+        """
+        tasks.defer(search.reindex_posts)
+
+
+class CacheStatsPage(webapp2.RequestHandler):
+    """Cache statistics handler.
+    """
+    def get(self):
+        """Write hit rates of fragment caches in this instance and memcache.
+        """
+        stats = dict(fragments=cache.fragment_cache_stats(),
+                     memcache=memcache.get_stats())
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(stats, indent=2))
+
+
+PROFILE_LIST = """<p>Send this header to profile a request within an hour:</p>
+<pre>%s: %s</pre>
+<table>
+  <tr><th>Time</th><th>Request</th><th>ms</th><th>Reason</th></tr>
+%s
+</table>
+"""
+PROFILE_ROW = """  <tr>
+    <td>%s</td><td><a href="/admin/profiles/%d">%s %s</a></td>
+    <td>%.1f</td><td>%s</td>
+  </tr>"""
+PROFILE_DETAIL = """<p>%s %s took %.1f ms (%s).
+  <a href="?format=collapsed">Collapsed stacks</a></p>
+<table>
+  <tr>
+    <th>Function</th><th>Calls</th><th>Own ms</th><th>Cumulative ms</th>
+  </tr>
+%s
+</table>
+"""
+FUNCTION_ROW = """  <tr>
+    <td>%s</td><td>%d</td><td>%.3f</td><td>%.3f</td>
+  </tr>"""
+
+class ProfileListPage(webapp2.RequestHandler):
+    """Profile list handler.
+    """
+    def get(self):
+        """Render signed profile header and recent profiles.
+        """
+        rows = [PROFILE_ROW % (record.created, record.key.id(),
+                               record.method, cgi.escape(record.path),
+                               record.duration_ms, record.reason)
+                for record in ProfileRecord.recent()]
+        token = make_secure_val(profiling.new_token_value())
+        self.response.write(PROFILE_LIST % (profiling.PROFILE_HEADER, token,
+                                            '\n'.join(rows)))
+
+
+class ProfilePage(webapp2.RequestHandler):
+    """Profile detail handler.
+    """
+    def get(self, profile_id):
+        """Render top functions of the profile, or its collapsed stacks.
+
+        Collapsed stacks, written with ?format=collapsed, can be given to
+        flamegraph.pl or speedscope.
+
+        Args:
+            profile_id (str): ProfileRecord's id.
+        """
+        record = ProfileRecord.get_by_id(int(profile_id))
+        if not record:
+            return self.abort(404)
+
+        if self.request.get('format') == 'collapsed':
+            self.response.headers['Content-Type'] = 'text/plain'
+            return self.response.write(record.collapsed or '')
+
+        rows = [FUNCTION_ROW % (cgi.escape(function['name']),
+                                function['calls'], function['own_ms'],
+                                function['cumulative_ms'])
+                for function in record.functions()]
+        self.response.write(PROFILE_DETAIL % (
+            record.method, cgi.escape(record.path), record.duration_ms,
+            record.reason, '\n'.join(rows)))
@@ -0,0 +1,157 @@
+"""Handlers for JSON read API.
+
+Every list response has 'items', 'next_cursor' and 'prev_cursor'. Clients
+can pick fields of items with 'fields' parameter, e.g. ?fields=id,subject,
+and responses have ETag so unchanged ones are answered with 304.
+"""
+import hashlib
+import json
+
+from google.appengine.ext import ndb
+
+from models import counter
+from models.post import Post
+from models.comment import Comment
+from models.user import User
+from models.pagination import fetch_page
+from handlers.blog import BlogHandler
+from handlers.postlist import load_posts
+from helper import get_by_id, parse_id
+
+PER_PAGE = 20
+MAX_IDS = 100
+
+class ApiHandler(BlogHandler):
+    """Base handler of JSON API.
+    """
+    def write_json(self, data):
+        """Write data as JSON with ETag.
+
+        Args:
+            data (dict): Data to write.
+        """
+        fields = self.request.get('fields')
+        if fields and 'items' in data:
+            fields = set(fields.split(','))
+            data['items'] = [dict((name, value)
+                                  for name, value in item.iteritems()
+                                  if name in fields)
+                             for item in data['items']]
+
+        body = json.dumps(data, sort_keys=True)
+        etag = hashlib.md5(body).hexdigest()
+
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.headers['Cache-Control'] = 'private, max-age=0'
+        self.response.etag = etag
+
+        if etag in self.request.if_none_match:
+            self.response.status = 304
+        else:
+            self.write(body)
+
+    def write_error(self, status, message):
+        """Write error as JSON.
+
+        Args:
+            status (int): HTTP status code.
+            message (str): Error message.
+        """
+        self.response.status = status
+        self.response.headers['Content-Type'] = 'application/json'
+        self.write(json.dumps(dict(error=message)))
+
+    def write_posts(self, posts, page=None):
+        """Write posts with their authors, totals and liked flags.
+
+        Args:
+            posts (list): Post instances.
+            page (Page): Page which posts belong, if any.
+        """
+        liked = load_posts(posts, self.user)
+
+        items = []
+        for post in posts:
+            item = post.to_dict()
+            item['liked'] = post.key in liked
+            items.append(item)
+
+        self.write_json(dict(items=items,
+                             next_cursor=page and page.next_cursor,
+                             prev_cursor=page and page.prev_cursor))
+
+
+class PostListApi(ApiHandler):
+    """Post list API handler.
+    """
+    def get(self):
+        """Write a page of posts, or posts of given ids.
+
+        ?ids=1,2,3 fetches the posts with one batched get. Ids which don't
+        exist are left out.
+        """
+        ids = self.request.get('ids')
+
+        if ids:
+            ids = [parse_id(post_id) for post_id in ids.split(',')]
+
+            if len(ids) > MAX_IDS:
+                return self.write_error(400, 'Too many ids.')
+
+            if None in ids:
+                return self.write_error(400, 'ids must be integers from 1 '
+                                        'to 2**63 - 1.')
+
+            posts = [post for post in
+                     ndb.get_multi([ndb.Key(Post, post_id)
+                                    for post_id in ids])
+                     if post]
+            return self.write_posts(posts)
+
+        page = fetch_page(Post.query, 'created', self.request.get('cursor'),
+                          PER_PAGE, counter.POSTS)
+        self.write_posts(page.items, page)
+
+
+class UserPostListApi(ApiHandler):
+    """Post list of a user API handler.
+    """
+    def get(self, username):
+        """Write a page of posts of the user.
+
+        Args:
+            username (str): User's name.
+        """
+        user = User.by_name(username)
+
+        if not user:
+            return self.write_error(404, 'User not found.')
+
+        def make_query():
+            """Make query of posts of the user."""
+            return Post.query(Post.user == user.key)
+
+        page = fetch_page(make_query, 'created', self.request.get('cursor'),
+                          PER_PAGE, counter.user_posts(user.key))
+        self.write_posts(page.items, page)
+
+
+class CommentListApi(ApiHandler):
+    """Comment list of a post API handler.
+    """
+    def get(self, post_id):
+        """Write a page of comments of the post.
+
+        Args:
+            post_id (str): Post's id which comments belong.
+        """
+        post = get_by_id(Post, post_id)
+
+        if not post:
+            return self.write_error(404, 'Post not found.')
+
+        page = Comment.page_by_post(post, self.request.get('cursor'),
+                                    PER_PAGE)
+        self.write_json(dict(items=[c.to_dict() for c in page.items],
+                             next_cursor=page.next_cursor,
+                             prev_cursor=page.prev_cursor))
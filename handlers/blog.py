@@ -5,9 +5,11 @@ import hmac
 
 import webapp2
 
-import render
+from google.appengine.ext import ndb
 
-from models.user import User
+import profiling
+import render
+import session
 
 if os.environ.has_key('SECRET'):
     SECRET = os.environ['SECRET']
@@ -76,6 +78,17 @@ class BlogHandler(webapp2.RequestHandler):
         """
         self.write(self.render_str(template, **kw))
 
+    def set_page_cache_headers(self, etag):
+        """Set headers of a page cached for logged out users.
+
+        Args:
+            etag (str): ETag of the page.
+        """
+        self.response.etag = etag
+        self.response.headers['Cache-Control'] = ('public, max-age=0, '
+                                                  'must-revalidate')
+        self.response.headers['Vary'] = 'Cookie'
+
     def set_secure_cookie(self, name, val, remember):
         """Make secure cookie and set it to the browser.
 
@@ -110,19 +123,53 @@ class BlogHandler(webapp2.RequestHandler):
         Args:
             user (User): user instance to login.
         """
-        self.set_secure_cookie('user_id', str(user.key().id()), remember)
+        self.set_secure_cookie('user_id', str(user.key.id()), remember)
 
     def logout(self):
-        """Remove cookie to log out.
+        """Remove cookie and cached session to log out.
         """
+        cookie_val = self.request.cookies.get('user_id')
+        if cookie_val:
+            session.forget(cookie_val)
         self.response.headers.add_header('Set-Cookie', 'user_id=; Path=/')
 
+    def profile_requested(self):
+        """Decide if the request is profiled, and why.
+
+        Returns:
+            str: 'header' if it has valid signed X-Profile header, 'sample'
+                if it's sampled, None if it's not profiled.
+        """
+        token = self.request.headers.get(profiling.PROFILE_HEADER)
+        if token and profiling.is_valid_token_value(check_secure_val(token)):
+            return 'header'
+        if profiling.sampled():
+            return 'sample'
+        return None
+
     def initialize(self, *a, **kw):
         """Set self.user value from 'user_id' cookie if it exists.
+
+        self.user is SessionUser instance loaded from the cached session.
         """
         webapp2.RequestHandler.initialize(self, *a, **kw)
+        self.profile_reason = self.profile_requested()
         uid = self.read_secure_cookie('user_id')
         if uid:
-            self.user = User.by_id(int(uid))
+            self.user = session.load(self.request.cookies.get('user_id'), uid)
         else:
             self.user = None
+
+    @ndb.toplevel
+    def dispatch(self):
+        """Dispatch the request in a fresh ndb context.
+
+        Entities got by the handler are cached in the context for the rest
+        of the request, and async writes it started are waited for before
+        the response is sent. The handler method is run under cProfile if
+        the request is profiled.
+        """
+        if self.profile_reason:
+            return profiling.run(self.request, self.profile_reason,
+                                 webapp2.RequestHandler.dispatch, self)
+        return webapp2.RequestHandler.dispatch(self)
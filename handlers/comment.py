@@ -1,13 +1,20 @@
-"""Handlers for new, edit and delete comments.
+"""Handlers for comment list, new, edit and delete comments.
 """
-import time
+import json
 
+from google.appengine.ext import ndb
+
+import cache
+
+from models import counter
+from models import recent
 from models.post import Post
 from models.comment import Comment
+from models.like import Like
 
 from handlers.blog import BlogHandler
 
-from helper import login_required
+from helper import get_by_id, login_required
 
 class NewCommentPage(BlogHandler):
     """New comment page handler
@@ -19,25 +26,52 @@ class NewCommentPage(BlogHandler):
         If content is empty, render post page with error.
         """
         content = self.request.get('content')
-        post_id = self.request.get('post_id')
+        post = get_by_id(Post, self.request.get('post_id'))
 
-        if post_id:
-            try:
-                post = Post.get_by_id(int(post_id))
-            except ValueError:
-                return self.redirect('/blog')
+        if not post:
+            return self.redirect('/blog')
 
         if content:
-            comment = Comment(user=self.user, post=post, content=content)
-            comment.put()
+            comment = Comment(user=self.user.key, post=post.key,
+                              content=content)
+            counter.run_with_counters(comment.put, {
+                counter.post_comments(post.key): 1,
+            })
 
-            # Delay for DB processing.
-            time.sleep(0.1)
+            recent.record(comment.recent_lists(), comment.key)
+            cache.bump_generation()
 
-            return self.redirect('/blog/%s' % post.key().id())
+            return self.redirect('/blog/%s' % post.key.id())
         else:
             error = 'Comment is needed'
-            self.render('permalink.html', post=post, error=error)
+            comments = Comment.page_by_post(post)
+            liked = Like.liked_post_keys(self.user, [post])
+            self.render('permalink.html', post=post, comments=comments,
+                        liked=liked, error=error)
+
+
+class CommentListPage(BlogHandler):
+    """Comment list handler for loading more comments of a post.
+    """
+    def get(self, post_id):
+        """Write a page of comments as JSON.
+
+        The JSON has 'html' which is rendered comments and 'next_cursor'
+        which is cursor of the next page, null if it's last page.
+
+        Args:
+            post_id (str): Post's id which comments belong.
+        """
+        post = get_by_id(Post, post_id)
+
+        if not post:
+            return self.abort(404)
+
+        page = Comment.page_by_post(post, self.request.get('cursor'))
+        html = ''.join(comment.render(self.user) for comment in page.items)
+
+        self.response.headers['Content-Type'] = 'application/json'
+        self.write(json.dumps(dict(html=html, next_cursor=page.next_cursor)))
 
 
 class EditCommentPage(BlogHandler):
@@ -52,9 +86,9 @@ class EditCommentPage(BlogHandler):
         Args:
             comment_id (str): Comment's id to edit.
         """
-        comment = Comment.get_by_id(int(comment_id))
+        comment = get_by_id(Comment, comment_id)
 
-        if not(comment and self.user.key().id() == comment.user.key().id()):
+        if not(comment and comment.is_owner(self.user)):
             return self.redirect('/blog')
 
         content = self.request.get('content-%s' % comment_id)
@@ -62,13 +96,14 @@ class EditCommentPage(BlogHandler):
         if content:
             comment.content = content
             comment.put()
+            comment.invalidate_fragments()
 
-            # Delay for DB processing.
-            time.sleep(0.1)
+            recent.record(comment.recent_lists(), comment.key)
+            cache.bump_generation()
 
-            return self.redirect('/blog/%s' % comment.post.key().id())
+            return self.redirect('/blog/%s' % comment.post_id())
         else:
-            return self.redirect('/blog/%s' % comment.post.key().id())
+            return self.redirect('/blog/%s' % comment.post_id())
 
 
 class DeleteCommentPage(BlogHandler):
@@ -83,12 +118,25 @@ class DeleteCommentPage(BlogHandler):
         Args:
             comment_id (str): Comment's id to edit.
         """
-        comment = Comment.get_by_id(int(comment_id))
+        comment = get_by_id(Comment, comment_id)
+
+        if not comment:
+            return self.redirect('/blog')
+
+        post_key = comment.post
+
+        def delete_comment():
+            """Delete the comment unless it's already deleted."""
+            if not comment.key.get():
+                raise ndb.Rollback()
+            comment.key.delete()
+            return True
 
-        if comment and self.user.key().id() == comment.user.key().id():
-            comment.delete()
+        if comment.is_owner(self.user) and counter.run_with_counters(
+                delete_comment, {counter.post_comments(post_key): -1}):
+            comment.invalidate_fragments()
 
-            # Delay for DB processing.
-            time.sleep(0.1)
+            recent.record(comment.recent_lists(), comment.key, deleted=True)
+            cache.bump_generation()
 
-        return self.redirect('/blog/%s' % comment.post.key().id())
+        return self.redirect('/blog/%s' % post_key.id())
@@ -0,0 +1,175 @@
+"""Handlers for Atom and RSS feeds.
+
+Feeds are rendered once and cached in memcache under the generation
+number of the feed, which post writes increase, so a cached feed is served
+until a post in it is written. The generation is read before the feed is
+built, so a feed built while a post is written is stored under one that
+is already expired. Posts are fetched with recent writes merged in, like
+list pages, so a feed built right after a write doesn't cache it without
+the post.
+Cached feeds are served with ETag and Last-Modified, so polling feed
+readers mostly get 304 without touching the datastore or templates.
+"""
+import calendar
+import datetime
+import hashlib
+from email.utils import formatdate
+
+import cache
+import render
+from models import counter
+from models.pagination import fetch_page
+from models.post import Post, ALL_FEED, user_feed
+from models.prefetch import prefetch_refprops
+from models.user import User
+from handlers.blog import BlogHandler
+
+FEED_SIZE = 20
+CONTENT_TYPES = {
+    'atom': 'application/atom+xml; charset=utf-8',
+    'rss': 'application/rss+xml; charset=utf-8',
+}
+
+def http_date(value):
+    """Format datetime in UTC as HTTP date.
+
+    Args:
+        value (datetime): Time to format.
+
+    Returns:
+        str: HTTP date.
+    """
+    return formatdate(calendar.timegm(value.utctimetuple()), usegmt=True)
+
+
+class FeedHandler(BlogHandler):
+    """Base handler of feeds.
+    """
+    def write_feed(self, name, feed_format, build):
+        """Write cached feed, or build and cache it.
+
+        Args:
+            name (str): Feed name.
+            feed_format (str): 'atom' or 'rss'.
+            build (callable): Returns title, link and posts of the feed, or
+                None if the feed doesn't exist.
+        """
+        generation = cache.feed_generation(name)
+        feed = None
+        if generation is not None:
+            feed = cache.get_feed(name, feed_format, generation)
+
+        if feed is None:
+            built = build()
+            if built is None:
+                return self.abort(404)
+
+            title, link, posts = built
+            feed = self.render_feed(feed_format, title, link, posts)
+            if generation is not None:
+                cache.set_feed(name, feed_format, generation, feed)
+
+        self.response.headers['Content-Type'] = CONTENT_TYPES[feed_format]
+        self.response.headers['Cache-Control'] = 'public, max-age=60'
+        self.response.etag = feed['etag']
+        self.response.headers['Last-Modified'] = http_date(
+            feed['last_modified'])
+
+        if self.is_not_modified(feed):
+            self.response.status = 304
+        else:
+            self.write(feed['body'])
+
+    def is_not_modified(self, feed):
+        """Check if the client already has the feed.
+
+        Args:
+            feed (dict): Cached feed.
+
+        Returns:
+            bool: True if the feed isn't modified, False otherwise.
+        """
+        if self.request.if_none_match:
+            return feed['etag'] in self.request.if_none_match
+
+        if_modified_since = self.request.if_modified_since
+        if if_modified_since:
+            last_modified = feed['last_modified'].replace(microsecond=0)
+            return last_modified <= if_modified_since.replace(tzinfo=None)
+
+        return False
+
+    def render_feed(self, feed_format, title, link, posts):
+        """Render feed of the posts.
+
+        Args:
+            feed_format (str): 'atom' or 'rss'.
+            title (str): Feed title.
+            link (str): Path of the page the feed is for.
+            posts (list): Post instances, newest first.
+
+        Returns:
+            dict: etag, last_modified and body of the feed.
+        """
+        prefetch_refprops(posts, Post.user)
+
+        if posts:
+            last_modified = max(post.updated or post.created
+                                for post in posts)
+        else:
+            last_modified = datetime.datetime.utcnow()
+
+        body = render.render_str('%s.xml' % feed_format, title=title,
+                                 host_url=self.request.host_url, link=link,
+                                 self_url=self.request.path_url,
+                                 posts=posts, updated=last_modified,
+                                 http_date=http_date)
+        body = body.encode('utf-8')
+
+        return dict(etag=hashlib.sha1(body).hexdigest(),
+                    last_modified=last_modified, body=body)
+
+
+class PostFeed(FeedHandler):
+    """Feed of every post handler.
+    """
+    def get(self, feed_format):
+        """Write feed of the newest posts.
+
+        Args:
+            feed_format (str): 'atom' or 'rss'.
+        """
+        def build():
+            """Return title, link and posts of the feed."""
+            posts = fetch_page(Post.query, 'created', per_page=FEED_SIZE,
+                               recent_list=counter.POSTS).items
+            return 'Simple Blog', '/blog', posts
+
+        self.write_feed(ALL_FEED, feed_format, build)
+
+
+class UserPostFeed(FeedHandler):
+    """Feed of posts of a user handler.
+    """
+    def get(self, username, feed_format):
+        """Write feed of the newest posts of the user.
+
+        Args:
+            username (str): User's name.
+            feed_format (str): 'atom' or 'rss'.
+        """
+        def build():
+            """Return title, link and posts of the feed."""
+            user = User.by_name(username)
+            if not user:
+                return None
+
+            def make_query():
+                """Make query of posts of the user."""
+                return Post.query(Post.user == user.key)
+
+            posts = fetch_page(make_query, 'created', per_page=FEED_SIZE,
+                               recent_list=counter.user_posts(user.key)).items
+            return 'Simple Blog - %s' % user.username, '/blog', posts
+
+        self.write_feed(user_feed(username), feed_format, build)
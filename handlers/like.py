@@ -1,14 +1,16 @@
 """Handlers for like and unlike.
 """
 
-import time
+import cache
 
+from models import counter
+from models import recent
 from models.post import Post
 from models.like import Like
 
 from handlers.blog import BlogHandler
 
-from helper import login_required
+from helper import get_by_id, login_required
 
 class LikePage(BlogHandler):
     """ Blog like page handler.
@@ -20,20 +22,17 @@ class LikePage(BlogHandler):
         Args:
             post_id (str): Post's id to like.
         """
-        post = Post.get_by_id(int(post_id))
+        post = get_by_id(Post, post_id)
 
-        if not(post and self.user.key().id() != post.user.key().id()):
+        if not(post and not post.is_owner(self.user)):
             return self.redirect('/blog')
 
-        if self.user.likes.filter('post = ', post).get():
-            return self.redirect('/blog/%s' % post.key().id())
+        if Like.add(self.user.key, post.key):
+            recent.record([counter.user_likes(self.user.key)],
+                          Like.make_key(self.user.key, post.key))
+            cache.bump_generation()
 
-        Like(user=self.user, post=post).put()
-
-        # Delay for DB processing.
-        time.sleep(0.1)
-
-        return self.redirect('/blog/%s' % post.key().id())
+        return self.redirect('/blog/%s' % post.key.id())
 
 class UnlikePage(BlogHandler):
     """ Blog unlike page handler.
@@ -45,17 +44,15 @@ class UnlikePage(BlogHandler):
         Args:
             post_id (str): Post's id to unlike.
         """
-        post = Post.get_by_id(int(post_id))
+        post = get_by_id(Post, post_id)
 
-        if not(post and self.user.key().id() != post.user.key().id()):
+        if not(post and not post.is_owner(self.user)):
             return self.redirect('/blog')
 
-        like = self.user.likes.filter('post = ', post).get()
-
-        if like:
-            like.delete()
-
-            # Delay for DB processing.
-            time.sleep(0.1)
+        if Like.remove(self.user.key, post.key):
+            recent.record([counter.user_likes(self.user.key)],
+                          Like.make_key(self.user.key, post.key),
+                          deleted=True)
+            cache.bump_generation()
 
-        return self.redirect('/blog/%s' % post.key().id())
+        return self.redirect('/blog/%s' % post.key.id())
@@ -1,28 +1,35 @@
 """ Handlers for new, edit and delete post.
 """
-import time
-
-from google.appengine.ext import db
-
+from google.appengine.ext import ndb
+
+import cache
+import markup
+import tasks
+from models import cascade
+from models import counter
+from models import recent
+from models import search
 from models.post import Post
-from models.like import Like
 
 from handlers.blog import BlogHandler
 
-from helper import login_required
+from helper import get_by_id, login_required
 
 class NewPostPage(BlogHandler):
     """New post page handler.
     """
-    def render_front(self, subject='', content='', error=''):
+    def render_front(self, subject='', content='', error='',
+                     use_markdown=False):
         """Render new post page with given arguments.
 
         subject (str): Post subject.
         content (str): Post content.
         error (str): Error message to display.
+        use_markdown (bool): Whether content is written in markdown.
         """
         self.render('newpost.html', subject=subject, content=content,
-                    error=error)
+                    error=error, use_markdown=use_markdown,
+                    markdown_available=markup.MARKDOWN_AVAILABLE)
 
     @login_required
     def get(self):
@@ -40,19 +47,26 @@ class NewPostPage(BlogHandler):
         """
         subject = self.request.get('subject')
         content = self.request.get('content')
+        use_markdown = bool(self.request.get('use_markdown'))
 
         if subject and content:
-            post = Post(user=self.user, subject=subject, content=content)
+            post = Post(user=self.user.key, subject=subject,
+                        content=content, use_markdown=use_markdown)
 
-            post.put()
+            counter.run_with_counters(post.put, {
+                counter.POSTS: 1,
+                counter.user_posts(self.user.key): 1,
+            })
 
-            # Delay for DB processing.
-            time.sleep(0.1)
+            recent.record(post.recent_lists(), post.key)
+            cache.bump_generation()
+            cache.bump_feed_generations(post.feed_names())
+            tasks.defer(search.update_post, post.key.id())
 
-            return self.redirect('/blog/%s' % post.key().id())
+            return self.redirect('/blog/%s' % post.key.id())
         else:
             error = 'Subject and Content are needed'
-            self.render_front(subject, content, error)
+            self.render_front(subject, content, error, use_markdown)
 
 
 class EditPostPage(BlogHandler):
@@ -67,11 +81,13 @@ class EditPostPage(BlogHandler):
         Args:
             post_id (str): Post's id.
         """
-        post = Post.get_by_id(int(post_id))
+        post = get_by_id(Post, post_id)
 
-        if post and self.user.key().id() == post.user.key().id():
+        if post and post.is_owner(self.user):
             self.render('editpost.html', subject=post.subject,
-                        content=post.content, error='', post=post)
+                        content=post.content, error='', post=post,
+                        use_markdown=post.use_markdown,
+                        markdown_available=markup.MARKDOWN_AVAILABLE)
         else:
             return self.redirect('/blog')
 
@@ -85,27 +101,34 @@ class EditPostPage(BlogHandler):
         Args:
             post_id (str): Post's id to edit.
         """
-        post = Post.get_by_id(int(post_id))
+        post = get_by_id(Post, post_id)
 
-        if not(post and self.user.key().id() == post.user.key().id()):
+        if not(post and post.is_owner(self.user)):
             return self.redirect('/blog')
 
         subject = self.request.get('subject')
         content = self.request.get('content')
+        use_markdown = bool(self.request.get('use_markdown'))
 
         if subject and content:
             post.subject = subject
             post.content = content
+            post.use_markdown = use_markdown
             post.put()
+            post.invalidate_fragments()
 
-            # Delay for DB processing.
-            time.sleep(0.1)
+            recent.record(post.recent_lists(), post.key)
+            cache.bump_generation()
+            cache.bump_feed_generations(post.feed_names())
+            tasks.defer(search.update_post, post.key.id())
 
-            return self.redirect('/blog/%s' % post.key().id())
+            return self.redirect('/blog/%s' % post.key.id())
         else:
             error = 'Subject and Content are needed'
             self.render('editpost.html', subject=post.subject,
-                        content=post.content, error=error, post=post)
+                        content=post.content, error=error, post=post,
+                        use_markdown=use_markdown,
+                        markdown_available=markup.MARKDOWN_AVAILABLE)
 
 
         return self.redirect('/blog')
@@ -118,19 +141,40 @@ class DeletePostPage(BlogHandler):
     def post(self, post_id):
         """Delete post if given post_id exists.
 
+        Its comments and likes are deleted by a background task.
         If logged out user attempt to access, redirect to login page.
 
         Args:
             post_id (str): Post's id to edit.
         """
-        post = Post.get_by_id(int(post_id))
-
-        if post and self.user.key().id() == post.user.key().id():
-            post.delete()
-
-            db.delete(Like.all().filter('post = ', post))
-
-            # Delay for DB processing.
-            time.sleep(0.1)
+        post = get_by_id(Post, post_id)
+
+        if post and post.is_owner(self.user):
+            def delete_post():
+                """Delete the post and defer deleting its children.
+
+                Nothing is done if it's already deleted, e.g. by a double
+                submit.
+                """
+                if not post.key.get():
+                    raise ndb.Rollback()
+                post.key.delete()
+                tasks.defer(cascade.delete_post_children, post.key,
+                            _transactional=True)
+                tasks.defer(search.update_post, post.key.id(),
+                            _transactional=True)
+                return True
+
+            deleted = counter.run_with_counters(delete_post, {
+                counter.POSTS: -1,
+                counter.user_posts(self.user.key): -1,
+            })
+            if not deleted:
+                return self.redirect('/blog')
+            post.invalidate_fragments()
+
+            recent.record(post.recent_lists(), post.key, deleted=True)
+            cache.bump_generation()
+            cache.bump_feed_generations(post.feed_names())
 
         return self.redirect('/blog')
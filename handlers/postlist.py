@@ -1,25 +1,80 @@
 """Handlers for post list.
+
+Handlers start independent datastore and memcache RPCs together and wait
+for them after, so a page takes as long as its slowest RPC of each step
+rather than the sum of them.
 """
+from google.appengine.ext import ndb
+
+from models import counter
 from models.post import Post
+from models.like import Like
+from models.comment import Comment
+from models.pagination import fetch_page_async
+from models.prefetch import prefetch_refprops_async
 from handlers.blog import BlogHandler
-from helper import login_required
+from helper import login_required, cache_anonymous_page, parse_id
+
+PER_PAGE = 5
+
+def load_posts(posts, liked_user=None):
+    """Load authors, totals and likes of posts in parallel.
+
+    Args:
+        posts (list): Post instances.
+        liked_user (SessionUser): User whose likes are looked up, if any.
+
+    Returns:
+        set: Keys of posts liked_user liked.
+    """
+    post_keys = [post.key for post in posts]
+    users = prefetch_refprops_async(posts, Post.user)
+    counts = Post.get_counts_async(post_keys)
+    liked = Like.liked_post_keys_async(liked_user, post_keys)
+
+    users.get_result()
+    Post.attach_counts(posts, counts.get_result())
+    return liked.get_result()
+
 
 class PostPage(BlogHandler):
     """Post handler.
     """
+    @cache_anonymous_page
     def get(self, post_id):
         """Get post with given post_id and render it.
 
+        The post, its comments, totals and like are fetched together, then
+        users of the post and comments.
+
         Args:
             post_id (str): Post's id to render.
         """
-        post = Post.get_by_id(int(post_id))
+        post_id = parse_id(post_id)
+        if post_id is None:
+            return self.redirect('/blog')
+
+        post_key = ndb.Key(Post, post_id)
+        post_future = post_key.get_async()
+        comments_future = Comment.page_by_post_async(
+            post_key, self.request.get('comments_cursor'))
+        counts = Post.get_counts_async([post_key])
+        liked = Like.liked_post_keys_async(self.user, [post_key])
 
-        if post:
-            self.render('permalink.html', post=post)
-        else:
+        post = post_future.get_result()
+        if not post:
             return self.redirect('/blog')
 
+        comments = comments_future.get_result()
+        users = [prefetch_refprops_async([post], Post.user),
+                 prefetch_refprops_async(comments.items, Comment.user)]
+        Post.attach_counts([post], counts.get_result())
+        for future in users:
+            future.get_result()
+
+        self.render('permalink.html', post=post, comments=comments,
+                    liked=liked.get_result())
+
 
 class LikePostListPage(BlogHandler):
     """My post page handler.
@@ -28,26 +83,25 @@ class LikePostListPage(BlogHandler):
     def get(self):
         """Get logged in user posts from DB and render it.
         """
-        per_page = 5
-        page = self.request.get('page')
-
-        if page:
-            page = int(page)
-        else:
-            page = 1
+        cursor = self.request.get('cursor')
+        user_likes = counter.user_likes(self.user.key)
 
-        likes = self.user.likes
-        nr_posts = likes.count()
-        total_page = nr_posts / per_page
+        def make_query():
+            """Make query of likes of logged in user."""
+            return Like.query(Like.user == self.user.key)
 
-        if nr_posts % per_page:
-            total_page += 1
+        page_future = fetch_page_async(make_query, '__key__', cursor,
+                                       PER_PAGE, user_likes)
+        total = counter.get_counts_async([user_likes])
 
-        offset = per_page * (page - 1)
-        posts = [l.post for l in likes.fetch(limit=per_page, offset=offset)]
+        page = page_future.get_result()
+        post_keys = [like.post for like in page.items]
+        posts = [post for post in ndb.get_multi(post_keys) if post]
+        load_posts(posts)
+        liked = set(post.key for post in posts)
 
         self.render('likeposts.html', posts=posts, page=page,
-                    total_page=total_page)
+                    total=total.get_result()[user_likes], liked=liked)
 
 
 class MyPostListPage(BlogHandler):
@@ -57,52 +111,40 @@ class MyPostListPage(BlogHandler):
     def get(self):
         """Get logged in user posts from DB and render it.
         """
-        per_page = 5
-        page = self.request.get('page')
+        cursor = self.request.get('cursor')
+        user_posts = counter.user_posts(self.user.key)
 
-        if page:
-            page = int(page)
-        else:
-            page = 1
+        def make_query():
+            """Make query of posts of logged in user."""
+            return Post.query(Post.user == self.user.key)
 
-        post_all = Post.all().order('-created')
-        my_posts = post_all.filter('user =', self.user)
-        nr_posts = my_posts.count()
-        total_page = nr_posts / per_page
+        page_future = fetch_page_async(make_query, 'created', cursor,
+                                       PER_PAGE, user_posts)
+        total = counter.get_counts_async([user_posts])
 
-        if nr_posts % per_page:
-            total_page += 1
-
-        offset = per_page * (page - 1)
-        posts = my_posts.fetch(limit=per_page, offset=offset)
+        page = page_future.get_result()
+        posts = page.items
+        load_posts(posts)
 
         self.render('main.html', posts=posts, page=page,
-                    total_page=total_page)
+                    total=total.get_result()[user_posts], liked=set())
 
 
 class MainPage(BlogHandler):
     """Blog main page handler.
     """
+    @cache_anonymous_page
     def get(self):
         """Get posts from DB and render it.
         """
-        per_page = 5
-        page = self.request.get('page')
-
-        if page:
-            page = int(page)
-        else:
-            page = 1
-
-        posts_all = Post.all().order('-created')
-        nr_posts = posts_all.count()
-        total_page = nr_posts / per_page
-
-        if nr_posts % per_page:
-            total_page += 1
+        cursor = self.request.get('cursor')
+        page_future = fetch_page_async(Post.query, 'created', cursor, PER_PAGE,
+                                       counter.POSTS)
+        total = counter.get_counts_async([counter.POSTS])
 
-        offset = per_page * (page - 1)
-        posts = posts_all.fetch(limit=per_page, offset=offset)
+        page = page_future.get_result()
+        posts = page.items
+        liked = load_posts(posts, self.user)
 
         self.render('main.html', posts=posts, page=page,
-                    total_page=total_page)
+                    total=total.get_result()[counter.POSTS], liked=liked)
@@ -106,10 +106,13 @@ class RegisterPage(BlogHandler):
         params = validate_userinfo(username, password, confirmation, email)
 
         if params['has_error']:
-            self.render('signup.html', **params)
-        else:
-            user = User.register(username, password, email)
-            user.put()
+            return self.render('signup.html', **params)
 
+        user = User.register(username, password, email)
+
+        if user:
             self.login(user)
             return self.redirect('/blog')
+        else:
+            params['error_username'] = 'That username already exists.'
+            self.render('signup.html', **params)
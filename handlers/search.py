@@ -0,0 +1,45 @@
+""" Handler for post search.
+"""
+from google.appengine.ext import ndb
+
+from models import search
+from models.post import Post
+
+from handlers.blog import BlogHandler
+from handlers.postlist import load_posts
+
+PER_PAGE = 10
+
+class SearchPage(BlogHandler):
+    """Search page handler.
+    """
+    def get(self):
+        """Render posts matching q, best first.
+
+        Matching ids come from the search index, and only posts of the
+        requested page are loaded with one batched get. Only the best
+        search.MAX_RESULTS posts can be paged, the total counts them all.
+        """
+        query = self.request.get('q').strip()
+        try:
+            start = max(int(self.request.get('start', 0)), 0)
+        except ValueError:
+            start = 0
+
+        results = search.search(query) if query else None
+        post_ids = results.post_ids if results else []
+        page_ids = post_ids[start:start + PER_PAGE]
+        posts = [post for post in
+                 ndb.get_multi([ndb.Key(Post, post_id)
+                                for post_id in page_ids])
+                 if post]
+        liked = load_posts(posts, self.user)
+
+        prev_start = max(start - PER_PAGE, 0) if start > 0 else None
+        next_start = (start + PER_PAGE
+                      if start + PER_PAGE < len(post_ids) else None)
+
+        self.render('search.html', q=query, posts=posts, liked=liked,
+                    total=results.total if results else 0,
+                    shown=len(post_ids), prev_start=prev_start,
+                    next_start=next_start)
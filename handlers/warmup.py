@@ -0,0 +1,16 @@
+"""Handler for warmup requests.
+"""
+import webapp2
+
+import render
+
+class WarmupPage(webapp2.RequestHandler):
+    """Warmup request handler.
+
+    App Engine sends warmup request to a new instance before sending it
+    traffic, so templates are loaded here instead of in user requests.
+    """
+    def get(self):
+        """Preload every template.
+        """
+        render.preload_templates()
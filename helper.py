@@ -1,7 +1,45 @@
 """Helper functions.
 """
+import hashlib
 from functools import wraps
 
+import cache
+
+# Datastore ids are positive 64 bit integers.
+MAX_ID = 2 ** 63 - 1
+
+def parse_id(value):
+    """Parse id of an entity given in url or form.
+
+    Args:
+        value (str): Id string.
+
+    Returns:
+        int: The id if it's a valid datastore id, None otherwise.
+    """
+    try:
+        entity_id = int(value)
+    except (TypeError, ValueError):
+        return None
+    if 0 < entity_id <= MAX_ID:
+        return entity_id
+    return None
+
+def get_by_id(model, value):
+    """Get entity of the model by id given in url or form.
+
+    Args:
+        model (class): Model of the entity.
+        value (str): Id string.
+
+    Returns:
+        Entity if the id is valid and it exists, None otherwise.
+    """
+    entity_id = parse_id(value)
+    if entity_id is None:
+        return None
+    return model.get_by_id(entity_id)
+
 def login_required(function):
     """Decorator function for login required pages.
     """
@@ -13,3 +51,42 @@ def login_required(function):
             return self.redirect('/blog/login')
         return function(self, *args, **kw)
     return decorated_function
+
+def cache_anonymous_page(function):
+    """Decorator function for pages cached for logged out users.
+
+    Pages are cached by url and content generation number, and served with
+    strong ETag, so repeated requests get 304 without datastore work.
+    """
+    @wraps(function)
+    def decorated_function(self, *args, **kw):
+        """Serve cached page if user is not logged in.
+        """
+        if self.user is not None:
+            return function(self, *args, **kw)
+
+        generation = cache.page_generation()
+        if generation is None:
+            return function(self, *args, **kw)
+
+        etag = hashlib.sha1('%s|%s' % (generation,
+                                       self.request.path_qs)).hexdigest()
+
+        if etag in self.request.if_none_match:
+            self.response.status = 304
+            self.set_page_cache_headers(etag)
+            return
+
+        body = cache.get_page(etag)
+        if body is not None:
+            self.set_page_cache_headers(etag)
+            return self.write(body)
+
+        result = function(self, *args, **kw)
+
+        if self.response.status_int == 200:
+            self.set_page_cache_headers(etag)
+            cache.set_page(etag, self.response.body)
+
+        return result
+    return decorated_function
@@ -0,0 +1,197 @@
+"""Per request instrumentation of API calls and template renders.
+
+Middleware wraps the WSGI application and keeps statistics of the request
+being handled in a thread local. API proxy hooks record the count and wall
+time of every datastore, memcache and other API call, and render.py times
+templates with timer().
+
+Totals are sent in a Server-Timing header and logged as a JSON line when
+the response is done. Requests slower than SLOW_REQUEST_MS also log every
+call in order.
+"""
+import collections
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+
+SLOW_REQUEST_MS = int(os.environ.get('SLOW_REQUEST_MS', 500))
+CATEGORIES = {
+    'datastore_v3': 'datastore',
+}
+
+_local = threading.local()
+
+class RequestStats(object):
+    """Statistics of a request.
+
+    Attributes:
+        start (float): Time the request started.
+        totals (OrderedDict): Count and milliseconds of each category.
+        events (list): Category, name and milliseconds of each call.
+    """
+    def __init__(self):
+        self.start = time.time()
+        self.totals = collections.OrderedDict()
+        self.events = []
+        self.pending = {}
+
+    def add(self, category, name, ms):
+        """Record a call.
+
+        Args:
+            category (str): Category of the call, e.g. datastore or render.
+            name (str): Name of the call, e.g. RunQuery or template name.
+            ms (float): Wall time of the call in milliseconds.
+        """
+        count, total = self.totals.get(category, (0, 0.0))
+        self.totals[category] = (count + 1, total + ms)
+        self.events.append((category, name, round(ms, 2)))
+
+    def elapsed_ms(self):
+        """Return milliseconds since the request started.
+        """
+        return (time.time() - self.start) * 1000
+
+    def server_timing(self):
+        """Return Server-Timing header value of totals so far.
+        """
+        metrics = ['%s;dur=%.1f;desc="%d calls"' % (category, total, count)
+                   for category, (count, total) in self.totals.iteritems()]
+        metrics.append('total;dur=%.1f' % self.elapsed_ms())
+        return ', '.join(metrics)
+
+    def summary(self):
+        """Return totals as dict which can be serialized to JSON.
+        """
+        return dict((category, dict(count=count, ms=round(total, 2)))
+                    for category, (count, total) in self.totals.iteritems())
+
+
+def current():
+    """Return statistics of the current request, None if there isn't.
+    """
+    return getattr(_local, 'stats', None)
+
+def record(category, name, ms):
+    """Record a call in the current request, if there is.
+
+    Args:
+        category (str): Category of the call.
+        name (str): Name of the call.
+        ms (float): Wall time of the call in milliseconds.
+    """
+    stats = current()
+    if stats is not None:
+        stats.add(category, name, ms)
+
+@contextlib.contextmanager
+def timer(category, name):
+    """Record wall time of the block in the current request.
+
+        with instrumentation.timer('render', 'post.html'):
+            ...
+
+    Args:
+        category (str): Category of the call.
+        name (str): Name of the call.
+    """
+    start = time.time()
+    try:
+        yield
+    finally:
+        record(category, name, (time.time() - start) * 1000)
+
+def _pre_call(service, call, request, response):
+    """Remember when the API call started.
+    """
+    stats = current()
+    if stats is not None:
+        stats.pending[(id(request), id(response))] = time.time()
+
+def _post_call(service, call, request, response):
+    """Record the API call with the time since it started.
+    """
+    stats = current()
+    if stats is None:
+        return
+    start = stats.pending.pop((id(request), id(response)), None)
+    if start is not None:
+        stats.add(CATEGORIES.get(service, service), call,
+                  (time.time() - start) * 1000)
+
+_hooks_installed = False
+
+def install_hooks():
+    """Install API proxy hooks once.
+
+    The SDK is imported here, so render.py can time templates without it,
+    e.g. when templates are compiled with python render.py.
+    """
+    global _hooks_installed # pylint: disable=global-statement
+    if not _hooks_installed:
+        from google.appengine.api import apiproxy_stub_map
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+            'instrumentation', _pre_call)
+        apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+            'instrumentation', _post_call)
+        _hooks_installed = True
+
+
+class Middleware(object):
+    """WSGI middleware which instruments requests.
+
+    Attributes:
+        app: WSGI application to wrap.
+        slow_request_ms (int): Requests slower than it log every call.
+    """
+    def __init__(self, app, slow_request_ms=SLOW_REQUEST_MS):
+        self.app = app
+        self.slow_request_ms = slow_request_ms
+        install_hooks()
+
+    def __call__(self, environ, start_response):
+        stats = RequestStats()
+        _local.stats = stats
+
+        def instrumented_start_response(status, headers, exc_info=None):
+            """Add Server-Timing header and start response."""
+            headers = list(headers)
+            headers.append(('Server-Timing', stats.server_timing()))
+            return start_response(status, headers, exc_info)
+
+        try:
+            result = self.app(environ, instrumented_start_response)
+        except Exception:
+            self.finish(environ, stats)
+            raise
+
+        return self.iterate(environ, stats, result)
+
+    def iterate(self, environ, stats, result):
+        """Iterate response body and finish the request after it.
+        """
+        try:
+            for chunk in result:
+                yield chunk
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+            self.finish(environ, stats)
+
+    def finish(self, environ, stats):
+        """Log statistics of the request and forget them.
+        """
+        _local.stats = None
+        elapsed_ms = stats.elapsed_ms()
+        line = dict(method=environ.get('REQUEST_METHOD'),
+                    path=environ.get('PATH_INFO'),
+                    ms=round(elapsed_ms, 2), totals=stats.summary())
+
+        if elapsed_ms >= self.slow_request_ms:
+            line['events'] = stats.events
+            logging.warning('slow request %s', json.dumps(line))
+        else:
+            logging.info('request %s', json.dumps(line))
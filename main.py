@@ -2,10 +2,21 @@
 """
 import webapp2
 
+import instrumentation
+
+from handlers.admin import RepairCountersPage, MigrateLikesPage
+from handlers.admin import BackfillUsernamesPage, BackfillContentHtmlPage
+from handlers.admin import CacheStatsPage, ReindexSearchPage
+from handlers.admin import ProfileListPage, ProfilePage
+from handlers.warmup import WarmupPage
+from handlers.api import PostListApi, UserPostListApi, CommentListApi
+from handlers.feed import PostFeed, UserPostFeed
+from handlers.search import SearchPage
 from handlers.register import RegisterPage
 from handlers.login import LoginPage, LogoutPage
 from handlers.post import NewPostPage, EditPostPage, DeletePostPage
 from handlers.comment import NewCommentPage, EditCommentPage, DeleteCommentPage
+from handlers.comment import CommentListPage
 from handlers.like import LikePage, UnlikePage
 from handlers.postlist import PostPage
 from handlers.postlist import LikePostListPage
@@ -20,7 +31,21 @@ class PageNotFoundHandler(webapp2.RequestHandler):
         """
         self.redirect('/blog')
 
-app = webapp2.WSGIApplication([
+routes_app = webapp2.WSGIApplication([
+    ('/admin/repair_counters/?', RepairCountersPage),
+    ('/admin/migrate_likes/?', MigrateLikesPage),
+    ('/admin/backfill_usernames/?', BackfillUsernamesPage),
+    ('/admin/backfill_content_html/?', BackfillContentHtmlPage),
+    ('/admin/reindex_search/?', ReindexSearchPage),
+    ('/admin/cache_stats/?', CacheStatsPage),
+    ('/admin/profiles/?', ProfileListPage),
+    ('/admin/profiles/(\d+)/?', ProfilePage),
+    ('/api/posts/?', PostListApi),
+    ('/api/posts/(\d+)/comments/?', CommentListApi),
+    ('/api/users/([^/]+)/posts/?', UserPostListApi),
+    ('/blog/feed\.(atom|rss)', PostFeed),
+    ('/blog/users/([^/]+)/feed\.(atom|rss)', UserPostFeed),
+    ('/blog/search/?', SearchPage),
     ('/blog/signup/?', RegisterPage),
     ('/blog/login/?', LoginPage),
     ('/blog/logout/?', LogoutPage),
@@ -32,9 +57,13 @@ app = webapp2.WSGIApplication([
     ('/blog/delete_comment/(\d+)/?', DeleteCommentPage),
     ('/blog/like/(\d+)/?', LikePage),
     ('/blog/unlike/(\d+)/?', UnlikePage),
+    ('/blog/(\d+)/comments/?', CommentListPage),
     ('/blog/(\d+)/?', PostPage),
     ('/blog/like_post/?', LikePostListPage),
     ('/blog/my_post/?', MyPostListPage),
     ('/blog/?', MainPage),
+    ('/_ah/warmup', WarmupPage),
     ('/.*', PageNotFoundHandler),
 ], debug=True)
+
+app = instrumentation.Middleware(routes_app)
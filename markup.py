@@ -0,0 +1,124 @@
+"""Convert post and comment content to html.
+
+Content is converted when it's saved, so pages don't have to. Plain text
+is escaped and its newlines become line breaks. Markdown is supported if
+the markdown package is available. It's converted from the raw text, so
+code spans and blockquotes work, and its html is then sanitized with a
+whitelist of tags, attributes and URL schemes.
+"""
+import cgi
+import re
+from HTMLParser import HTMLParser, HTMLParseError
+
+try:
+    import markdown
+except ImportError:
+    markdown = None
+
+MARKDOWN_AVAILABLE = markdown is not None
+
+ALLOWED_TAGS = frozenset([
+    'a', 'blockquote', 'br', 'code', 'em', 'h1', 'h2', 'h3', 'h4', 'h5',
+    'h6', 'hr', 'img', 'li', 'ol', 'p', 'pre', 'strong', 'ul'])
+VOID_TAGS = frozenset(['br', 'hr', 'img'])
+ALLOWED_ATTRIBUTES = {
+    'a': ('href', 'title'),
+    'img': ('src', 'alt', 'title'),
+}
+URL_ATTRIBUTES = frozenset(['href', 'src'])
+# Links and images which don't use these schemes are neutralized.
+SAFE_URL_RE = re.compile(r'(https?://|mailto:|/|#)', re.IGNORECASE)
+
+
+class Sanitizer(HTMLParser):
+    """Html parser which keeps only whitelisted tags and attributes.
+
+    Other tags are escaped, so they show as text, and unclosed tags are
+    closed at the end.
+    """
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.pieces = []
+        self.open_tags = []
+
+    def handle_starttag(self, tag, attrs):
+        """Write the tag with allowed attributes, or escape it."""
+        if tag not in ALLOWED_TAGS:
+            self.pieces.append(cgi.escape(self.get_starttag_text()))
+            return
+
+        pieces = [tag]
+        for name, value in attrs:
+            if name not in ALLOWED_ATTRIBUTES.get(tag, ()):
+                continue
+            value = value or ''
+            if name in URL_ATTRIBUTES and not SAFE_URL_RE.match(value):
+                value = '#'
+            pieces.append('%s="%s"' % (name, cgi.escape(value, quote=True)))
+        self.pieces.append('<%s>' % ' '.join(pieces))
+
+        if tag not in VOID_TAGS:
+            self.open_tags.append(tag)
+
+    def handle_endtag(self, tag):
+        """Close the tag and tags opened in it, if it's open."""
+        if tag not in self.open_tags:
+            return
+        while self.open_tags:
+            open_tag = self.open_tags.pop()
+            self.pieces.append('</%s>' % open_tag)
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        """Write escaped text."""
+        self.pieces.append(cgi.escape(data))
+
+    def handle_entityref(self, name):
+        """Write the entity as it is."""
+        self.pieces.append('&%s;' % name)
+
+    def handle_charref(self, name):
+        """Write the character reference as it is."""
+        self.pieces.append('&#%s;' % name)
+
+    def close(self):
+        """Finish parsing and close tags left open."""
+        HTMLParser.close(self)
+        while self.open_tags:
+            self.pieces.append('</%s>' % self.open_tags.pop())
+
+def sanitize(html):
+    """Remove tags, attributes and URLs which are not whitelisted.
+
+    Html which the parser rejects, e.g. an unknown marked section, is
+    escaped as a whole instead.
+
+    Args:
+        html (str): Html which may be unsafe.
+
+    Returns:
+        str: Html string which is safe to render as it is.
+    """
+    sanitizer = Sanitizer()
+    try:
+        sanitizer.feed(html)
+        sanitizer.close()
+    except HTMLParseError:
+        return cgi.escape(html)
+    return ''.join(sanitizer.pieces)
+
+def to_html(content, use_markdown=False):
+    """Convert content to sanitized html.
+
+    Args:
+        content (str): Content written by user.
+        use_markdown (bool): Convert it as markdown if True.
+
+    Returns:
+        str: Html string which is safe to render as it is.
+    """
+    if use_markdown and MARKDOWN_AVAILABLE:
+        return sanitize(markdown.markdown(content))
+
+    return cgi.escape(content, quote=True).replace('\n', '<br>')
@@ -0,0 +1,166 @@
+"""This module deletes entities which belong to a deleted post.
+
+Comments and likes of a post are deleted in the background by a chain of
+tasks. Each task deletes one keys-only batch and defers the next one with
+its cursor, so a failed task is retried from the same batch. A batch of
+likes is first stored in a LikeBatch with its counter updates, so a
+retried task applies each of them once.
+"""
+import collections
+import logging
+
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+import cache
+import tasks
+from models import counter
+from models import recent
+from models.comment import Comment
+from models.like import Like
+
+BATCH_SIZE = 200
+# Counters updated in one cross group transaction with the LikeBatch,
+# below the limit of 25 entity groups.
+COUNTER_CHUNK_SIZE = 20
+
+
+class LikeBatch(ndb.Model):
+    """DB model for a batch of likes of a deleted post being deleted.
+
+    It's keyed by the post and the cursor of the batch, and stored before
+    any counter is updated. It keeps the batch as it was first read, so a
+    retried task deletes the same likes and updates the same counters even
+    if some likes are already deleted.
+
+    Attributes:
+        likes (list): Keys of the likes of the batch.
+        users (list): Key of the user of each like.
+        names (list): Counter names.
+        deltas (list): Amount to add for each counter.
+        applied (list): Indexes of chunks of counters already updated.
+        next_cursor (str): Query cursor of the next batch, None if it's
+            the last batch.
+    """
+    _use_cache = False
+    _use_memcache = False
+
+    likes = ndb.KeyProperty(repeated=True, indexed=False)
+    users = ndb.KeyProperty(repeated=True, indexed=False)
+    names = ndb.StringProperty(repeated=True, indexed=False)
+    deltas = ndb.IntegerProperty(repeated=True, indexed=False)
+    applied = ndb.IntegerProperty(repeated=True, indexed=False)
+    next_cursor = ndb.StringProperty(indexed=False)
+
+
+def _fetch_keys(model, post_key, cursor):
+    """Fetch a batch of keys of entities of the post.
+
+    Returns:
+        tuple: Keys and the cursor of the next batch, None if it's last.
+    """
+    start_cursor = Cursor(urlsafe=cursor) if cursor else None
+    keys, next_cursor, more = model.query(model.post == post_key).fetch_page(
+        BATCH_SIZE, start_cursor=start_cursor, keys_only=True)
+    if more and next_cursor:
+        return keys, next_cursor.urlsafe()
+    return keys, None
+
+def _delete_comments(post_key, cursor):
+    """Delete a batch of comments of the post.
+
+    Returns:
+        str: Cursor of the next batch, None if it's the last.
+    """
+    keys, next_cursor = _fetch_keys(Comment, post_key, cursor)
+    ndb.delete_multi(keys)
+    return next_cursor
+
+def _store_like_batch(batch_key, post_key, cursor):
+    """Read a batch of likes of the post and store it with its deltas.
+
+    Returns:
+        LikeBatch instance.
+    """
+    keys, next_cursor = _fetch_keys(Like, post_key, cursor)
+    likes = [like for like in ndb.get_multi(keys) if like]
+
+    deltas = collections.defaultdict(int)
+    for like in likes:
+        deltas[counter.user_likes(like.user)] -= 1
+    deltas[counter.post_likes(post_key)] -= len(likes)
+    names = sorted(name for name, delta in deltas.iteritems() if delta)
+
+    like_batch = LikeBatch(key=batch_key, likes=[like.key for like in likes],
+                           users=[like.user for like in likes], names=names,
+                           deltas=[deltas[name] for name in names],
+                           next_cursor=next_cursor)
+    like_batch.put()
+    return like_batch
+
+def _mark_applied(batch_key, chunk):
+    """Mark the chunk of counters of the batch applied.
+
+    It's run by counter.run_with_counters with the deltas of the chunk, so
+    the mark and the counter updates commit together. It rolls back if the
+    chunk is already applied.
+    """
+    like_batch = batch_key.get()
+    if chunk in like_batch.applied:
+        raise ndb.Rollback()
+    like_batch.applied.append(chunk)
+    like_batch.put()
+
+def _delete_likes(post_key, cursor):
+    """Delete a batch of likes of the post and update counters of its users.
+
+    Each chunk of counter updates commits with its mark in the LikeBatch,
+    and likes are deleted after every chunk is applied, so a retried task
+    neither loses nor repeats an update.
+
+    Returns:
+        str: Cursor of the next batch, None if it's the last.
+    """
+    batch_key = ndb.Key(LikeBatch, '%d:%s' % (post_key.id(), cursor or ''))
+    like_batch = batch_key.get()
+    if like_batch is None:
+        like_batch = _store_like_batch(batch_key, post_key, cursor)
+
+    for chunk, start in enumerate(xrange(0, len(like_batch.names),
+                                         COUNTER_CHUNK_SIZE)):
+        if chunk in like_batch.applied:
+            continue
+        end = start + COUNTER_CHUNK_SIZE
+        deltas = dict(zip(like_batch.names[start:end],
+                          like_batch.deltas[start:end]))
+        counter.run_with_counters(_mark_applied, deltas, batch_key, chunk)
+
+    ndb.delete_multi(like_batch.likes)
+    for like_key, user_key in zip(like_batch.likes, like_batch.users):
+        recent.record([counter.user_likes(user_key)], like_key, deleted=True)
+    batch_key.delete()
+    return like_batch.next_cursor
+
+STEPS = [_delete_comments, _delete_likes]
+
+def delete_post_children(post_key, step=0, cursor=None):
+    """Delete comments and likes of the deleted post in batches.
+
+    Args:
+        post_key (ndb.Key): Key of the deleted post.
+        step (int): Index of the kind being deleted.
+        cursor (str): Query cursor of the next batch.
+    """
+    if step == len(STEPS):
+        counter.delete([counter.post_likes(post_key),
+                        counter.post_comments(post_key)])
+        cache.bump_generation()
+        logging.info('Deleted comments and likes of post %d', post_key.id())
+        return
+
+    next_cursor = STEPS[step](post_key, cursor)
+
+    if next_cursor:
+        tasks.defer(delete_post_children, post_key, step, next_cursor)
+    else:
+        tasks.defer(delete_post_children, post_key, step + 1)
@@ -1,36 +1,175 @@
 """This module models blog comment information in post.
 """
-from google.appengine.ext import db
+from google.appengine.ext import ndb
+import markup
 import render
+from cache import FragmentCache
+from models import counter
 from models.user import User
 from models.post import Post
+from models.pagination import fetch_page_async
+from models.prefetch import prefetch_refprops, resolve
 
-class Comment(db.Model):
+FRAGMENTS = FragmentCache('comment-fragment')
+VIEWER_CLASSES = ('owner', 'other')
+PER_PAGE = 20
+
+class Comment(ndb.Model):
     """DB Model for Comment Entity.
 
     This class models blog post information.
 
     Attributes:
-        user (User): User instance which is owner of the post.
-        post (Post): Post instance which is the comment belongs.
+        user (ndb.Key): Key of the user who is owner of the comment.
+        post (ndb.Key): Key of the post which the comment belongs.
         content (text): Content of the comment.
+        content_html (text): Content converted to html when it's saved.
         created (datetime): Created time of the comment.
+        updated (datetime): Last modified time of the comment.
     """
-    user = db.ReferenceProperty(User, collection_name='comments', required=True)
-    post = db.ReferenceProperty(Post, collection_name='comments', required=True)
-    content = db.TextProperty(required=True)
-    created = db.DateTimeProperty(auto_now_add=True)
+    user = ndb.KeyProperty(kind=User, required=True)
+    post = ndb.KeyProperty(kind=Post, required=True)
+    content = ndb.TextProperty(required=True)
+    content_html = ndb.TextProperty()
+    created = ndb.DateTimeProperty(auto_now_add=True)
+    updated = ndb.DateTimeProperty(auto_now=True)
+
+    @property
+    def author(self):
+        """User instance who is owner of the comment.
+
+        It's got without an RPC when the user is prefetched.
+        """
+        return resolve(self, Comment.user)
+
+    def convert_content(self):
+        """Convert content to html and set content_html.
+        """
+        self.content_html = markup.to_html(self.content)
+
+    def html(self):
+        """Return content as html.
+
+        Returns:
+            str: content_html, or html converted now for old comments.
+        """
+        if self.content_html is None:
+            self.convert_content()
+        return self.content_html
+
+    def _pre_put_hook(self):
+        """Convert content to html before the comment is stored.
+        """
+        self.convert_content()
+
+    @classmethod
+    def page_by_post(cls, post, cursor=None, per_page=PER_PAGE):
+        """Fetch a page of comments of the post with their users prefetched.
+
+        Args:
+            post (Post): Post instance which comments belong.
+            cursor (str): Cursor string made by previous page.
+            per_page (int): The number of comments in a page.
+
+        Returns:
+            Page instance of comments ordered by newest first.
+        """
+        page = cls.page_by_post_async(post.key, cursor,
+                                      per_page).get_result()
+        prefetch_refprops(page.items, Comment.user)
+        return page
+
+    @classmethod
+    def page_by_post_async(cls, post_key, cursor=None, per_page=PER_PAGE):
+        """Start fetching a page of comments of the post.
+
+        Users of the comments are not prefetched, so they can be loaded
+        with other entities.
+
+        Args:
+            post_key (ndb.Key): Key of the post which comments belong.
+            cursor (str): Cursor string made by previous page.
+            per_page (int): The number of comments in a page.
+
+        Returns:
+            Future of Page instance of comments ordered by newest first.
+        """
+        def make_query():
+            """Make query of comments of the post."""
+            return Comment.query(Comment.post == post_key)
+
+        return fetch_page_async(make_query, 'created', cursor, per_page,
+                                counter.post_comments(post_key))
+
+    def is_owner(self, user):
+        """Check if the user wrote the comment without loading its user.
+
+        Args:
+            user (SessionUser): User logged in, or None.
+
+        Returns:
+            bool: True if the user is owner of the comment, False otherwise.
+        """
+        return user is not None and self.user == user.key
+
+    def recent_lists(self):
+        """Return names of recent writes lists the comment belongs.
+
+        Returns:
+            list: List names.
+        """
+        return [counter.post_comments(self.post)]
+
+    def post_id(self):
+        """Return id of the post which the comment belongs without loading it.
+
+        Returns:
+            int: Post's id.
+        """
+        return self.post.id()
+
+    def invalidate_fragments(self):
+        """Delete cached html of the comment for every viewer class.
+        """
+        FRAGMENTS.invalidate(['%s:%s' % (self.key.urlsafe(), viewer)
+                              for viewer in VIEWER_CLASSES])
 
     def render(self, user):
         """Renders the post itself.
 
+        Rendered html is cached by the comment and the viewer class, and
+        versioned by everything comment.html reads: the update time, which
+        changes with content, and the author's name.
+
         Args:
-            user (User): User instance logged in.
+            user (SessionUser): User logged in.
 
         Returns:
             str: Rendered html string.
         """
-        # This is needed to render post properly.
-        self._render_text = self.content.replace('\n', '<br>')
+        viewer = 'owner' if self.is_owner(user) else 'other'
+        key = '%s:%s' % (self.key.urlsafe(), viewer)
+        version = (self.updated, self.author.username)
+        html = FRAGMENTS.get(key, version)
 
-        return render.render_str('comment.html', comment=self, user=user)
+        if html is None:
+            html = render.render_str('comment.html', comment=self, user=user)
+            FRAGMENTS.set(key, version, html)
+
+        return html
+
+    def to_dict(self):
+        """Return the comment as dict which can be serialized to JSON.
+
+        The user should be prefetched to avoid a datastore get.
+
+        Returns:
+            dict: Comment's fields.
+        """
+        return dict(id=self.key.id(),
+                    post_id=self.post_id(),
+                    author=self.author.username,
+                    content=self.content,
+                    content_html=self.html(),
+                    created=self.created.isoformat(),
+                    updated=self.updated and self.updated.isoformat())
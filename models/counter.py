@@ -0,0 +1,443 @@
+"""This module models sharded counters for blog totals.
+
+Each counter is split into NUM_SHARDS shard entities with deterministic key
+names, so reading a counter is a single batched get and concurrent writes
+are spread over different entity groups. Totals are cached in memcache.
+"""
+import datetime
+import logging
+import random
+
+from google.appengine.api import memcache
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+import cache
+import tasks
+
+NUM_SHARDS = 10
+CACHE_PREFIX = 'counter:'
+# Seconds cached totals are kept. A total summed from the shards while a
+# write commits can be cached without the write, so this bounds how long a
+# total can lag the shards.
+CACHE_TIME = 300
+
+POSTS = 'posts'
+
+def user_posts(user_key):
+    """Return counter name for the number of posts of the user.
+
+    Args:
+        user_key (ndb.Key): User's key.
+    """
+    return 'user-posts:%d' % user_key.id()
+
+def user_likes(user_key):
+    """Return counter name for the number of posts the user liked.
+
+    Args:
+        user_key (ndb.Key): User's key.
+    """
+    return 'user-likes:%d' % user_key.id()
+
+def post_likes(post_key):
+    """Return counter name for the number of likes of the post.
+
+    Args:
+        post_key (ndb.Key): Post's key.
+    """
+    return 'post-likes:%d' % post_key.id()
+
+def post_comments(post_key):
+    """Return counter name for the number of comments of the post.
+
+    Args:
+        post_key (ndb.Key): Post's key.
+    """
+    return 'post-comments:%d' % post_key.id()
+
+
+class CounterShard(ndb.Model):
+    """DB Model for a shard of a counter.
+
+    Totals are cached in memcache by this module, so shards are not.
+
+    Attributes:
+        name (str): Counter name which the shard belongs.
+        count (int): Partial count of the counter.
+    """
+    _use_memcache = False
+
+    name = ndb.StringProperty(required=True)
+    count = ndb.IntegerProperty(default=0, indexed=False)
+
+    @classmethod
+    def shard_keys(cls, name):
+        """Return keys of every shard of the counter.
+
+        Args:
+            name (str): Counter name.
+
+        Returns:
+            list: ndb.Key list of the shards.
+        """
+        return [ndb.Key(cls, '%s:%d' % (name, index))
+                for index in xrange(NUM_SHARDS)]
+
+
+def get_counts(names):
+    """Get totals of counters.
+
+    Totals are read from memcache, and missing ones are summed from the
+    shards with one batched get.
+
+    Args:
+        names (list): Counter names.
+
+    Returns:
+        dict: Total for each counter name.
+    """
+    return get_counts_async(names).get_result()
+
+@ndb.tasklet
+def get_counts_async(names):
+    """Start getting totals of counters.
+
+    Args:
+        names (list): Counter names.
+
+    Returns:
+        Future of dict of total for each counter name.
+    """
+    names = list(set(names))
+    context = ndb.get_context()
+    cached = yield [context.memcache_get(CACHE_PREFIX + name)
+                    for name in names]
+    counts = dict((name, int(count))
+                  for name, count in zip(names, cached) if count is not None)
+    missing = [name for name in names if name not in counts]
+
+    if missing:
+        keys = []
+        for name in missing:
+            keys.extend(CounterShard.shard_keys(name))
+
+        for name in missing:
+            counts[name] = 0
+        shards = yield ndb.get_multi_async(keys)
+        for shard in shards:
+            if shard:
+                counts[shard.name] += shard.count
+
+        memcache.add_multi(dict((name, counts[name]) for name in missing),
+                           key_prefix=CACHE_PREFIX, time=CACHE_TIME)
+
+    raise ndb.Return(counts)
+
+def get_count(name):
+    """Get total of the counter.
+
+    Args:
+        name (str): Counter name.
+
+    Returns:
+        int: Total of the counter.
+    """
+    return get_counts([name])[name]
+
+def _apply_delta(name, delta):
+    """Add delta to a random shard of the counter.
+
+    This must be called in a transaction.
+
+    Args:
+        name (str): Counter name.
+        delta (int): Amount to add.
+    """
+    shard_id = '%s:%d' % (name, random.randint(0, NUM_SHARDS - 1))
+    shard = CounterShard.get_by_id(shard_id)
+    if shard is None:
+        shard = CounterShard(id=shard_id, name=name)
+    shard.count += delta
+    shard.put()
+
+def _update_cache(deltas):
+    """Apply committed deltas to cached totals.
+
+    Totals which are not cached are left alone, they are summed from the
+    shards on next read.
+
+    Args:
+        deltas (dict): Amount to add for each counter name.
+    """
+    for name, delta in deltas.iteritems():
+        if delta > 0:
+            memcache.incr(CACHE_PREFIX + name, delta)
+        elif delta < 0:
+            memcache.decr(CACHE_PREFIX + name, -delta)
+
+def run_with_counters(function, deltas, *args, **kwargs):
+    """Run function and update counters in one cross group transaction.
+
+    If function raises ndb.Rollback, nothing is written and None is returned.
+
+    Args:
+        function (callable): Function to run in the transaction.
+        deltas (dict): Amount to add for each counter name.
+        *args: Arguments for function.
+        **kwargs: Keyword arguments for function.
+
+    Returns:
+        Return value of function.
+    """
+    applied = []
+
+    def txn():
+        """Run function and apply deltas."""
+        del applied[:]
+        result = function(*args, **kwargs)
+        for name, delta in deltas.iteritems():
+            if delta:
+                _apply_delta(name, delta)
+        applied.append(True)
+        return result
+
+    result = ndb.transaction(txn, xg=True)
+    if applied:
+        _update_cache(deltas)
+    return result
+
+def increment(name, delta=1):
+    """Add delta to the counter in a transaction.
+
+    Args:
+        name (str): Counter name.
+        delta (int): Amount to add.
+    """
+    if delta:
+        ndb.transaction(lambda: _apply_delta(name, delta))
+        _update_cache({name: delta})
+
+def delete(names):
+    """Delete counters.
+
+    Args:
+        names (list): Counter names to delete.
+    """
+    keys = []
+    for name in names:
+        keys.extend(CounterShard.shard_keys(name))
+    ndb.delete_multi(keys)
+    memcache.delete_multi(names, key_prefix=CACHE_PREFIX)
+
+
+REPAIR_BATCH_SIZE = 500
+# Tallies read and written together while counting a batch.
+TALLY_CHUNK_SIZE = 100
+# Counters written in one cross group transaction, which also has the
+# entity group of the repair run, below the limit of 25 groups.
+REPAIR_WRITE_CHUNK_SIZE = 20
+
+
+class CounterTally(ndb.Model):
+    """DB model for a counter recounted by a repair run.
+
+    Tallies are children of the run, so the run reads them back with a
+    strongly consistent query, and they are kept in the datastore rather
+    than passed between repair tasks, which have a size limit.
+
+    Attributes:
+        name (str): Counter name.
+        base (int): Total of the shards when the run first saw the counter.
+        count (int): Total recounted from entities.
+        batches (list): Batches counted, so a retried task counts once.
+        applied (bool): Whether the recount is written to the shards.
+    """
+    _use_cache = False
+    _use_memcache = False
+
+    name = ndb.StringProperty(required=True, indexed=False)
+    base = ndb.IntegerProperty(default=0, indexed=False)
+    count = ndb.IntegerProperty(default=0, indexed=False)
+    batches = ndb.StringProperty(repeated=True, indexed=False)
+    applied = ndb.BooleanProperty(default=False, indexed=False)
+
+    @staticmethod
+    def run_key(run):
+        """Return key of the repair run which tallies belong.
+
+        Args:
+            run (str): Repair run id.
+        """
+        return ndb.Key('CounterRepair', run)
+
+    @classmethod
+    def make_key(cls, run, name):
+        """Return key of the tally of the counter in the run.
+
+        Args:
+            run (str): Repair run id.
+            name (str): Counter name.
+        """
+        return ndb.Key(cls, name, parent=cls.run_key(run))
+
+
+def _shard_totals(names):
+    """Sum shards of counters, skipping memcache."""
+    keys = []
+    for name in names:
+        keys.extend(CounterShard.shard_keys(name))
+
+    totals = dict((name, 0) for name in names)
+    for shard in ndb.get_multi(keys):
+        if shard:
+            totals[shard.name] += shard.count
+    return totals
+
+def _add_tallies(run, batch, tallies):
+    """Add counts of a batch to the tallies of the run.
+
+    Args:
+        run (str): Repair run id.
+        batch (str): Id of the batch, unique in the run.
+        tallies (dict): Count of the batch for each counter name.
+    """
+    names = sorted(tallies)
+    for i in xrange(0, len(names), TALLY_CHUNK_SIZE):
+        chunk = names[i:i + TALLY_CHUNK_SIZE]
+        entities = ndb.get_multi([CounterTally.make_key(run, name)
+                                  for name in chunk])
+        bases = _shard_totals([name for name, entity in zip(chunk, entities)
+                               if entity is None])
+
+        changed = []
+        for name, entity in zip(chunk, entities):
+            if entity is None:
+                entity = CounterTally(key=CounterTally.make_key(run, name),
+                                      name=name, base=bases[name])
+            if batch not in entity.batches:
+                entity.count += tallies[name]
+                entity.batches.append(batch)
+                changed.append(entity)
+        ndb.put_multi(changed)
+
+def _tally_posts(posts, tallies):
+    """Count posts for each user."""
+    for post in posts:
+        tallies[POSTS] = tallies.get(POSTS, 0) + 1
+        name = user_posts(post.user)
+        tallies[name] = tallies.get(name, 0) + 1
+
+def _tally_likes(likes, tallies):
+    """Count likes for each user and post."""
+    for like in likes:
+        for name in (user_likes(like.user), post_likes(like.post)):
+            tallies[name] = tallies.get(name, 0) + 1
+
+def _tally_comments(comments, tallies):
+    """Count comments for each post."""
+    for comment in comments:
+        name = post_comments(comment.post)
+        tallies[name] = tallies.get(name, 0) + 1
+
+def _note_counters(run, batch, start_cursor):
+    """Add counters which exist to the run, so unused ones become zero."""
+    shards, next_cursor, more = CounterShard.query(
+        projection=[CounterShard.name], distinct=True).fetch_page(
+            REPAIR_BATCH_SIZE, start_cursor=start_cursor)
+    _add_tallies(run, batch, dict((shard.name, 0) for shard in shards))
+    return next_cursor, more
+
+def _count_step(model, tally):
+    """Return repair step which counts a batch of entities of the model."""
+    def count(run, batch, start_cursor):
+        """Count a batch of entities into the tallies of the run."""
+        entities, next_cursor, more = model.query().fetch_page(
+            REPAIR_BATCH_SIZE, start_cursor=start_cursor)
+        tallies = {}
+        tally(entities, tallies)
+        _add_tallies(run, batch, tallies)
+        return next_cursor, more
+    return count
+
+def _write_tallies(run, batch, start_cursor):
+    """Write a chunk of recounts of the run to the shards.
+
+    Each recount is added as the difference from the total the counter had
+    when the run first saw it, so writes made during the repair are kept.
+    """
+    keys, next_cursor, more = CounterTally.query(
+        ancestor=CounterTally.run_key(run)).fetch_page(
+            REPAIR_WRITE_CHUNK_SIZE, start_cursor=start_cursor,
+            keys_only=True)
+
+    def txn():
+        """Apply recounts not applied yet, and mark them applied."""
+        written = [tally for tally in ndb.get_multi(keys)
+                   if tally and not tally.applied]
+        for tally in written:
+            if tally.count != tally.base:
+                _apply_delta(tally.name, tally.count - tally.base)
+            tally.applied = True
+        ndb.put_multi(written)
+        return written
+
+    written = ndb.transaction(txn, xg=True)
+    memcache.delete_multi([tally.name for tally in written],
+                          key_prefix=CACHE_PREFIX)
+    return next_cursor, more
+
+def _delete_tallies(run, batch, start_cursor):
+    """Delete a batch of tallies of the finished run."""
+    keys, next_cursor, more = CounterTally.query(
+        ancestor=CounterTally.run_key(run)).fetch_page(
+            REPAIR_BATCH_SIZE, start_cursor=start_cursor, keys_only=True)
+    ndb.delete_multi(keys)
+    return next_cursor, more
+
+def repair_counters(run=None, step=0, cursor=None, batch=0):
+    """Recompute every counter from scratch.
+
+    This runs as a chain of deferred tasks, each of which handles one
+    batch. Counters which exist are noted first, then posts, likes and
+    comments are counted into CounterTally entities, and last the recounts
+    are written to the shards in small transactions.
+
+    Likes and comments written during the repair are kept, but one written
+    while its kind is being counted may be counted twice. Run it again
+    when writes are quiet if totals must be exact.
+
+    Args:
+        run (str): Repair run id, made by the first task.
+        step (int): Index of the step being run.
+        cursor (str): Query cursor of the next batch.
+        batch (int): Index of the batch in the step.
+    """
+    from models.post import Post
+    from models.like import Like
+    from models.comment import Comment
+
+    steps = [_note_counters,
+             _count_step(Post, _tally_posts),
+             _count_step(Like, _tally_likes),
+             _count_step(Comment, _tally_comments),
+             _write_tallies,
+             _delete_tallies]
+
+    if run is None:
+        run = datetime.datetime.utcnow().strftime('%Y%m%d%H%M%S%f')
+
+    if step == len(steps):
+        cache.bump_generation()
+        logging.info('Repaired counters in run %s', run)
+        return
+
+    start_cursor = Cursor(urlsafe=cursor) if cursor else None
+    next_cursor, more = steps[step](run, '%d:%d' % (step, batch),
+                                    start_cursor)
+
+    if more and next_cursor:
+        tasks.defer(repair_counters, run, step, next_cursor.urlsafe(),
+                    batch + 1)
+    else:
+        tasks.defer(repair_counters, run, step + 1)
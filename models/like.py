@@ -1,17 +1,174 @@
 """This module models blog like post information.
 """
-from google.appengine.ext import db
+import logging
+
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+import cache
+import tasks
+from models import counter
 from models.user import User
 from models.post import Post
 
-class Like(db.Model):
+MIGRATION_BATCH_SIZE = 100
+
+class Like(ndb.Model):
     """DB Model for Like Entity.
 
-    This class models like post information.
+    This class models like post information. Key name of a like is made from
+    the user and the post, so a user can like a post only once.
 
     Attributes:
-        user (User): User instance which is owner of the post.
-        post (Post): Post instance which is the comment belongs.
+        user (ndb.Key): Key of the user who likes the post.
+        post (ndb.Key): Key of the liked post.
     """
-    user = db.ReferenceProperty(User, collection_name='likes', required=True)
-    post = db.ReferenceProperty(Post, collection_name='liked_by', required=True)
+    user = ndb.KeyProperty(kind=User, required=True)
+    post = ndb.KeyProperty(kind=Post, required=True)
+
+    @staticmethod
+    def make_key_name(user_key, post_key):
+        """Make key name of like from user and post.
+
+        Args:
+            user_key (ndb.Key): Key of the user who likes the post.
+            post_key (ndb.Key): Key of the liked post.
+
+        Returns:
+            str: Key name of the like.
+        """
+        return 'u%d-p%d' % (user_key.id(), post_key.id())
+
+    @classmethod
+    def make_key(cls, user_key, post_key):
+        """Make key of like from user and post.
+
+        Args:
+            user_key (ndb.Key): Key of the user who likes the post.
+            post_key (ndb.Key): Key of the liked post.
+
+        Returns:
+            ndb.Key: Key of the like.
+        """
+        return ndb.Key(cls, cls.make_key_name(user_key, post_key))
+
+    @classmethod
+    def liked_post_keys(cls, user, posts):
+        """Find posts the user liked among posts with one batched get.
+
+        Args:
+            user (SessionUser): User logged in, or None.
+            posts (list): Post instances to check.
+
+        Returns:
+            set: Keys of posts the user liked.
+        """
+        return cls.liked_post_keys_async(
+            user, [post.key for post in posts]).get_result()
+
+    @classmethod
+    @ndb.tasklet
+    def liked_post_keys_async(cls, user, post_keys):
+        """Start finding posts the user liked among posts of the keys.
+
+        Args:
+            user (SessionUser): User logged in, or None.
+            post_keys (list): Keys of posts to check.
+
+        Returns:
+            Future of set of keys of posts the user liked.
+        """
+        if not (user and post_keys):
+            raise ndb.Return(set())
+
+        keys = [cls.make_key(user.key, post_key) for post_key in post_keys]
+        likes = yield ndb.get_multi_async(keys)
+        raise ndb.Return(set(like.post for like in likes if like))
+
+    @classmethod
+    def add(cls, user_key, post_key):
+        """Like the post in a transaction unless the user already liked it.
+
+        Args:
+            user_key (ndb.Key): Key of the user who likes the post.
+            post_key (ndb.Key): Key of the post to like.
+
+        Returns:
+            bool: True if like is created, False otherwise.
+        """
+        key = cls.make_key(user_key, post_key)
+
+        def txn():
+            """Put like if it doesn't exist."""
+            if key.get():
+                raise ndb.Rollback()
+            cls(key=key, user=user_key, post=post_key).put()
+            return True
+
+        deltas = {counter.user_likes(user_key): 1,
+                  counter.post_likes(post_key): 1}
+        return bool(counter.run_with_counters(txn, deltas))
+
+    @classmethod
+    def remove(cls, user_key, post_key):
+        """Unlike the post in a transaction if the user liked it.
+
+        Args:
+            user_key (ndb.Key): Key of the user who liked the post.
+            post_key (ndb.Key): Key of the post to unlike.
+
+        Returns:
+            bool: True if like is deleted, False otherwise.
+        """
+        key = cls.make_key(user_key, post_key)
+
+        def txn():
+            """Delete like if it exists."""
+            if not key.get():
+                raise ndb.Rollback()
+            key.delete()
+            return True
+
+        deltas = {counter.user_likes(user_key): -1,
+                  counter.post_likes(post_key): -1}
+        return bool(counter.run_with_counters(txn, deltas))
+
+
+def migrate_likes(cursor=None, migrated=0):
+    """Re-key likes made before deterministic key names.
+
+    This runs as a chain of deferred tasks. Each task moves one batch of
+    likes with id keys to key names made by Like.make_key_name, and deletes
+    duplicated likes. It can be rerun safely. When it's done, counters are
+    repaired because duplicated likes were counted.
+
+    Args:
+        cursor (str): Query cursor of the next batch.
+        migrated (int): The number of likes migrated so far.
+    """
+    start_cursor = Cursor(urlsafe=cursor) if cursor else None
+    likes, next_cursor, more = Like.query().fetch_page(
+        MIGRATION_BATCH_SIZE, start_cursor=start_cursor)
+    legacy = {}
+    for like in likes:
+        if like.key.string_id() is None:
+            key = Like.make_key(like.user, like.post)
+            legacy.setdefault(key, []).append(like)
+
+    if legacy:
+        keys = legacy.keys()
+        existing = set(like.key for like in ndb.get_multi(keys) if like)
+        new_likes = [Like(key=key, user=olds[0].user, post=olds[0].post)
+                     for key, olds in legacy.iteritems()
+                     if key not in existing]
+        ndb.put_multi(new_likes)
+        ndb.delete_multi([old.key for olds in legacy.itervalues()
+                          for old in olds])
+        migrated += len(new_likes)
+
+    if more and next_cursor:
+        tasks.defer(migrate_likes, next_cursor.urlsafe(), migrated)
+    else:
+        cache.bump_generation()
+        logging.info('Migrated %d likes', migrated)
+        tasks.defer(counter.repair_counters)
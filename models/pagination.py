@@ -0,0 +1,240 @@
+"""This module provides keyset pagination for blog list queries.
+
+Pages are addressed by an opaque cursor which holds the direction and the
+boundary value of the ordering property, so fetching any page costs the same
+no matter how deep it is. Entities are ordered by key after the property,
+and the cursor holds the key too, so entities with the same value are
+neither skipped nor repeated at page boundaries.
+"""
+import base64
+import datetime
+
+from google.appengine.ext import ndb
+from google.net.proto.ProtocolBuffer import ProtocolBufferDecodeError
+
+from models import recent
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+def _encode_value(value):
+    """Encode ordering property value to string.
+
+    Args:
+        value: datetime or ndb.Key value of ordering property.
+
+    Returns:
+        str: Encoded value.
+    """
+    if isinstance(value, datetime.datetime):
+        delta = value - EPOCH
+        micros = (delta.days * 86400 + delta.seconds) * 1000000
+        return 'd%d' % (micros + delta.microseconds)
+    return 'k%s' % value.urlsafe()
+
+def _decode_value(value):
+    """Decode string made by _encode_value.
+
+    Args:
+        value (str): Encoded value.
+
+    Returns:
+        datetime or ndb.Key value of ordering property.
+    """
+    if value.startswith('d'):
+        return EPOCH + datetime.timedelta(microseconds=int(value[1:]))
+    return ndb.Key(urlsafe=value[1:])
+
+def encode_cursor(direction, value):
+    """Make opaque cursor string.
+
+    Args:
+        direction (str): 'next' or 'prev'.
+        value: Boundary value of ordering property, or tuple of it and the
+            boundary key.
+
+    Returns:
+        str: Url safe cursor string.
+    """
+    values = value if isinstance(value, tuple) else (value,)
+    raw = '|'.join([direction] + [_encode_value(v) for v in values])
+    return base64.urlsafe_b64encode(raw).rstrip('=')
+
+def decode_cursor(cursor, prop):
+    """Decode cursor string made by encode_cursor.
+
+    Args:
+        cursor (str): Cursor string.
+        prop (str): Ordering property name of the page.
+
+    Returns:
+        tuple: (direction, value) if cursor is valid for the ordering,
+            (None, None) otherwise. value is a tuple of the value and the
+            key unless prop is '__key__'.
+    """
+    if not cursor:
+        return None, None
+
+    try:
+        cursor = str(cursor)
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        parts = raw.split('|')
+        direction = parts[0]
+        size = 2 if prop == '__key__' else 3
+        if direction not in ('next', 'prev') or len(parts) != size:
+            return None, None
+        values = tuple(_decode_value(value) for value in parts[1:])
+        return direction, values[0] if len(values) == 1 else values
+    except (TypeError, ValueError, ProtocolBufferDecodeError,
+            UnicodeEncodeError):
+        return None, None
+
+def _sort_value(entity, prop):
+    """Return value of ordering property of entity, and its key after it.
+    """
+    if prop == '__key__':
+        return entity.key
+    return getattr(entity, prop), entity.key
+
+def _property(query, prop):
+    """Return property of the model of the query to filter and order by.
+    """
+    # pylint: disable=protected-access
+    model = ndb.Model._lookup_model(query.kind)
+    if prop == '__key__':
+        return model._key
+    return getattr(model, prop)
+
+
+def _make_queries(make_query, prop, direction, value):
+    """Make queries of entities beyond the cursor, nearest first.
+
+    A boundary of value and key needs two queries, since a query can't
+    filter (prop < value) or (prop == value and key < key). The first gets
+    entities with the same value, the second ones beyond it.
+
+    Returns:
+        list: Queries whose results are in order one after another.
+    """
+    query = make_query()
+    order_prop = _property(query, prop)
+    if prop == '__key__':
+        ascending = [order_prop]
+    else:
+        key_prop = _property(query, '__key__')
+        ascending = [order_prop, key_prop]
+    descending = [-order for order in ascending]
+
+    if direction is None:
+        return [query.order(*descending)]
+
+    if prop == '__key__':
+        bound, key = value, None
+    else:
+        bound, key = value
+
+    if direction == 'prev':
+        queries = [query.filter(order_prop > bound).order(*ascending)]
+        if key is not None:
+            queries.insert(0, make_query().filter(
+                order_prop == bound, key_prop > key).order(key_prop))
+    else:
+        queries = [query.filter(order_prop < bound).order(*descending)]
+        if key is not None:
+            queries.insert(0, make_query().filter(
+                order_prop == bound, key_prop < key).order(-key_prop))
+    return queries
+
+
+class Page(object):
+    """A page of entities.
+
+    Attributes:
+        items (list): Entities in the page.
+        next_cursor (str): Cursor of the next page, None if it's last page.
+        prev_cursor (str): Cursor of the previous page, None if it's first.
+    """
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+
+def fetch_page(make_query, prop, cursor=None, per_page=5, recent_list=None):
+    """Fetch a page of entities ordered by prop descending.
+
+    Args:
+        make_query (callable): Returns new filtered query without order.
+        prop (str): Ordering property name. It can be '__key__'.
+        cursor (str): Cursor string made by previous page.
+        per_page (int): The number of entities in a page.
+        recent_list (str): Name of recent writes list to merge, if any.
+
+    Returns:
+        Page instance.
+    """
+    return fetch_page_async(make_query, prop, cursor, per_page,
+                            recent_list).get_result()
+
+@ndb.tasklet
+def fetch_page_async(make_query, prop, cursor=None, per_page=5,
+                     recent_list=None):
+    """Start fetching a page of entities ordered by prop descending.
+
+    The queries and the read of recent writes are started together.
+
+    Args:
+        make_query (callable): Returns new filtered query without order.
+        prop (str): Ordering property name. It can be '__key__'.
+        cursor (str): Cursor string made by previous page.
+        per_page (int): The number of entities in a page.
+        recent_list (str): Name of recent writes list to merge, if any.
+
+    Returns:
+        Future of Page instance.
+    """
+    direction, value = decode_cursor(cursor, prop)
+
+    results = [query.fetch_async(per_page + 1) for query in
+               _make_queries(make_query, prop, direction, value)]
+    entries = recent.get_entries_async(recent_list) if recent_list else None
+    items = [item for batch in (yield results) for item in batch]
+    items = items[:per_page + 1]
+
+    if entries:
+        sort_key = lambda entity: _sort_value(entity, prop)
+        in_range = None
+        if direction == 'prev':
+            in_range = lambda entity: sort_key(entity) > value
+        elif direction == 'next':
+            in_range = lambda entity: sort_key(entity) < value
+        items = yield recent.merge_entries_async(
+            (yield entries), items, sort_key, in_range,
+            reverse=direction != 'prev')
+        items = items[:per_page + 1]
+
+    has_more = len(items) > per_page
+    items = items[:per_page]
+
+    if direction == 'prev':
+        if not has_more:
+            # Reached the first page, so fill it up from the beginning.
+            page = yield fetch_page_async(make_query, prop, None, per_page,
+                                          recent_list)
+            raise ndb.Return(page)
+        items.reverse()
+
+    if not items:
+        if direction == 'next':
+            raise ndb.Return(Page(items,
+                                  prev_cursor=encode_cursor('prev', value)))
+        raise ndb.Return(Page(items))
+
+    next_cursor = None
+    prev_cursor = None
+
+    if direction == 'prev' or has_more:
+        next_cursor = encode_cursor('next', _sort_value(items[-1], prop))
+    if direction is not None:
+        prev_cursor = encode_cursor('prev', _sort_value(items[0], prop))
+
+    raise ndb.Return(Page(items, next_cursor, prev_cursor))
@@ -1,35 +1,249 @@
 """This module models blog post information.
 """
-from google.appengine.ext import db
+import logging
+
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+import cache
+import markup
 import render
-from models.user import User
+import tasks
+from cache import FragmentCache
+from models import counter
+from models.prefetch import resolve
+from models.user import User, normalize_username
+
+FRAGMENTS = FragmentCache('post-fragment')
+VIEWER_CLASSES = ('anonymous', 'owner', 'other', 'other-liked')
+BACKFILL_BATCH_SIZE = 100
+ALL_FEED = 'all'
+
+def user_feed(username):
+    """Return name of the feed of posts of the user.
 
-class Post(db.Model):
+    Args:
+        username (str): User's name.
+
+    Returns:
+        str: Feed name.
+    """
+    return 'user:%s' % normalize_username(username)
+
+
+class Post(ndb.Model):
     """DB Model for Post Entity.
 
     This class models blog post information.
 
     Attributes:
-        user (User): User instance what is owner of the post.
+        user (ndb.Key): Key of the user who is owner of the post.
         subject (str): Subject of the post.
         content (text): Content of the post.
+        content_html (text): Content converted to html when it's saved.
+        use_markdown (bool): Whether content is written in markdown.
         created (datetime): Created time of the post.
+        updated (datetime): Last modified time of the post.
     """
-    user = db.ReferenceProperty(User, collection_name='posts', required=True)
-    subject = db.StringProperty(required=True)
-    content = db.TextProperty(required=True)
-    created = db.DateTimeProperty(auto_now_add=True)
+    user = ndb.KeyProperty(kind=User, required=True)
+    subject = ndb.StringProperty(required=True)
+    content = ndb.TextProperty(required=True)
+    content_html = ndb.TextProperty()
+    use_markdown = ndb.BooleanProperty(default=False)
+    created = ndb.DateTimeProperty(auto_now_add=True)
+    updated = ndb.DateTimeProperty(auto_now=True)
+
+    @property
+    def author(self):
+        """User instance who is owner of the post.
+
+        It's got without an RPC when the user is prefetched.
+        """
+        return resolve(self, Post.user)
+
+    def convert_content(self):
+        """Convert content to html and set content_html.
+        """
+        self.content_html = markup.to_html(self.content, self.use_markdown)
+
+    def html(self):
+        """Return content as html.
+
+        Returns:
+            str: content_html, or html converted now for old posts.
+        """
+        if self.content_html is None:
+            self.convert_content()
+        return self.content_html
+
+    def _pre_put_hook(self):
+        """Convert content to html before the post is stored.
+        """
+        self.convert_content()
+
+    def is_owner(self, user):
+        """Check if the user wrote the post without loading its user.
+
+        Args:
+            user (SessionUser): User logged in, or None.
+
+        Returns:
+            bool: True if the user is owner of the post, False otherwise.
+        """
+        return user is not None and self.user == user.key
+
+    def recent_lists(self):
+        """Return names of recent writes lists the post belongs.
+
+        Returns:
+            list: List names.
+        """
+        return [counter.POSTS, counter.user_posts(self.user)]
+
+    def feed_names(self):
+        """Return names of feeds the post appears.
+
+        Returns:
+            list: Feed names.
+        """
+        return [ALL_FEED, user_feed(self.author.username)]
+
+    @classmethod
+    def attach_counts(cls, posts, counts=None):
+        """Attach like and comment totals to posts with one batched read.
 
-    def render(self, user):
+        Args:
+            posts (list): Post instances.
+            counts (dict): Totals got by get_counts_async, read now if it's
+                None.
+
+        Returns:
+            list: Given posts.
+        """
+        if counts is None:
+            counts = cls.get_counts_async(
+                [post.key for post in posts]).get_result()
+
+        for post in posts:
+            post._like_count, post._comment_count = counts[post.key]
+
+        return posts
+
+    @staticmethod
+    @ndb.tasklet
+    def get_counts_async(post_keys):
+        """Start reading like and comment totals of posts of the keys.
+
+        Args:
+            post_keys (list): Keys of posts.
+
+        Returns:
+            Future of dict of (like total, comment total) by post key.
+        """
+        names = []
+        for post_key in post_keys:
+            names.append(counter.post_likes(post_key))
+            names.append(counter.post_comments(post_key))
+
+        counts = yield counter.get_counts_async(names)
+        raise ndb.Return(dict(
+            (post_key, (counts[counter.post_likes(post_key)],
+                        counts[counter.post_comments(post_key)]))
+            for post_key in post_keys))
+
+    def _viewer_class(self, user, liked):
+        """Return class of the viewer which decides how the post looks.
+        """
+        if user is None:
+            return 'anonymous'
+        if self.is_owner(user):
+            return 'owner'
+        if self.key in liked:
+            return 'other-liked'
+        return 'other'
+
+    def invalidate_fragments(self):
+        """Delete cached html of the post for every viewer class.
+        """
+        FRAGMENTS.invalidate(['%s:%s' % (self.key.urlsafe(), viewer)
+                              for viewer in VIEWER_CLASSES])
+
+    def render(self, user, liked=frozenset()):
         """Renders the post itself.
 
+        Rendered html is cached by the post and the viewer class, and
+        versioned by everything post.html reads: the update time, the
+        author's name and the like and comment totals. Totals come from
+        counters, so a fragment lags a like or comment at most as long as
+        counter.CACHE_TIME.
+
         Args:
-            user (User): User instance logged in.
+            user (SessionUser): User logged in.
+            liked (set): Keys of posts the user liked.
 
         Returns:
             str: Rendered html string.
         """
-        # This is needed to render post properly.
-        self._render_text = self.content.replace('\n', '<br>')
+        if not hasattr(self, '_like_count'):
+            Post.attach_counts([self])
+
+        key = '%s:%s' % (self.key.urlsafe(),
+                         self._viewer_class(user, liked))
+        version = (self.updated, self.author.username, self._like_count,
+                   self._comment_count)
+        html = FRAGMENTS.get(key, version)
+
+        if html is None:
+            html = render.render_str('post.html', post=self, user=user,
+                                     liked=liked)
+            FRAGMENTS.set(key, version, html)
+
+        return html
+
+    def to_dict(self):
+        """Return the post as dict which can be serialized to JSON.
+
+        Like and comment totals must be attached and the user should be
+        prefetched to avoid datastore gets for each post.
+
+        Returns:
+            dict: Post's fields.
+        """
+        if not hasattr(self, '_like_count'):
+            Post.attach_counts([self])
+
+        return dict(id=self.key.id(),
+                    author=self.author.username,
+                    subject=self.subject,
+                    content=self.content,
+                    content_html=self.html(),
+                    created=self.created.isoformat(),
+                    updated=self.updated and self.updated.isoformat(),
+                    likes=self._like_count,
+                    comments=self._comment_count)
+
+
+def backfill_content_html(model, cursor=None, converted=0):
+    """Convert content of entities saved before content_html to html.
+
+    This runs as a chain of deferred tasks, each of which converts one
+    batch of entities of the model.
+
+    Args:
+        model (class): Post or Comment.
+        cursor (str): Query cursor of the next batch.
+        converted (int): The number of entities converted so far.
+    """
+    start_cursor = Cursor(urlsafe=cursor) if cursor else None
+    entities, next_cursor, more = model.query().fetch_page(
+        BACKFILL_BATCH_SIZE, start_cursor=start_cursor)
+    missing = [entity for entity in entities if entity.content_html is None]
+    ndb.put_multi(missing)
+    converted += len(missing)
 
-        return render.render_str('post.html', post=self, user=user)
+    if more and next_cursor:
+        tasks.defer(backfill_content_html, model, next_cursor.urlsafe(),
+                    converted)
+    else:
+        cache.bump_generation()
+        logging.info('Converted content of %d %s entities', converted,
+                     model._get_kind()) # pylint: disable=protected-access
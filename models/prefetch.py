@@ -0,0 +1,75 @@
+"""This module prefetches KeyProperty values of entity lists.
+
+Getting the entity of a KeyProperty costs a datastore get for each entity.
+prefetch_refprops loads them for a whole list with one batched get, and
+resolve() returns them afterwards without another RPC.
+"""
+from google.appengine.ext import ndb
+
+def prefetch_refprops(entities, *props):
+    """Load entities of key properties of entities with one batched get.
+
+    Args:
+        entities (list): Model instances to prefetch.
+        *props: KeyProperty of the model to load, e.g. Post.user.
+
+    Returns:
+        list: Given entities.
+    """
+    return prefetch_refprops_async(entities, *props).get_result()
+
+@ndb.tasklet
+def prefetch_refprops_async(entities, *props):
+    """Start loading entities of key properties with one batched get.
+
+    Args:
+        entities (list): Model instances to prefetch.
+        *props: KeyProperty of the model to load, e.g. Post.user.
+
+    Returns:
+        Future of given entities, which are resolved when it's done.
+    """
+    # pylint: disable=protected-access
+    fields = [(entity, prop._code_name) for entity in entities
+              for prop in props]
+    keys = list(set(getattr(entity, name) for entity, name in fields
+                    if getattr(entity, name) is not None))
+    ref_entities = yield ndb.get_multi_async(keys) if keys else []
+    ref_entities = dict(zip(keys, ref_entities))
+
+    for entity, name in fields:
+        ref_entity = ref_entities.get(getattr(entity, name))
+        # Dangling references are left alone to be loaded on access.
+        if ref_entity is not None:
+            _resolved(entity)[name] = ref_entity
+
+    raise ndb.Return(entities)
+
+def _resolved(entity):
+    """Return dict of resolved entities of key properties of entity.
+    """
+    resolved = entity.__dict__.get('_resolved_refs')
+    if resolved is None:
+        resolved = entity.__dict__['_resolved_refs'] = {}
+    return resolved
+
+def resolve(entity, prop):
+    """Return entity of key property, prefetched or loaded by a get.
+
+    Args:
+        entity (ndb.Model): Model instance which has the property.
+        prop (ndb.KeyProperty): Key property to resolve.
+
+    Returns:
+        Referenced entity, None if it doesn't exist.
+    """
+    name = prop._code_name # pylint: disable=protected-access
+    key = getattr(entity, name)
+    ref_entity = _resolved(entity).get(name)
+    if ref_entity is None or ref_entity.key != key:
+        if key is None:
+            return None
+        ref_entity = key.get()
+        if ref_entity is not None:
+            _resolved(entity)[name] = ref_entity
+    return ref_entity
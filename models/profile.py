@@ -0,0 +1,46 @@
+"""This module models profiles of sampled requests.
+"""
+import json
+
+from google.appengine.ext import ndb
+
+class ProfileRecord(ndb.Model):
+    """DB model for profile of a request.
+
+    Attributes:
+        method (str): HTTP method of the request.
+        path (str): Path and query string of the request.
+        duration_ms (float): Wall time of the handler in milliseconds.
+        reason (str): 'header' if an admin asked for it, 'sample' otherwise.
+        top_functions (text): JSON list of the functions which took most
+            time, with their calls, own time and cumulative time.
+        collapsed (text): Call stacks in collapsed format of flame graphs.
+        created (datetime): Time the profile was stored.
+    """
+    method = ndb.StringProperty(indexed=False)
+    path = ndb.StringProperty(indexed=False)
+    duration_ms = ndb.FloatProperty(indexed=False)
+    reason = ndb.StringProperty(indexed=False)
+    top_functions = ndb.TextProperty()
+    collapsed = ndb.TextProperty()
+    created = ndb.DateTimeProperty(auto_now_add=True)
+
+    @classmethod
+    def recent(cls, limit=50):
+        """Return profiles stored most recently.
+
+        Args:
+            limit (int): The maximum number of profiles.
+
+        Returns:
+            list: ProfileRecord instances, newest first.
+        """
+        return cls.query().order(-cls.created).fetch(limit)
+
+    def functions(self):
+        """Return top functions of the profile.
+
+        Returns:
+            list: Dict of name, calls, own_ms and cumulative_ms.
+        """
+        return json.loads(self.top_functions or '[]')
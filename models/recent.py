@@ -0,0 +1,132 @@
+"""This module keeps recent writes of eventually consistent lists.
+
+Queries may not see an entity for a while after it's written. Write
+handlers record keys they put or delete under the name of every list the
+entity belongs, and list queries merge those recent writes into their
+results using strongly consistent gets, so users always see their writes.
+"""
+import logging
+import time
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+NAMESPACE = 'recent'
+# Seconds to keep a write, longer than queries take to catch up.
+WINDOW = 60
+MAX_ENTRIES = 50
+CAS_RETRIES = 10
+
+def _record(client, list_name, key, deleted):
+    """Add write of the key to the list with compare and set.
+
+    Returns:
+        bool: True if it's recorded, False otherwise.
+    """
+    now = time.time()
+    entry = (key.urlsafe(), deleted, now)
+
+    for _ in xrange(CAS_RETRIES):
+        entries = client.gets(list_name, namespace=NAMESPACE)
+        if entries is None:
+            if client.add(list_name, [entry], time=WINDOW,
+                          namespace=NAMESPACE):
+                return True
+            continue
+
+        entries = [e for e in entries
+                   if e[2] > now - WINDOW and e[0] != entry[0]]
+        entries.append(entry)
+        if client.cas(list_name, entries[-MAX_ENTRIES:], time=WINDOW,
+                      namespace=NAMESPACE):
+            return True
+
+    return False
+
+def record(list_names, key, deleted=False):
+    """Record write of the entity to the lists it belongs.
+
+    Args:
+        list_names (list): Names of the lists.
+        key (ndb.Key): Key of the entity put or deleted.
+        deleted (bool): True if the entity is deleted.
+    """
+    client = memcache.Client()
+    for list_name in list_names:
+        if not _record(client, list_name, key, deleted):
+            logging.warning('Failed to record recent write of %s to %s',
+                            key, list_name)
+
+def merge(list_name, entities, sort_key, in_range=None, reverse=True):
+    """Merge recent writes of the list into query results.
+
+    Deleted entities are removed, and written ones are loaded with a
+    strongly consistent batched get and put in order.
+
+    Args:
+        list_name (str): Name of the list.
+        entities (list): Entities returned by an eventually consistent query.
+        sort_key (callable): Returns sort value of an entity.
+        in_range (callable): Returns True if an entity matches the query
+            bounds. Every entity matches if it's None.
+        reverse (bool): Sort descending if True.
+
+    Returns:
+        list: Merged entities.
+    """
+    entries = get_entries_async(list_name).get_result()
+    return merge_entries_async(entries, entities, sort_key, in_range,
+                               reverse).get_result()
+
+@ndb.tasklet
+def get_entries_async(list_name):
+    """Start getting recent writes of the list.
+
+    The read is batched with other memcache reads of the ndb context.
+
+    Args:
+        list_name (str): Name of the list.
+
+    Returns:
+        Future of list of recent writes, for merge_entries_async.
+    """
+    entries = yield ndb.get_context().memcache_get(list_name,
+                                                   namespace=NAMESPACE)
+    raise ndb.Return(entries or [])
+
+@ndb.tasklet
+def merge_entries_async(entries, entities, sort_key, in_range=None,
+                        reverse=True):
+    """Start merging recent writes got by get_entries_async into results.
+
+    Written entities are got asynchronously, so other work of the calling
+    tasklet goes on meanwhile.
+
+    Args:
+        entries (list): Recent writes of the list.
+        entities (list): Entities returned by an eventually consistent query.
+        sort_key (callable): Returns sort value of an entity.
+        in_range (callable): Returns True if an entity matches the query
+            bounds. Every entity matches if it's None.
+        reverse (bool): Sort descending if True.
+
+    Returns:
+        Future of list of merged entities.
+    """
+    now = time.time()
+    entries = [e for e in entries if e[2] > now - WINDOW]
+    if not entries:
+        raise ndb.Return(entities)
+
+    written = set(e[0] for e in entries)
+    merged = [entity for entity in entities
+              if entity.key.urlsafe() not in written]
+
+    put_keys = [ndb.Key(urlsafe=e[0]) for e in entries if not e[1]]
+    written_entities = yield ndb.get_multi_async(put_keys)
+    for entity in written_entities:
+        if entity is not None and (in_range is None or in_range(entity)):
+            merged.append(entity)
+
+    merged.sort(key=sort_key, reverse=reverse)
+    raise ndb.Return(merged)
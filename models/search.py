@@ -0,0 +1,398 @@
+"""This module keeps an inverted index of posts for full text search.
+
+Each token maps to the ids of posts which contain it and the weights of
+the token in them, so a search reads only the entities of its tokens and
+never queries posts. Postings of a token are split into TOKEN_SHARDS
+entities by post id, so common tokens are neither one large entity nor
+one written by every post. Post write handlers defer update_post, which
+updates just the tokens that changed since the post was last indexed.
+
+The index is kept in the datastore by default. A LocalIndex can be
+installed to keep it in process instead, e.g. for tests and local tools.
+
+    search.set_index(search.LocalIndex())
+"""
+import collections
+import logging
+import math
+import re
+
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+import tasks
+from models import counter
+from models.post import Post
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+MIN_TOKEN_LENGTH = 2
+MAX_TOKEN_LENGTH = 100
+STOP_WORDS = frozenset([
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'but', 'by', 'for', 'if',
+    'in', 'into', 'is', 'it', 'no', 'not', 'of', 'on', 'or', 'such', 'that',
+    'the', 'their', 'then', 'there', 'these', 'they', 'this', 'to', 'was',
+    'will', 'with',
+])
+# A token in the subject counts as much as this many in the content.
+SUBJECT_WEIGHT = 3
+MAX_RESULTS = 100
+# Distinct tokens of a query looked up, since each reads TOKEN_SHARDS keys.
+MAX_QUERY_TOKENS = 10
+TOKEN_SHARDS = 10
+# Tokens updated in one cross group transaction with the document, below
+# the limit of 25 entity groups.
+TRANSACTION_TOKENS = 20
+REINDEX_BATCH_SIZE = 50
+
+def tokenize(text):
+    """Split text into lowercase tokens, leaving out stop words.
+
+    Args:
+        text (unicode): Text to split.
+
+    Returns:
+        list: Tokens in order.
+    """
+    return [token for token in TOKEN_RE.findall(text.lower())
+            if MIN_TOKEN_LENGTH <= len(token) <= MAX_TOKEN_LENGTH and
+            token not in STOP_WORDS]
+
+def term_weights(subject, content):
+    """Count tokens of the post, weighting ones in subject higher.
+
+    Args:
+        subject (unicode): Post subject.
+        content (unicode): Post content.
+
+    Returns:
+        dict: Weight of each token.
+    """
+    weights = collections.defaultdict(int)
+    for token in tokenize(subject):
+        weights[token] += SUBJECT_WEIGHT
+    for token in tokenize(content):
+        weights[token] += 1
+    return dict(weights)
+
+
+class SearchToken(ndb.Model):
+    """DB model for postings of a token in a shard, keyed by key_name().
+
+    Attributes:
+        post_ids (list): Ids of posts which contain the token.
+        weights (list): Weight of the token in each post.
+    """
+    post_ids = ndb.IntegerProperty(repeated=True, indexed=False)
+    weights = ndb.IntegerProperty(repeated=True, indexed=False)
+
+    @staticmethod
+    def key_name(token, shard):
+        """Return key name of postings of the token in the shard.
+
+        Tokens are prefixed since key names like __foo__ are reserved.
+        """
+        return 't:%s:%d' % (token, shard)
+
+    @classmethod
+    def make_key(cls, token, post_id):
+        """Return key of the shard which has postings of the post.
+
+        Args:
+            token (unicode): Token.
+            post_id (int): Post's id.
+        """
+        return ndb.Key(cls, cls.key_name(token, post_id % TOKEN_SHARDS))
+
+    @classmethod
+    def token_keys(cls, token):
+        """Return keys of every shard of the token.
+        """
+        return [ndb.Key(cls, cls.key_name(token, shard))
+                for shard in xrange(TOKEN_SHARDS)]
+
+    def postings(self):
+        """Return weight of the token in each post by post id.
+        """
+        return dict(zip(self.post_ids, self.weights))
+
+    def set_postings(self, postings):
+        """Set weight of the token in each post.
+
+        Args:
+            postings (dict): Weight by post id.
+        """
+        post_ids = sorted(postings)
+        self.post_ids = post_ids
+        self.weights = [postings[post_id] for post_id in post_ids]
+
+
+class SearchDocument(ndb.Model):
+    """DB model for tokens of a post as it was last indexed.
+
+    It's keyed by post id, and used to find tokens to update when the post
+    is edited or deleted. It's written in the same transactions as the
+    postings, so it always has the tokens the postings have.
+
+    Attributes:
+        tokens (list): Tokens of the post.
+        weights (list): Weight of each token.
+    """
+    tokens = ndb.StringProperty(repeated=True, indexed=False)
+    weights = ndb.IntegerProperty(repeated=True, indexed=False)
+
+    def token_weights(self):
+        """Return weight of each token.
+        """
+        return dict(zip(self.tokens, self.weights))
+
+    def set_token_weights(self, weights):
+        """Set weight of each token.
+
+        Args:
+            weights (dict): Weight by token.
+        """
+        self.tokens = sorted(weights)
+        self.weights = [weights[token] for token in self.tokens]
+
+
+class LocalIndex(object):
+    """Inverted index kept in process.
+
+    Attributes:
+        postings (dict): Weight by post id for each token.
+        documents (dict): Token weights by post id.
+    """
+    def __init__(self):
+        self.postings = collections.defaultdict(dict)
+        self.documents = {}
+
+    def update(self, post_id, weights):
+        """Replace tokens of the post.
+
+        Args:
+            post_id (int): Post's id.
+            weights (dict): Weight of each token, empty to remove the post.
+        """
+        for token in self.documents.pop(post_id, {}):
+            self.postings[token].pop(post_id, None)
+            if not self.postings[token]:
+                del self.postings[token]
+
+        for token, weight in weights.iteritems():
+            self.postings[token][post_id] = weight
+        if weights:
+            self.documents[post_id] = dict(weights)
+
+    def lookup(self, tokens):
+        """Return postings of the tokens.
+
+        Args:
+            tokens (list): Tokens to look up.
+
+        Returns:
+            dict: Weight by post id for each token.
+        """
+        return dict((token, dict(self.postings.get(token, {})))
+                    for token in tokens)
+
+    def size(self):
+        """Return the number of posts indexed.
+        """
+        return len(self.documents)
+
+
+class DatastoreIndex(object):
+    """Inverted index kept in SearchToken and SearchDocument entities.
+    """
+    def update(self, post_id, weights):
+        """Replace tokens of the post, writing only ones which changed.
+
+        Each cross group transaction reads the document, updates a few of
+        the tokens which differ from it and writes the document as they
+        are now. So postings match the document even if updates of the
+        post run at once, and a retried task finishes what failed.
+
+        Args:
+            post_id (int): Post's id.
+            weights (dict): Weight of each token, empty to remove the post.
+        """
+        while ndb.transaction(
+                lambda: self._update_batch(post_id, weights), xg=True):
+            pass
+
+    def _update_batch(self, post_id, weights):
+        """Update a batch of tokens which changed, and the document.
+
+        Returns:
+            bool: True if changed tokens are left, False otherwise.
+        """
+        key = ndb.Key(SearchDocument, str(post_id))
+        document = key.get()
+        indexed = document.token_weights() if document else {}
+
+        changed = sorted(token for token in set(indexed) | set(weights)
+                         if indexed.get(token) != weights.get(token))
+        batch = changed[:TRANSACTION_TOKENS]
+        self._update_tokens(batch, post_id, weights)
+
+        for token in batch:
+            if token in weights:
+                indexed[token] = weights[token]
+            else:
+                indexed.pop(token, None)
+
+        if indexed:
+            document = document or SearchDocument(key=key)
+            document.set_token_weights(indexed)
+            document.put()
+        elif document:
+            key.delete()
+        return len(changed) > len(batch)
+
+    @staticmethod
+    def _update_tokens(tokens, post_id, weights):
+        """Set weight of the post in postings of the tokens.
+        """
+        keys = [SearchToken.make_key(token, post_id) for token in tokens]
+        puts = []
+        deletes = []
+
+        for token, key, entity in zip(tokens, keys, ndb.get_multi(keys)):
+            postings = entity.postings() if entity else {}
+            if token in weights:
+                postings[post_id] = weights[token]
+            else:
+                postings.pop(post_id, None)
+
+            if postings:
+                entity = entity or SearchToken(key=key)
+                entity.set_postings(postings)
+                puts.append(entity)
+            elif entity:
+                deletes.append(key)
+
+        ndb.put_multi(puts)
+        ndb.delete_multi(deletes)
+
+    def lookup(self, tokens):
+        """Return postings of the tokens with one batched get.
+
+        Args:
+            tokens (list): Tokens to look up.
+
+        Returns:
+            dict: Weight by post id for each token.
+        """
+        keys = [key for token in tokens
+                for key in SearchToken.token_keys(token)]
+        postings = dict((token, {}) for token in tokens)
+        for i, entity in enumerate(ndb.get_multi(keys)):
+            if entity:
+                postings[tokens[i // TOKEN_SHARDS]].update(entity.postings())
+        return postings
+
+    def size(self):
+        """Return the number of posts, which are all indexed.
+        """
+        return counter.get_count(counter.POSTS)
+
+
+class SearchResults(object):
+    """Results of a search.
+
+    Attributes:
+        post_ids (list): Ids of the best matching posts, at most the limit.
+        total (int): The number of every matching post, which may be more
+            than the ids.
+    """
+    def __init__(self, post_ids, total):
+        self.post_ids = post_ids
+        self.total = total
+
+
+_index = DatastoreIndex()
+
+def set_index(index):
+    """Install index which search uses.
+
+    Args:
+        index: LocalIndex or DatastoreIndex instance.
+    """
+    global _index # pylint: disable=global-statement
+    _index = index
+
+def update_post(post_id):
+    """Index the post as it's stored now, or remove it if it's deleted.
+
+    Post write handlers defer it after the post is put or deleted.
+
+    Args:
+        post_id (int): Post's id.
+    """
+    post = Post.get_by_id(post_id)
+    if post:
+        _index.update(post_id, term_weights(post.subject, post.content))
+    else:
+        _index.update(post_id, {})
+
+def search(query, limit=MAX_RESULTS):
+    """Find posts matching the query, best first.
+
+    Posts which contain more of the query tokens rank higher, then ones
+    with higher sum of token weight times inverse document frequency.
+    Only the first MAX_QUERY_TOKENS distinct tokens of the query are used.
+
+    Args:
+        query (unicode): Search words.
+        limit (int): The maximum number of results.
+
+    Returns:
+        SearchResults: Ids of the best matching posts and their total.
+    """
+    tokens = []
+    for token in tokenize(query):
+        if token not in tokens:
+            tokens.append(token)
+    tokens = tokens[:MAX_QUERY_TOKENS]
+    if not tokens:
+        return SearchResults([], 0)
+
+    total = max(_index.size(), 1)
+    scores = collections.defaultdict(float)
+    matches = collections.defaultdict(int)
+
+    for postings in _index.lookup(tokens).itervalues():
+        if not postings:
+            continue
+        idf = math.log(1.0 + float(total) / len(postings))
+        for post_id, weight in postings.iteritems():
+            scores[post_id] += weight * idf
+            matches[post_id] += 1
+
+    ranked = sorted(scores, reverse=True,
+                    key=lambda post_id: (matches[post_id], scores[post_id],
+                                         post_id))
+    return SearchResults(ranked[:limit], len(ranked))
+
+def reindex_posts(cursor=None, indexed=0):
+    """Index every post, e.g. to build the index for existing posts.
+
+    This runs as a chain of deferred tasks, each of which indexes one batch
+    of posts.
+
+    Args:
+        cursor (str): Query cursor of the next batch.
+        indexed (int): The number of posts indexed so far.
+    """
+    start_cursor = Cursor(urlsafe=cursor) if cursor else None
+    posts, next_cursor, more = Post.query().fetch_page(
+        REINDEX_BATCH_SIZE, start_cursor=start_cursor)
+    for post in posts:
+        _index.update(post.key.id(),
+                      term_weights(post.subject, post.content))
+    indexed += len(posts)
+
+    if more and next_cursor:
+        tasks.defer(reindex_posts, next_cursor.urlsafe(), indexed)
+    else:
+        logging.info('Indexed %d posts', indexed)
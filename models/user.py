@@ -1,10 +1,21 @@
 """This module models user information for blog.
 """
 import hashlib
+import logging
+import os
 import random
 from string import letters
 
-from google.appengine.ext import db
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+import tasks
+
+BACKFILL_BATCH_SIZE = 100
+# Set to 1 while users registered before the username index are not all
+# indexed, so they are found by a query. Unset it once backfill_usernames
+# is done.
+USERNAME_QUERY_FALLBACK = os.environ.get('USERNAME_QUERY_FALLBACK') == '1'
 
 def make_salt(length=5):
     """Make salt for hashed password.
@@ -51,7 +62,18 @@ def check_password(username, password, hashed_password):
     salt = hashed_password.split(',')[0]
     return hashed_password == make_password_hash(username, password, salt)
 
-class User(db.Model):
+def normalize_username(username):
+    """Normalize username so names differ only in case are the same.
+
+    Args:
+        username (str): User's name.
+
+    Returns:
+        str: Normalized username.
+    """
+    return username.strip().lower()
+
+class User(ndb.Model):
     """DB model for User Entity.
 
     This class models blog's user information.
@@ -61,9 +83,9 @@ class User(db.Model):
         password (str): User's password.
         email (str): User's email address.
     """
-    username = db.StringProperty(required=True)
-    password = db.StringProperty(required=True)
-    email = db.StringProperty()
+    username = ndb.StringProperty(required=True)
+    password = ndb.StringProperty(required=True)
+    email = ndb.StringProperty()
 
     @classmethod
     def by_id(cls, uid):
@@ -81,18 +103,38 @@ class User(db.Model):
     def by_name(cls, username):
         """Find user by name and return User instance.
 
+        The user is found through the username index. If old users share
+        the index, the one whose name matches exactly is returned. Users
+        not in the index are found by a query only if
+        USERNAME_QUERY_FALLBACK is set.
+
         Args:
             username (str): User's name for finding.
 
         Returns:
             User instance if it exists, None otherwise.
         """
-        user = User.all().filter('username =', username).get()
-        return user
+        index = Username.get_by_id(normalize_username(username))
+        if index is None:
+            if USERNAME_QUERY_FALLBACK:
+                return User.query(User.username == username.strip()).get()
+            return None
+
+        if not index.legacy_users:
+            return index.user.get()
+        users = ndb.get_multi([index.user] + index.legacy_users)
+        for user in users:
+            if user and user.username == username.strip():
+                return user
+        return users[0]
 
     @classmethod
     def register(cls, username, password, email):
-        """Make hashed password and User instance using given information.
+        """Make hashed password and store new user with username index.
+
+        The user and the index are stored in a transaction, so a username
+        can't be taken twice. Names of users not in the index yet are
+        checked by a query first if USERNAME_QUERY_FALLBACK is set.
 
         Args:
             username (str): User's name.
@@ -100,12 +142,25 @@ class User(db.Model):
             email (str): User's email address.
 
         Returns:
-            User instance.
+            User instance if it's registered, None if username is taken.
         """
+        if USERNAME_QUERY_FALLBACK and User.query(
+                User.username == username.strip()).get(keys_only=True):
+            return None
+
         password = make_password_hash(username, password)
-        return User(username=username,
-                    password=password,
-                    email=email)
+        index_id = normalize_username(username)
+
+        def txn():
+            """Put user and its index unless username exists."""
+            if Username.get_by_id(index_id):
+                raise ndb.Rollback()
+            user = User(username=username, password=password, email=email)
+            user.put()
+            Username(id=index_id, user=user.key).put()
+            return user
+
+        return ndb.transaction(txn, xg=True)
 
     @classmethod
     def login(cls, username, password):
@@ -119,5 +174,76 @@ class User(db.Model):
             User instance if login is successful, None otherwise.
         """
         user = cls.by_name(username)
-        if user and check_password(username, password, user.password):
+        if user and check_password(user.username, password, user.password):
             return user
+
+
+class Username(ndb.Model):
+    """DB model for unique username index.
+
+    Key name of the entity is normalized username, so finding a user by
+    name is a strongly consistent get.
+
+    Attributes:
+        user (ndb.Key): Key of the user which has the username.
+        legacy_users (list): Keys of users registered before the index
+            whose names differ from the user's only in case.
+    """
+    user = ndb.KeyProperty(kind=User, required=True)
+    legacy_users = ndb.KeyProperty(kind=User, repeated=True, indexed=False)
+
+
+def _index_username(user):
+    """Add the user to the index of its name in a transaction.
+
+    Returns:
+        str: 'created' if the index is new, 'collision' if it already has
+            another user, None if it already has the user.
+    """
+    key = ndb.Key(Username, normalize_username(user.username))
+    index = key.get()
+    if index is None:
+        Username(key=key, user=user.key).put()
+        return 'created'
+    if user.key == index.user or user.key in index.legacy_users:
+        return None
+    index.legacy_users.append(user.key)
+    index.put()
+    return 'collision'
+
+def backfill_usernames(cursor=None, created=0, collisions=0):
+    """Build username index for users registered before it.
+
+    This runs as a chain of deferred tasks, each of which indexes one batch
+    of users. A user whose name differs from an indexed one only in case
+    is added to legacy_users of its index and logged, so both can still
+    log in with their exact names.
+
+    Args:
+        cursor (str): Query cursor of the next batch.
+        created (int): The number of indexes created so far.
+        collisions (int): The number of users sharing an index so far.
+    """
+    start_cursor = Cursor(urlsafe=cursor) if cursor else None
+    users, next_cursor, more = User.query().fetch_page(
+        BACKFILL_BATCH_SIZE, start_cursor=start_cursor)
+    indexes = ndb.get_multi([ndb.Key(Username,
+                                     normalize_username(user.username))
+                             for user in users])
+    for user, index in zip(users, indexes):
+        if index and user.key in [index.user] + index.legacy_users:
+            continue
+        result = ndb.transaction(lambda: _index_username(user))
+        if result == 'created':
+            created += 1
+        elif result == 'collision':
+            collisions += 1
+            logging.warning('Username %r of user %d differs from an indexed '
+                            'one only in case', user.username, user.key.id())
+
+    if more and next_cursor:
+        tasks.defer(backfill_usernames, next_cursor.urlsafe(), created,
+                    collisions)
+    else:
+        logging.info('Created %d username indexes, %d users share one',
+                     created, collisions)
@@ -0,0 +1,170 @@
+"""On demand profiling of live requests.
+
+BlogHandler profiles a request with cProfile when an admin sends a signed
+X-Profile header, or with probability PROFILE_SAMPLE_RATE. The top
+functions and call stacks in the collapsed format of flame graphs are
+stored as ProfileRecord entities, and shown on /admin/profiles.
+
+cProfile records callers of each function rather than whole stacks, so
+collapsed stacks are rebuilt from the call graph, splitting the time of a
+function among its callers in proportion to the time spent under each.
+"""
+import collections
+import cProfile
+import json
+import logging
+import os
+import pstats
+import random
+import time
+
+from models.profile import ProfileRecord
+
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_HEADER = 'X-Profile'
+# Seconds a signed profile header is valid for.
+TOKEN_LIFETIME = 3600
+TOP_FUNCTIONS = 40
+MAX_STACK_DEPTH = 40
+# Stacks which took less time than it are left out of collapsed stacks.
+MIN_STACK_US = 10
+
+def sampled():
+    """Decide if a request is profiled by sampling.
+
+    Returns:
+        bool: True with probability PROFILE_SAMPLE_RATE.
+    """
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+def token_value(expires):
+    """Return value of profile token which expires at the time.
+
+    It's signed by BlogHandler to make the X-Profile header.
+
+    Args:
+        expires (int): Unix time the token expires.
+
+    Returns:
+        str: Token value.
+    """
+    return 'profile:%d' % expires
+
+def new_token_value():
+    """Return value of profile token which expires after TOKEN_LIFETIME.
+    """
+    return token_value(int(time.time()) + TOKEN_LIFETIME)
+
+def is_valid_token_value(value):
+    """Check that the verified token value is not expired.
+
+    Args:
+        value (str): Token value whose signature is checked.
+
+    Returns:
+        bool: True if it's a profile token which is not expired.
+    """
+    prefix, _, expires = (value or '').partition(':')
+    return (prefix == 'profile' and expires.isdigit() and
+            int(expires) > time.time())
+
+def _function_name(function):
+    """Return readable name of pstats function tuple.
+    """
+    filename, line, name = function
+    if filename == '~':
+        return name
+    return '%s:%d(%s)' % (os.path.basename(filename), line, name)
+
+def top_functions(stats, limit=TOP_FUNCTIONS):
+    """Return functions which took most cumulative time.
+
+    Args:
+        stats (pstats.Stats): Profile statistics.
+        limit (int): The maximum number of functions.
+
+    Returns:
+        list: Dict of name, calls, own_ms and cumulative_ms.
+    """
+    rows = []
+    for function, (_, calls, own, cumulative, _) in stats.stats.iteritems():
+        rows.append(dict(name=_function_name(function), calls=calls,
+                         own_ms=round(own * 1000, 3),
+                         cumulative_ms=round(cumulative * 1000, 3)))
+    rows.sort(key=lambda row: row['cumulative_ms'], reverse=True)
+    return rows[:limit]
+
+def collapsed_stacks(stats):
+    """Rebuild call stacks in collapsed format from the call graph.
+
+    Each line is frames from the root separated by ';' and the own time of
+    the last frame on that stack in microseconds.
+
+    Args:
+        stats (pstats.Stats): Profile statistics.
+
+    Returns:
+        str: Collapsed stacks.
+    """
+    callees = dict((function, []) for function in stats.stats)
+    for function, (_, _, _, _, callers) in stats.stats.iteritems():
+        for caller, edge in callers.iteritems():
+            if caller in callees:
+                callees[caller].append((function, edge[3]))
+
+    totals = collections.defaultdict(float)
+
+    def walk(function, stack, share):
+        """Add own time of the function and walk its callees."""
+        _, _, own, cumulative, _ = stats.stats[function]
+        stack = stack + (_function_name(function),)
+        totals[';'.join(stack)] += own * share * 1000000
+
+        if len(stack) >= MAX_STACK_DEPTH or not cumulative:
+            return
+        for callee, edge_cumulative in callees[function]:
+            callee_cumulative = stats.stats[callee][3]
+            if (_function_name(callee) in stack or not callee_cumulative or
+                    edge_cumulative * share * 1000000 < MIN_STACK_US):
+                continue
+            walk(callee, stack,
+                 share * edge_cumulative / callee_cumulative)
+
+    roots = [function for function, (_, _, _, _, callers)
+             in stats.stats.iteritems()
+             if not any(caller in stats.stats for caller in callers) and
+             '_lsprof' not in function[2]]
+    for root in roots:
+        walk(root, (), 1.0)
+
+    return '\n'.join('%s %d' % (stack, microseconds)
+                     for stack, microseconds in sorted(totals.iteritems())
+                     if microseconds >= 1)
+
+def run(request, reason, function, *args, **kwargs):
+    """Call the function under cProfile and store the profile.
+
+    Failing to store the profile is logged and doesn't fail the request.
+
+    Args:
+        request (webapp2.Request): Request being profiled.
+        reason (str): 'header' or 'sample'.
+        function (callable): Function to profile.
+
+    Returns:
+        Result of the function.
+    """
+    profile = cProfile.Profile()
+    start = time.time()
+    try:
+        return profile.runcall(function, *args, **kwargs)
+    finally:
+        duration_ms = (time.time() - start) * 1000
+        try:
+            stats = pstats.Stats(profile)
+            ProfileRecord(method=request.method, path=request.path_qs[:500],
+                          duration_ms=duration_ms, reason=reason,
+                          top_functions=json.dumps(top_functions(stats)),
+                          collapsed=collapsed_stacks(stats)).put()
+        except Exception: # pylint: disable=broad-except
+            logging.exception('Failed to store profile of %s', request.path)
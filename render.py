@@ -1,13 +1,142 @@
 """Render jinja2 template to html.
 
 This module render jinja2 template to html.
+
+Templates can be precompiled into python modules by running this module.
+
+    $ python render.py
+
+If compiled templates exist, they are loaded instead of parsing templates
+and auto reload checks are skipped, except on the development server.
+Compiling writes a stamp of the jinja2 version and hashes of the template
+files, and compiled templates are only used while it matches, so a
+template changed without compiling again is never served stale.
+Built asset bundles are linked the same way, see assets.py.
 """
+import hashlib
+import json
+import logging
 import os
 import jinja2
 
-TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), 'templates')
-JINJA_ENV = jinja2.Environment(loader=jinja2.FileSystemLoader(TEMPLATE_DIR),
-                               autoescape=True)
+import assets
+import instrumentation
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_DIR = os.path.join(BASE_DIR, 'templates')
+COMPILED_DIR = os.path.join(BASE_DIR, 'templates_compiled')
+STAMP_PATH = os.path.join(COMPILED_DIR, 'stamp.json')
+TEMPLATE_EXTENSIONS = ('.html', '.xml')
+
+def is_dev_server():
+    """Check if the app is running on the development server.
+
+    Returns:
+        bool: True if it's on the development server, False otherwise.
+    """
+    return os.environ.get('SERVER_SOFTWARE', '').startswith('Development')
+
+def asset_urls(name):
+    """Return URLs of the asset bundle for templates.
+
+    Args:
+        name (str): Bundle name, e.g. site.css.
+
+    Returns:
+        list: URL of the built bundle, or URLs of its source files on the
+            development server or if it's not built.
+    """
+    return assets.asset_urls(name, built=not is_dev_server())
+
+def template_names():
+    """Return names of every template.
+
+    Returns:
+        list: Template names.
+    """
+    return sorted(name for name in os.listdir(TEMPLATE_DIR)
+                  if name.endswith(TEMPLATE_EXTENSIONS))
+
+def make_stamp():
+    """Return stamp of the jinja2 version and the template files.
+
+    Returns:
+        dict: jinja2 version and sha1 of each template by name.
+    """
+    hashes = {}
+    for name in template_names():
+        with open(os.path.join(TEMPLATE_DIR, name), 'rb') as template:
+            hashes[name] = hashlib.sha1(template.read()).hexdigest()
+    return dict(jinja2=jinja2.__version__, templates=hashes)
+
+def compiled_is_current():
+    """Check if compiled templates match the template files.
+
+    Returns:
+        bool: True if they were compiled from the current templates with
+            the current jinja2, False otherwise.
+    """
+    if not os.path.exists(STAMP_PATH):
+        return False
+
+    with open(STAMP_PATH) as stamp_file:
+        try:
+            stamp = json.load(stamp_file)
+        except ValueError:
+            return False
+    return stamp == make_stamp()
+
+def make_env(compiled=None):
+    """Make jinja2 environment.
+
+    Args:
+        compiled (bool): Load precompiled templates if True. If it's None,
+            they are loaded when they are current and it's not the dev
+            server.
+
+    Returns:
+        jinja2.Environment instance.
+    """
+    if compiled is None and not is_dev_server():
+        compiled = compiled_is_current()
+        if not compiled and os.path.isdir(COMPILED_DIR):
+            logging.warning('Compiled templates are stale, loading '
+                            'template files. Run render.py to compile.')
+
+    if compiled:
+        env = jinja2.Environment(loader=jinja2.ModuleLoader(COMPILED_DIR),
+                                 autoescape=True, auto_reload=False)
+    else:
+        env = jinja2.Environment(
+            loader=jinja2.FileSystemLoader(TEMPLATE_DIR), autoescape=True)
+
+    env.globals['asset_urls'] = asset_urls
+    return env
+
+JINJA_ENV = make_env()
+
+def preload_templates():
+    """Load every template so later requests don't have to.
+    """
+    for name in template_names():
+        JINJA_ENV.get_template(name)
+
+def compile_templates():
+    """Compile every template into python modules in COMPILED_DIR.
+
+    The stamp is written last, so compiled templates are not used if
+    compiling fails.
+    """
+    if os.path.exists(STAMP_PATH):
+        os.remove(STAMP_PATH)
+
+    env = make_env(compiled=False)
+    names = template_names()
+    env.compile_templates(COMPILED_DIR, zip=None, ignore_errors=False,
+                          filter_func=lambda name: name in names)
+
+    with open(STAMP_PATH, 'w') as stamp_file:
+        json.dump(make_stamp(), stamp_file, indent=2, sort_keys=True)
 
 def render_str(template, **params):
     """Render jinja2 template with parameters to html string.
@@ -19,5 +148,9 @@ def render_str(template, **params):
     Returns:
         str: Rendered html string.
     """
-    jinja_template = JINJA_ENV.get_template(template)
-    return jinja_template.render(params)
+    with instrumentation.timer('render', template):
+        jinja_template = JINJA_ENV.get_template(template)
+        return jinja_template.render(params)
+
+if __name__ == '__main__':
+    compile_templates()
@@ -0,0 +1,83 @@
+"""Session of logged in user.
+
+A session holds id and username of the logged in user. It's cached in an
+in-process LRU cache and in memcache, keyed by the signed 'user_id' cookie
+value, so most requests don't load the user from the datastore. The User
+entity is loaded lazily only when it's needed.
+"""
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from cache import LRUCache
+from models.user import User
+
+# Increase it when the format of cached sessions changes.
+SESSION_VERSION = 1
+NAMESPACE = 'session'
+
+_local_sessions = LRUCache(max_size=1000)
+
+class SessionUser(object):
+    """Logged in user of the session.
+
+    It can be used in place of User instance where only the key and the
+    username are needed.
+
+    Attributes:
+        user_id (int): User's id.
+        username (str): User's name.
+    """
+    def __init__(self, user_id, username):
+        self.user_id = user_id
+        self.username = username
+        self._entity = None
+
+    @property
+    def key(self):
+        """ndb.Key of the user, made without loading it.
+        """
+        return ndb.Key(User, self.user_id)
+
+    @property
+    def entity(self):
+        """User instance of the session, loaded on first access.
+        """
+        if self._entity is None:
+            self._entity = User.by_id(self.user_id)
+        return self._entity
+
+
+def load(cookie_val, uid):
+    """Load session of the signed cookie value.
+
+    Args:
+        cookie_val (str): Signed 'user_id' cookie value which is valid.
+        uid (str): User's id in the cookie value.
+
+    Returns:
+        SessionUser instance if the user exists, None otherwise.
+    """
+    data = _local_sessions.get(cookie_val)
+    if data is None:
+        data = memcache.get(cookie_val, namespace=NAMESPACE)
+
+    if data is None or data.get('version') != SESSION_VERSION:
+        user = User.by_id(int(uid))
+        if user is None:
+            return None
+
+        data = dict(id=user.key.id(), username=user.username,
+                    version=SESSION_VERSION)
+        memcache.set(cookie_val, data, namespace=NAMESPACE)
+
+    _local_sessions.set(cookie_val, data)
+    return SessionUser(data['id'], data['username'])
+
+def forget(cookie_val):
+    """Delete cached session of the cookie value.
+
+    Args:
+        cookie_val (str): Signed 'user_id' cookie value.
+    """
+    _local_sessions.delete(cookie_val)
+    memcache.delete(cookie_val, namespace=NAMESPACE)
@@ -2,49 +2,92 @@
 
 /* Add event listener for confirming when delete button is clicked */
 (function() {
-  var delete_buttons = document.querySelectorAll('.btn-delete');
+  document.addEventListener('click', function(event) {
+    if (!event.target.closest('.btn-delete')) {
+      return;
+    }
 
-  delete_buttons.forEach(function(element) {
-    element.addEventListener('click', function(event) {
-      if (!confirm('Are you sure?')) {
-        event.preventDefault();
-      }
-    });
+    if (!confirm('Are you sure?')) {
+      event.preventDefault();
+    }
   });
 })();
 
-/* Add event listener for changing tag when comment edit button is clicked */
+/* Add event listener for changing tag when comment edit or cancel button is
+ * clicked. Listeners are on document to work for comments loaded later. */
 (function() {
-  var edit_comment_buttons = document.querySelectorAll('.btn-edit-comment');
+  function toggleCommentForm(id, editing) {
+    var content_elem = document.querySelector('.comment-content-' + id);
+    var edit_form_elem = document.querySelector('#comment-edit-' + id);
 
-  edit_comment_buttons.forEach(function(element) {
-    element.addEventListener('click', function(event) {
-      content_class = '.comment-content-' + this.id;
-      edit_form_id = '#comment-edit-' + this.id;
+    content_elem.style.display = editing ? "none" : "block";
+    edit_form_elem.style.display = editing ? "block" : "none";
+  }
 
-      content_elem = document.querySelector(content_class);
-      content_elem.style.display = "none";
+  document.addEventListener('click', function(event) {
+    var edit_button = event.target.closest('.btn-edit-comment');
+    var cancel_button = event.target.closest('.btn-cancel-comment');
 
-      edit_form_elem = document.querySelector(edit_form_id);
-      edit_form_elem.style.display = "block";
-    });
+    if (edit_button) {
+      toggleCommentForm(edit_button.id, true);
+    } else if (cancel_button) {
+      toggleCommentForm(cancel_button.id, false);
+    }
   });
 })();
 
-/* Add event listener for changing tag when comment cancel button is clicked */
+/* Load more comments when scrolled to the bottom of the permalink page */
 (function() {
-  var cancel_comment_buttons = document.querySelectorAll('.btn-cancel-comment');
+  var more_link = document.querySelector('.more-comments');
+  var comments_elem = document.querySelector('.comments');
+  var loading = false;
+
+  if (!more_link || !comments_elem) {
+    return;
+  }
 
-  cancel_comment_buttons.forEach(function(element) {
-    element.addEventListener('click', function(event) {
-      content_class = '.comment-content-' + this.id;
-      edit_form_id = '#comment-edit-' + this.id;
+  function loadComments() {
+    var request = new XMLHttpRequest();
+
+    loading = true;
+    request.open('GET', more_link.getAttribute('data-url'));
+    request.addEventListener('load', function() {
+      loading = false;
+
+      if (request.status !== 200) {
+        return;
+      }
 
-      content_elem = document.querySelector(content_class);
-      content_elem.style.display = "block";
+      var data = JSON.parse(request.responseText);
+      comments_elem.insertAdjacentHTML('beforeend', data.html);
 
-      edit_form_elem = document.querySelector(edit_form_id);
-      edit_form_elem.style.display = "none";
+      if (data.next_cursor) {
+        var url = more_link.getAttribute('data-url').split('?')[0];
+        more_link.setAttribute('data-url', url + '?cursor=' + data.next_cursor);
+      } else {
+        more_link.parentNode.removeChild(more_link);
+        more_link = null;
+      }
+    });
+    request.addEventListener('error', function() {
+      loading = false;
     });
+    request.send();
+  }
+
+  more_link.addEventListener('click', function(event) {
+    event.preventDefault();
+    if (!loading) {
+      loadComments();
+    }
+  });
+
+  window.addEventListener('scroll', function() {
+    var bottom = window.innerHeight + window.pageYOffset;
+
+    if (more_link && !loading &&
+        bottom >= document.body.offsetHeight - 200) {
+      loadComments();
+    }
   });
 })();
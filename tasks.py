@@ -0,0 +1,79 @@
+"""Background tasks.
+
+Functions are deferred to the task queue by default. A LocalRunner can be
+installed to run them in process instead, e.g. for tests and local tools.
+
+    runner = tasks.LocalRunner()
+    tasks.set_runner(runner)
+    ...
+    runner.run_all()
+"""
+import collections
+import logging
+
+from google.appengine.ext import deferred
+
+class LocalRunner(object):
+    """Runner which queues tasks in process and runs them on demand.
+
+    Failed tasks are retried like the task queue does, up to max_retries.
+
+    Attributes:
+        max_retries (int): The number of retries of a failed task.
+        queue (deque): Pending tasks of (function, args, kwargs, retries).
+    """
+    def __init__(self, max_retries=3):
+        self.max_retries = max_retries
+        self.queue = collections.deque()
+
+    def defer(self, function, *args, **kwargs):
+        """Queue function call.
+
+        Task options, whose names start with '_', are ignored.
+        """
+        kwargs = dict((name, value) for name, value in kwargs.iteritems()
+                      if not name.startswith('_'))
+        self.queue.append((function, args, kwargs, 0))
+
+    def run_all(self):
+        """Run queued tasks, including ones queued by them, until none left.
+
+        Returns:
+            int: The number of tasks run successfully.
+        """
+        done = 0
+        while self.queue:
+            function, args, kwargs, retries = self.queue.popleft()
+            try:
+                function(*args, **kwargs)
+                done += 1
+            except Exception: # pylint: disable=broad-except
+                logging.exception('Task %s failed', function.__name__)
+                if retries < self.max_retries:
+                    self.queue.append((function, args, kwargs, retries + 1))
+        return done
+
+
+_runner = None
+
+def set_runner(runner):
+    """Install runner which runs deferred tasks.
+
+    Args:
+        runner (LocalRunner): Runner to use, None to use the task queue.
+    """
+    global _runner # pylint: disable=global-statement
+    _runner = runner
+
+def defer(function, *args, **kwargs):
+    """Defer function call to the task queue or the installed runner.
+
+    Args:
+        function (callable): Module level function to call.
+        *args: Arguments for function.
+        **kwargs: Keyword arguments for function and deferred options
+            such as _transactional or _countdown.
+    """
+    if _runner is not None:
+        return _runner.defer(function, *args, **kwargs)
+    return deferred.defer(function, *args, **kwargs)
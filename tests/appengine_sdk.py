@@ -0,0 +1,12 @@
+"""Put the App Engine SDK on the path if APPENGINE_SDK names its directory.
+
+Test modules which need the SDK import this first, and skip themselves if
+SDK is None.
+"""
+import os
+
+from benchmark import setup_sdk
+
+SDK = os.environ.get('APPENGINE_SDK')
+if SDK:
+    setup_sdk(os.path.expanduser(SDK))
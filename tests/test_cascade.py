@@ -0,0 +1,103 @@
+"""Tests of deleting comments and likes of a deleted post with tasks.
+
+They run the task chain with tasks.LocalRunner on the testbed, and need the
+App Engine SDK on the path.
+"""
+import unittest
+
+import appengine_sdk # pylint: disable=unused-import
+try:
+    from google.appengine.api import memcache
+    from google.appengine.ext import ndb
+
+    import benchmark
+    import tasks
+    from models import cascade
+    from models import counter
+    from models.comment import Comment
+    from models.like import Like
+    from models.post import Post
+    from models.user import User
+except ImportError:
+    cascade = None
+
+
+@unittest.skipUnless(cascade, 'App Engine SDK is not available')
+class DeletePostChildrenTest(unittest.TestCase):
+    """Tests of the cascade of a deleted post."""
+
+    def setUp(self):
+        self.bed = benchmark.activate_testbed()
+        ndb.get_context().clear_cache()
+        self.runner = tasks.LocalRunner()
+        tasks.set_runner(self.runner)
+        self.sizes = cascade.BATCH_SIZE, cascade.COUNTER_CHUNK_SIZE
+        cascade.BATCH_SIZE, cascade.COUNTER_CHUNK_SIZE = 2, 2
+        self.run_with_counters = counter.run_with_counters
+
+        self.post_key = ndb.Key(Post, 1)
+        self.other_post_key = ndb.Key(Post, 2)
+        self.users = ndb.put_multi([User(username='user%d' % i, password='x')
+                                    for i in xrange(3)])
+        likes = []
+        for user_key in self.users:
+            for post_key in (self.post_key, self.other_post_key):
+                likes.append(Like(key=Like.make_key(user_key, post_key),
+                                  user=user_key, post=post_key))
+            counter.increment(counter.user_likes(user_key), 2)
+        ndb.put_multi(likes)
+        counter.increment(counter.post_likes(self.post_key), 3)
+
+        ndb.put_multi([Comment(user=self.users[0], post=self.post_key,
+                               content='comment %d' % i)
+                       for i in xrange(3)])
+        counter.increment(counter.post_comments(self.post_key), 3)
+
+    def tearDown(self):
+        counter.run_with_counters = self.run_with_counters
+        cascade.BATCH_SIZE, cascade.COUNTER_CHUNK_SIZE = self.sizes
+        tasks.set_runner(None)
+        self.bed.deactivate()
+
+    def run_cascade(self):
+        tasks.defer(cascade.delete_post_children, self.post_key)
+        self.runner.run_all()
+        memcache.flush_all()
+
+    def assert_deleted(self):
+        for model in (Comment, Like):
+            self.assertEqual(
+                model.query(model.post == self.post_key).count(), 0)
+        self.assertEqual(
+            Like.query(Like.post == self.other_post_key).count(), 3)
+        self.assertEqual(cascade.LikeBatch.query().count(), 0)
+
+        counts = counter.get_counts(
+            [counter.user_likes(user_key) for user_key in self.users] +
+            [counter.post_likes(self.post_key),
+             counter.post_comments(self.post_key)])
+        self.assertEqual(sorted(counts.values()), [0, 0, 1, 1, 1])
+
+    def test_deletes_comments_and_likes(self):
+        self.run_cascade()
+        self.assert_deleted()
+
+    def test_retried_batch_applies_each_update_once(self):
+        calls = []
+
+        def fail_after_second_commit(*args, **kwargs):
+            """Commit the counter updates, then fail the second time."""
+            result = self.run_with_counters(*args, **kwargs)
+            calls.append(True)
+            if len(calls) == 2:
+                raise RuntimeError('Task failed after commit')
+            return result
+
+        counter.run_with_counters = fail_after_second_commit
+        self.run_cascade()
+        self.assertTrue(len(calls) > 2)
+        self.assert_deleted()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+"""Tests of updating and repairing sharded counters.
+
+They need the App Engine SDK on the path.
+"""
+import unittest
+
+import appengine_sdk # pylint: disable=unused-import
+try:
+    from google.appengine.api import memcache
+    from google.appengine.ext import ndb
+
+    import benchmark
+    import tasks
+    from models import counter
+    from models.comment import Comment
+    from models.like import Like
+    from models.post import Post
+    from models.user import User
+except ImportError:
+    counter = None
+
+
+@unittest.skipUnless(counter, 'App Engine SDK is not available')
+class CounterTest(unittest.TestCase):
+    """Base of counter tests, on the testbed."""
+
+    def setUp(self):
+        self.bed = benchmark.activate_testbed()
+        ndb.get_context().clear_cache()
+
+    def tearDown(self):
+        self.bed.deactivate()
+
+    def shard_totals(self, names):
+        memcache.flush_all()
+        return counter.get_counts(names)
+
+
+class RunWithCountersTest(CounterTest):
+    """Tests of counter.run_with_counters."""
+
+    def test_function_and_deltas_commit_together(self):
+        user_key = User(username='user', password='x').put()
+        name = counter.user_posts(user_key)
+        counter.increment(name, 2)
+        self.assertEqual(counter.get_count(name), 2)
+
+        post = Post(user=user_key, subject='subject', content='content')
+        result = counter.run_with_counters(post.put, {name: 1,
+                                                      counter.POSTS: 1})
+
+        self.assertEqual(result, post.key)
+        self.assertEqual(counter.get_counts([name, counter.POSTS]),
+                         {name: 3, counter.POSTS: 1})
+        self.assertEqual(self.shard_totals([name, counter.POSTS]),
+                         {name: 3, counter.POSTS: 1})
+
+    def test_rollback_writes_nothing(self):
+        counter.increment(counter.POSTS, 2)
+
+        def rollback():
+            """Put a user and roll back."""
+            User(username='user', password='x').put()
+            raise ndb.Rollback()
+
+        self.assertIsNone(
+            counter.run_with_counters(rollback, {counter.POSTS: 1}))
+        self.assertEqual(counter.get_count(counter.POSTS), 2)
+        self.assertEqual(self.shard_totals([counter.POSTS]),
+                         {counter.POSTS: 2})
+        self.assertEqual(User.query().count(), 0)
+
+
+class RepairCountersTest(CounterTest):
+    """Tests of counter.repair_counters."""
+
+    def setUp(self):
+        super(RepairCountersTest, self).setUp()
+        self.runner = tasks.LocalRunner()
+        tasks.set_runner(self.runner)
+        self.batch_size = counter.REPAIR_BATCH_SIZE
+        counter.REPAIR_BATCH_SIZE = 2
+
+    def tearDown(self):
+        counter.REPAIR_BATCH_SIZE = self.batch_size
+        tasks.set_runner(None)
+        super(RepairCountersTest, self).tearDown()
+
+    def test_totals_are_recounted(self):
+        users = ndb.put_multi([User(username='user%d' % i, password='x')
+                               for i in xrange(2)])
+        posts = ndb.put_multi([Post(user=users[0], subject='subject',
+                                    content='content %d' % i)
+                               for i in xrange(3)])
+        ndb.put_multi([Like(key=Like.make_key(user_key, post_key),
+                            user=user_key, post=post_key)
+                       for user_key in users for post_key in posts[:2]])
+        ndb.put_multi([Comment(user=users[1], post=posts[0],
+                               content='comment %d' % i)
+                       for i in xrange(3)])
+
+        stale = counter.post_likes(ndb.Key(Post, 999))
+        for name, delta in [(counter.POSTS, 5), (stale, 4),
+                            (counter.user_likes(users[0]), -1),
+                            (counter.post_comments(posts[0]), 1)]:
+            counter.increment(name, delta)
+
+        tasks.defer(counter.repair_counters)
+        self.runner.run_all()
+
+        expected = {
+            counter.POSTS: 3,
+            counter.user_posts(users[0]): 3,
+            counter.user_posts(users[1]): 0,
+            counter.user_likes(users[0]): 2,
+            counter.user_likes(users[1]): 2,
+            counter.post_likes(posts[0]): 2,
+            counter.post_likes(posts[1]): 2,
+            counter.post_likes(posts[2]): 0,
+            counter.post_comments(posts[0]): 3,
+            stale: 0,
+        }
+        self.assertEqual(counter.get_counts(expected.keys()), expected)
+        self.assertEqual(self.shard_totals(expected.keys()), expected)
+        self.assertEqual(counter.CounterTally.query().count(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+"""Tests of converting content to html.
+"""
+import unittest
+
+import markup
+
+
+class PlainTextTest(unittest.TestCase):
+    """Tests of plain text content."""
+
+    def test_escapes_html(self):
+        self.assertEqual(markup.to_html('<b>"a" & b</b>'),
+                         '&lt;b&gt;&quot;a&quot; &amp; b&lt;/b&gt;')
+
+    def test_newlines_become_line_breaks(self):
+        self.assertEqual(markup.to_html('a\nb'), 'a<br>b')
+
+
+class SanitizeTest(unittest.TestCase):
+    """Tests of sanitizing html."""
+
+    def test_keeps_allowed_tags(self):
+        html = '<p><em>a</em> <a href="http://example.com/">b</a></p>'
+        self.assertEqual(markup.sanitize(html), html)
+
+    def test_escapes_script(self):
+        self.assertEqual(markup.sanitize('<script>alert(1)</script>'),
+                         '&lt;script&gt;alert(1)')
+
+    def test_drops_event_handlers(self):
+        self.assertEqual(markup.sanitize('<img src="/a.png" onerror="x()">'),
+                         '<img src="/a.png">')
+
+    def test_neutralizes_javascript_url(self):
+        for url in ('javascript:alert(1)', ' javascript:alert(1)',
+                    'JaVaScRiPt:alert(1)', 'javascript&#58;alert(1)',
+                    'data:text/html,x', 'vbscript:x'):
+            self.assertEqual(markup.sanitize('<a href="%s">a</a>' % url),
+                             '<a href="#">a</a>', url)
+
+    def test_escapes_attribute_quotes(self):
+        self.assertEqual(
+            markup.sanitize('<a title="&quot;&gt;" href="/">a</a>'),
+            '<a title="&quot;&gt;" href="/">a</a>')
+
+    def test_escapes_html_the_parser_rejects(self):
+        self.assertEqual(markup.sanitize('<p><![foo[x]]>'),
+                         '&lt;p&gt;&lt;![foo[x]]&gt;')
+
+    def test_closes_open_tags(self):
+        self.assertEqual(markup.sanitize('<blockquote><p>a'),
+                         '<blockquote><p>a</p></blockquote>')
+
+
+@unittest.skipUnless(markup.MARKDOWN_AVAILABLE, 'markdown is not installed')
+class MarkdownTest(unittest.TestCase):
+    """Tests of markdown content."""
+
+    def to_html(self, content):
+        return markup.to_html(content, use_markdown=True)
+
+    def test_code_span_is_escaped_once(self):
+        self.assertEqual(self.to_html('`a < b && c`'),
+                         '<p><code>a &lt; b &amp;&amp; c</code></p>')
+
+    def test_blockquote(self):
+        self.assertEqual(self.to_html('> quoted'),
+                         '<blockquote>\n<p>quoted</p>\n</blockquote>')
+
+    def test_raw_script_is_escaped(self):
+        html = self.to_html('<script>alert(1)</script>')
+        self.assertNotIn('<script', html)
+
+    def test_raw_event_handler_is_dropped(self):
+        html = self.to_html('<img src="/a.png" onerror="alert(1)">')
+        self.assertNotIn('onerror', html)
+
+    def test_javascript_link_is_neutralized(self):
+        self.assertEqual(self.to_html('[a](javascript:alert(1))'),
+                         '<p><a href="#">a</a></p>')
+
+    def test_javascript_image_is_neutralized(self):
+        self.assertEqual(self.to_html('![a](javascript:x)'),
+                         '<p><img alt="a" src="#"></p>')
+
+    def test_http_link_is_kept(self):
+        self.assertEqual(self.to_html('[a](https://example.com/)'),
+                         '<p><a href="https://example.com/">a</a></p>')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,30 @@
+"""Test that entities stored by the old db models load with the ndb models.
+
+It runs the checks of check_ndb_compat.py on the testbed.
+"""
+import unittest
+
+from appengine_sdk import SDK
+import check_ndb_compat
+
+
+@unittest.skipUnless(SDK, 'APPENGINE_SDK is not set')
+class NdbCompatTest(unittest.TestCase):
+    """Tests of loading entities of the old schema."""
+
+    def setUp(self):
+        self.bed = check_ndb_compat.activate_testbed()
+
+    def tearDown(self):
+        self.bed.deactivate()
+
+    def test_legacy_entities_load(self):
+        stored = check_ndb_compat.store_legacy(
+            check_ndb_compat.legacy_models())
+        failed = [name for name, passed in check_ndb_compat.check(stored)
+                  if not passed]
+        self.assertEqual(failed, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+"""Tests of merging recent writes into eventually consistent results.
+
+They need the App Engine SDK on the path.
+"""
+import time
+import unittest
+
+import appengine_sdk # pylint: disable=unused-import
+try:
+    from google.appengine.ext import ndb
+
+    import benchmark
+    from models import recent
+except ImportError:
+    recent = None
+
+if recent:
+    class Item(ndb.Model):
+        """Entity of a list, ordered by rank."""
+        rank = ndb.IntegerProperty()
+
+
+@unittest.skipUnless(recent, 'App Engine SDK is not available')
+class MergeTest(unittest.TestCase):
+    """Tests of recent.merge and merge_entries_async."""
+
+    def setUp(self):
+        self.bed = benchmark.activate_testbed()
+        ndb.get_context().clear_cache()
+        self.items = [Item(rank=rank) for rank in xrange(5)]
+        ndb.put_multi(self.items)
+
+    def tearDown(self):
+        self.bed.deactivate()
+
+    def merge(self, entries, entities, in_range=None):
+        return recent.merge_entries_async(
+            entries, entities, lambda item: item.rank,
+            in_range).get_result()
+
+    def ranks(self, items):
+        return [item.rank for item in items]
+
+    def entry(self, rank, deleted=False, written=None):
+        return (self.items[rank].key.urlsafe(), deleted,
+                time.time() if written is None else written)
+
+    def test_written_entities_are_put_in_order(self):
+        merged = self.merge([self.entry(3), self.entry(1)],
+                            [self.items[4], self.items[2], self.items[0]])
+        self.assertEqual(self.ranks(merged), [4, 3, 2, 1, 0])
+
+    def test_written_entity_in_results_is_not_repeated(self):
+        self.items[2].rank = 5
+        self.items[2].put()
+        merged = self.merge([self.entry(2)],
+                            [self.items[4], self.items[2], self.items[0]])
+        self.assertEqual(self.ranks(merged), [5, 4, 0])
+
+    def test_deleted_entities_are_removed(self):
+        self.items[2].key.delete()
+        merged = self.merge([self.entry(2, deleted=True), self.entry(3)],
+                            [self.items[4], self.items[2], self.items[0]])
+        self.assertEqual(self.ranks(merged), [4, 3, 0])
+
+    def test_written_entities_out_of_range_are_left_out(self):
+        merged = self.merge([self.entry(3), self.entry(1)],
+                            [self.items[4], self.items[2]],
+                            in_range=lambda item: item.rank >= 2)
+        self.assertEqual(self.ranks(merged), [4, 3, 2])
+
+    def test_expired_entries_are_ignored(self):
+        expired = time.time() - recent.WINDOW - 1
+        merged = self.merge([self.entry(3, written=expired),
+                             self.entry(2, deleted=True, written=expired)],
+                            [self.items[4], self.items[2]])
+        self.assertEqual(self.ranks(merged), [4, 2])
+
+    def test_recorded_writes_are_merged(self):
+        self.items[2].key.delete()
+        recent.record(['items'], self.items[3].key)
+        recent.record(['items'], self.items[2].key, deleted=True)
+        merged = recent.merge('items', [self.items[4], self.items[2]],
+                              lambda item: item.rank)
+        self.assertEqual(self.ranks(merged), [4, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+"""Tests of tokenizing, the in process index and ranking of search.
+
+They need the App Engine SDK on the path.
+"""
+import unittest
+
+import appengine_sdk # pylint: disable=unused-import
+try:
+    from models import search
+except ImportError:
+    search = None
+
+
+@unittest.skipUnless(search, 'App Engine SDK is not available')
+class TokenizeTest(unittest.TestCase):
+    """Tests of splitting text into tokens."""
+
+    def test_lowercases_and_drops_stop_words(self):
+        self.assertEqual(search.tokenize(u'The Quick fox, and a Dog!'),
+                         [u'quick', u'fox', u'dog'])
+
+    def test_drops_short_tokens(self):
+        self.assertEqual(search.tokenize(u'x yz'), [u'yz'])
+
+    def test_subject_weighs_more(self):
+        self.assertEqual(search.term_weights(u'fox', u'fox dog'),
+                         {u'fox': search.SUBJECT_WEIGHT + 1, u'dog': 1})
+
+
+@unittest.skipUnless(search, 'App Engine SDK is not available')
+class LocalIndexTest(unittest.TestCase):
+    """Tests of the in process index."""
+
+    def setUp(self):
+        self.index = search.LocalIndex()
+
+    def test_update_replaces_tokens(self):
+        self.index.update(1, {u'fox': 1, u'dog': 2})
+        self.index.update(1, {u'fox': 3})
+        self.assertEqual(self.index.lookup([u'fox', u'dog']),
+                         {u'fox': {1: 3}, u'dog': {}})
+        self.assertEqual(self.index.size(), 1)
+
+    def test_update_with_no_tokens_removes_post(self):
+        self.index.update(1, {u'fox': 1})
+        self.index.update(2, {u'fox': 1})
+        self.index.update(1, {})
+        self.assertEqual(self.index.lookup([u'fox']), {u'fox': {2: 1}})
+        self.assertEqual(self.index.size(), 1)
+
+
+@unittest.skipUnless(search, 'App Engine SDK is not available')
+class SearchTest(unittest.TestCase):
+    """Tests of ranking with the in process index."""
+
+    def setUp(self):
+        self.index = search.LocalIndex()
+        self.old_index = search._index # pylint: disable=protected-access
+        search.set_index(self.index)
+
+    def tearDown(self):
+        search.set_index(self.old_index)
+
+    def index_post(self, post_id, subject, content):
+        self.index.update(post_id, search.term_weights(subject, content))
+
+    def test_no_tokens(self):
+        results = search.search(u'the and')
+        self.assertEqual((results.post_ids, results.total), ([], 0))
+
+    def test_more_matched_tokens_rank_first(self):
+        self.index_post(1, u'fox', u'fox fox fox fox')
+        self.index_post(2, u'note', u'quick fox')
+        self.assertEqual(search.search(u'quick fox').post_ids, [2, 1])
+
+    def test_higher_weight_ranks_first(self):
+        self.index_post(1, u'note', u'fox')
+        self.index_post(2, u'fox', u'fox')
+        self.index_post(3, u'note', u'dog')
+        self.assertEqual(search.search(u'fox').post_ids, [2, 1])
+
+    def test_only_first_query_tokens_are_used(self):
+        self.index_post(1, u'fox', u'')
+        self.index_post(2, u'dog', u'')
+        words = [u'w%d' % i for i in xrange(search.MAX_QUERY_TOKENS - 1)]
+        query = u' '.join([u'fox', u'fox'] + words + [u'dog'])
+        self.assertEqual(search.search(query).post_ids, [1])
+
+    def test_total_is_not_limited(self):
+        for post_id in xrange(1, 6):
+            self.index_post(post_id, u'fox', u'')
+        results = search.search(u'fox', limit=2)
+        self.assertEqual(len(results.post_ids), 2)
+        self.assertEqual(results.total, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()